@@ -0,0 +1,97 @@
+"""
+Compare the latency of GET /calls/ opening a database connection per request
+against reusing persistent connections.
+
+Requests are sent by concurrent threads, each one with its own connection,
+like the workers of the application server. Differences only show with a
+database server, eg. PostgreSQL with CD_DB_ENGINE=postgresql_psycopg2 and the
+CD_DB_* variables: connections of SQLite in-memory test databases are never
+closed.
+
+Usage: python -m benchmarks.bench_bill_load [requests] [threads] [subscribers]
+"""
+
+from datetime import datetime, timedelta, timezone
+import sys
+import threading
+import time
+
+from benchmarks.utils import report_latency, setup_django, test_database
+
+# Seconds persistent connections are kept open, longer than the benchmark
+CONN_MAX_AGE = 600
+
+
+def create_calls(subscribers, calls_per_subscriber=50):
+    """Create completed calls of a closed period for each subscriber."""
+    from core.models import CallDetail
+
+    first_start = datetime(2019, 9, 1, 8, 0, tzinfo=timezone.utc)
+    calls = []
+    for subscriber in range(subscribers):
+        for day in range(calls_per_subscriber):
+            started_at = first_start + timedelta(days=day % 28, minutes=day)
+            calls.append(CallDetail(
+                call_id=len(calls) + 1, source=str(2200000000 + subscriber),
+                destination='3312345678', duration=585, price=117,
+                reference_period=started_at.strftime('%m/%Y'),
+                started_at=started_at,
+                ended_at=started_at + timedelta(seconds=585),
+                is_completed=True))
+    CallDetail.objects.bulk_create(calls)
+
+
+def send_requests(numbers, count, latencies):
+    """Send count bill requests, storing their latencies in seconds."""
+    from django.db import connections
+    from django.test import Client
+
+    client = Client()
+    try:
+        for i in range(count):
+            number = numbers[i % len(numbers)]
+            start = time.perf_counter()
+            response = client.get(
+                '/calls/', {'number': number, 'period': '09/2019'})
+            latencies.append(time.perf_counter() - start)
+            assert response.status_code == 200
+    finally:
+        connections.close_all()
+
+
+def run(numbers, requests, threads):
+    """Send the requests from concurrent threads, returning the latencies."""
+    latencies = []
+    workers = [
+        threading.Thread(target=send_requests,
+                         args=(numbers, requests // threads, latencies))
+        for _ in range(threads)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return latencies
+
+
+def main(requests=2000, threads=4, subscribers=100):
+    setup_django()
+
+    from django.db import connection
+
+    with test_database():
+        create_calls(subscribers)
+        numbers = [str(2200000000 + i) for i in range(subscribers)]
+
+        # Render the bills once, requests are served from the bill cache
+        run(numbers, len(numbers), 1)
+
+        for name, max_age in (('GET /calls/ connection/request', 0),
+                              ('GET /calls/ persistent', CONN_MAX_AGE)):
+            # Shared by the connections of every thread
+            connection.settings_dict['CONN_MAX_AGE'] = max_age
+            report_latency(name, run(numbers, requests, threads))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,65 @@
+"""
+Compare calls/second rendering a large bill from model instances against
+rendering it from the rows of the rendered columns.
+
+Usage: python -m benchmarks.bench_bill_render [number of calls]
+"""
+
+import json
+import sys
+
+from benchmarks.cdrs import (
+    generate_calls, make_call_details, subscriber_number)
+from benchmarks.utils import report, setup_django, test_database, timer
+
+
+def main(count=100000):
+    setup_django()
+
+    from django.conf import settings
+    from rest_framework.test import APIClient
+    from core.models import CallDetail, MonthlyBill
+    from core.serializers import MonthlyBillSerializer, render_call_records
+
+    settings.METRICS_SAMPLE_RATE = 0
+
+    with test_database():
+        # A single subscriber, with every call in the billed period
+        calls = [call for call in generate_calls(1, count)
+                 if call[4].month == 9]
+        CallDetail.objects.bulk_create(make_call_details(calls))
+        number = subscriber_number(0)
+        bill = CallDetail.objects.bill(number, '09/2019')
+
+        with timer({}) as result:
+            expected = MonthlyBillSerializer(bill.all(), many=True).data
+        report('MonthlyBillSerializer', len(calls), result['seconds'],
+               unit='calls')
+
+        with timer({}) as result:
+            call_records = render_call_records(bill.all())
+        report('render_call_records', len(calls), result['seconds'],
+               unit='calls')
+        assert call_records == expected
+
+        client = APIClient()
+        params = {'number': number, 'period': '09/2019'}
+
+        MonthlyBill.objects.all().delete()
+        with timer({}) as result:
+            response = client.get('/calls/', params)
+        report('GET /calls/ uncached', len(calls), result['seconds'],
+               unit='calls')
+        assert len(response.data['call_records']) == len(calls)
+
+        MonthlyBill.objects.all().delete()
+        with timer({}) as result:
+            response = client.get('/calls/', dict(params, stream='true'))
+            content = b''.join(response.streaming_content)
+        report('GET /calls/ streamed', len(calls), result['seconds'],
+               unit='calls')
+        assert len(json.loads(content)['call_records']) == len(calls)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
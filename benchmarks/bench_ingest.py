@@ -0,0 +1,58 @@
+"""
+Compare records/second of single record POST against batch ingestion.
+
+Usage: python -m benchmarks.bench_ingest [number of calls] [batch size]
+"""
+
+import sys
+
+from benchmarks.utils import report, setup_django, test_database, timer
+
+
+def make_records(count, first_call_id=1):
+    """Build Start and End Call Records for count calls."""
+    records = []
+    for call_id in range(first_call_id, first_call_id + count):
+        records.append({
+            'call_id': call_id,
+            'type': 'start',
+            'timestamp': '2019-09-13T08:30:15Z',
+            'source': '2212345678',
+            'destination': '3312345678',
+        })
+        records.append({
+            'call_id': call_id,
+            'type': 'end',
+            'timestamp': '2019-09-13T08:40:00Z',
+        })
+    return records
+
+
+def main(count=1000, batch_size=1000):
+    setup_django()
+
+    from rest_framework.test import APIClient
+    from core.models import CallDetail
+
+    with test_database():
+        client = APIClient()
+
+        records = make_records(count)
+        with timer({}) as result:
+            for record in records:
+                client.post('/calls/', record, format='json')
+        report('single POST /calls/', len(records), result['seconds'])
+        assert CallDetail.objects.filter(is_completed=True).count() == count
+
+        records = make_records(count, first_call_id=count + 1)
+        with timer({}) as result:
+            for i in range(0, len(records), batch_size):
+                client.post('/calls/batch/', records[i:i + batch_size],
+                            format='json')
+        report('batch POST /calls/batch/', len(records), result['seconds'])
+        assert CallDetail.objects.filter(
+            is_completed=True).count() == 2 * count
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,51 @@
+"""
+Compare calls priced per second by get_price and the batch get_prices.
+
+Usage: python -m benchmarks.bench_pricing [number of calls]
+"""
+
+from datetime import datetime, timedelta, timezone
+import random
+import sys
+
+from benchmarks.utils import report, timer
+from core.pricing import get_prices, to_epoch_seconds
+from core.utils import get_price
+
+
+def make_calls(count, seed=0):
+    """Build random calls of up to 2 hours along one month."""
+    generator = random.Random(seed)
+    first_start = datetime(2019, 9, 1, tzinfo=timezone.utc)
+
+    calls = []
+    for _ in range(count):
+        start = first_start + timedelta(
+            seconds=generator.randrange(29 * 24 * 60 * 60))
+        end = start + timedelta(seconds=generator.randrange(2 * 60 * 60))
+        calls.append((start, end))
+    return calls
+
+
+def main(count=100000):
+    calls = make_calls(count)
+
+    with timer({}) as result:
+        expected = [get_price(start, end) for start, end in calls]
+    report('get_price', count, result['seconds'], unit='calls')
+
+    starts, ends = zip(*calls)
+    with timer({}) as result:
+        started_at = to_epoch_seconds(starts)
+        ended_at = to_epoch_seconds(ends)
+    report('to_epoch_seconds', count, result['seconds'], unit='calls')
+
+    with timer({}) as result:
+        prices = get_prices(started_at, ended_at)
+    report('get_prices', count, result['seconds'], unit='calls')
+
+    assert prices.tolist() == expected
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
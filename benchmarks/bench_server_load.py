@@ -0,0 +1,182 @@
+"""
+Compare the capacity of the WSGI (gunicorn sync workers) and ASGI (uvicorn,
+one process with a pool of threads) servers under concurrent connections.
+
+Both servers run against the same SQLite database file, filled with the
+calls of the subscribers, and serve streamed bills, rendered on each
+request. Throughput, latencies and the peak memory (RSS) of each server are
+reported. Unless a number of WSGI workers is given, the WSGI server runs as
+many workers as fit in the peak memory of the ASGI server, to compare them
+at equal memory.
+
+Usage: python -m benchmarks.bench_server_load [connections] [requests]
+    [wsgi workers, 0 for equal memory] [asgi threads]
+"""
+
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.bench_bill_load import create_calls
+from benchmarks.utils import percentile, setup_django
+
+HOST = '127.0.0.1'
+PORT = 8765
+SUBSCRIBERS = 20
+CALLS_PER_SUBSCRIBER = 500
+
+
+def process_tree(pid):
+    """Return the pid and the pids of the descendants of a process."""
+    pids = [pid]
+    for task in os.listdir('/proc/{}/task'.format(pid)):
+        with open('/proc/{}/task/{}/children'.format(pid, task)) as children:
+            for child in children.read().split():
+                pids.extend(process_tree(int(child)))
+    return pids
+
+
+def rss(pids):
+    """Return the peak resident memory, in MiB, of the processes."""
+    total = 0
+    for pid in pids:
+        with open('/proc/{}/status'.format(pid)) as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    total += int(line.split()[1])
+    return total / 1024
+
+
+async def fetch(path):
+    """Send a GET request, returning if the response status is 200."""
+    reader, writer = await asyncio.open_connection(HOST, PORT)
+    writer.write('GET {} HTTP/1.1\r\nHost: {}\r\nConnection: close\r\n\r\n'
+                 .format(path, HOST).encode())
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    return response.split(b' ', 2)[1] == b'200'
+
+
+async def load(connections, requests):
+    """Send the requests over concurrent connections, returning latencies."""
+    latencies = []
+    errors = []
+    paths = ['/calls/?number={}&period=09/2019&stream=true'.format(
+        2200000000 + i) for i in range(SUBSCRIBERS)]
+
+    async def client(index):
+        for i in range(index, requests, connections):
+            start = time.perf_counter()
+            try:
+                ok = await fetch(paths[i % len(paths)])
+            except OSError:
+                ok = False
+            latencies.append(time.perf_counter() - start)
+            if not ok:
+                errors.append(i)
+
+    await asyncio.gather(*[client(index) for index in range(connections)])
+    return latencies, errors
+
+
+def wait_for_server(server):
+    for _ in range(100):
+        if server.poll() is not None:
+            raise RuntimeError('Server exited with {}'.format(server.returncode))
+        try:
+            asyncio.run(fetch('/calls/?number=2200000000&period=09/2019'))
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError('Server did not start')
+
+
+def start_server(command, env):
+    server = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL,
+                              stderr=subprocess.DEVNULL)
+    try:
+        wait_for_server(server)
+    except Exception:
+        stop_server(server)
+        raise
+    return server
+
+
+def stop_server(server):
+    server.terminate()
+    server.wait()
+
+
+def bench(name, command, env, connections, requests):
+    """Run the load against a server, returning its peak memory in MiB."""
+    server = start_server(command, env)
+    try:
+        start = time.perf_counter()
+        latencies, errors = asyncio.run(load(connections, requests))
+        seconds = time.perf_counter() - start
+        memory = rss(process_tree(server.pid))
+
+        print('{:<32} {:>6.1f} requests/s  p50 {:>8.2f}ms  p99 {:>8.2f}ms  '
+              '{} errors  {:>6.1f} MiB'.format(
+                  name, len(latencies) / seconds,
+                  percentile(latencies, 50) * 1000,
+                  percentile(latencies, 99) * 1000, len(errors), memory))
+    finally:
+        stop_server(server)
+    return memory
+
+
+def wsgi_command(workers):
+    return ['gunicorn', 'calldetails.wsgi', '--workers', str(workers),
+            '--bind', '{}:{}'.format(HOST, PORT)]
+
+
+def equal_memory_workers(env, memory):
+    """
+    Return the number of WSGI workers fitting in the memory, in MiB, from
+    the memory of the master and of a worker after serving some bills.
+    """
+    server = start_server(wsgi_command(1), env)
+    try:
+        asyncio.run(load(1, SUBSCRIBERS))
+        master = rss([server.pid])
+        worker = rss(process_tree(server.pid)) - master
+    finally:
+        stop_server(server)
+    return max(1, int((memory - master) // worker))
+
+
+def main(connections=64, requests=1000, wsgi_workers=0, asgi_threads=16):
+    directory = tempfile.mkdtemp()
+    os.environ['CD_DB_NAME'] = os.path.join(directory, 'bench.sqlite3')
+    setup_django()
+
+    from django.core.management import call_command
+
+    call_command('migrate', verbosity=0)
+    create_calls(SUBSCRIBERS, CALLS_PER_SUBSCRIBER)
+
+    env = dict(os.environ, CD_ASGI_THREADS=str(asgi_threads))
+    memory = bench('ASGI {} threads'.format(asgi_threads),
+                   ['uvicorn', 'calldetails.asgi:application', '--host', HOST,
+                    '--port', str(PORT), '--loop', 'asyncio', '--http', 'h11',
+                    '--no-access-log'],
+                   env, connections, requests)
+
+    name = 'WSGI {} workers'
+    if not wsgi_workers:
+        wsgi_workers = equal_memory_workers(env, memory)
+        name += ', equal memory'
+    bench(name.format(wsgi_workers), wsgi_command(wsgi_workers), env,
+          connections, requests)
+
+    os.remove(os.environ['CD_DB_NAME'])
+    os.rmdir(directory)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,82 @@
+"""
+Compare records validated per second before and after the fast validator.
+
+The "before" validator is the previous CallDetailSerializer validation: it
+stops at the first error, parses timestamps with strptime and matches phone
+numbers with regular expressions compiled on each call.
+
+Usage: python -m benchmarks.bench_validation [number of records]
+"""
+
+from datetime import datetime, timezone
+import re
+import sys
+
+from benchmarks.bench_ingest import make_records
+from benchmarks.utils import report, setup_django, timer
+
+
+def strptime_validate(data):
+    """Validation of a record as done before the fast validator."""
+    call_id = data.get("call_id")
+    call_type = data.get("type")
+    timestamp = data.get("timestamp")
+    source = data.get("source")
+    destination = data.get("destination")
+
+    if not call_id or not call_type or not timestamp:
+        return None
+    if call_type == "start" and (not source or not destination):
+        return None
+    if not isinstance(timestamp, str) or not isinstance(call_id, int):
+        return None
+    if call_type == "start" and not (
+            isinstance(source, str) and isinstance(destination, str)):
+        return None
+    if call_type not in ["start", "end"]:
+        return None
+
+    try:
+        date = datetime.strptime(timestamp, "%Y-%m-%dT%H:%M:%SZ")
+        date = date.replace(tzinfo=timezone.utc)
+    except ValueError:
+        return None
+
+    if call_type == "start":
+        if not re.match(r"^\d{10}$|^\d{11}$", source):
+            return None
+        if not re.match(r"^\d{10}$|^\d{11}$", destination):
+            return None
+        return {'call_id': call_id, 'source': source,
+                'destination': destination, 'started_at': date}
+
+    return {'call_id': call_id, 'ended_at': date,
+            'reference_period': date.strftime("%m/%Y")}
+
+
+def main(count=100000):
+    setup_django()
+
+    from core.serializers import CallDetailSerializer
+    from core.validators import validate_call_record
+
+    records = make_records(count // 2)
+
+    with timer({}) as result:
+        for record in records:
+            strptime_validate(record)
+    report('before: strptime and re.match', len(records), result['seconds'])
+
+    with timer({}) as result:
+        for record in records:
+            validate_call_record(record)
+    report('after: validate_call_record', len(records), result['seconds'])
+
+    with timer({}) as result:
+        for record in records:
+            CallDetailSerializer(data=record).is_valid()
+    report('after: CallDetailSerializer', len(records), result['seconds'])
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
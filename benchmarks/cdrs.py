@@ -0,0 +1,115 @@
+"""
+Synthetic, reproducible call detail records for the benchmarks.
+
+Calls of a month are spread over a number of subscribers, part of them at
+night, in the reduced tariff time, and their Start and End records arrive
+in timestamp order, except for a part of the calls whose End record arrives
+before the Start one.
+"""
+
+from datetime import datetime, timedelta, timezone
+import random
+
+from core.utils import get_price
+
+# Reduced tariff time, from 22h00 to 6h00, in seconds of the day
+NIGHT_START = 22 * 60 * 60
+NIGHT_SECONDS = 8 * 60 * 60
+DAY_START = 6 * 60 * 60
+DAY_SECONDS = 16 * 60 * 60
+
+# Average call duration, in seconds, and the longest call
+MEAN_DURATION = 180
+MAX_DURATION = 2 * 60 * 60
+
+
+def subscriber_number(subscriber):
+    return str(2200000000 + subscriber)
+
+
+def generate_calls(subscribers, calls_per_month, year=2019, month=9,
+                   night_ratio=0.2, seed=0, first_call_id=1,
+                   first_subscriber=0):
+    """
+    Yield (call_id, source, destination, started_at, ended_at) of each call,
+    calls_per_month of each subscriber, ordered by call_id.
+
+    night_ratio of the calls start in the reduced tariff time, durations
+    follow an exponential distribution and calls may end in the next month.
+    """
+    generator = random.Random(seed)
+    first_day = datetime(year, month, 1, tzinfo=timezone.utc)
+    days = ((first_day + timedelta(days=31)).replace(day=1) - first_day).days
+
+    call_id = first_call_id - 1
+    for subscriber in range(first_subscriber, first_subscriber + subscribers):
+        source = subscriber_number(subscriber)
+        for _ in range(calls_per_month):
+            call_id += 1
+            if generator.random() < night_ratio:
+                second = NIGHT_START + generator.randrange(NIGHT_SECONDS)
+            else:
+                second = DAY_START + generator.randrange(DAY_SECONDS)
+            started_at = first_day + timedelta(
+                days=generator.randrange(days), seconds=second)
+            duration = min(
+                MAX_DURATION,
+                1 + int(generator.expovariate(1 / MEAN_DURATION)))
+            destination = str(3300000000 + generator.randrange(1000))
+
+            yield (call_id, source, destination, started_at,
+                   started_at + timedelta(seconds=duration))
+
+
+def format_timestamp(value):
+    return value.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def generate_records(calls, out_of_order_ratio=0.1, seed=0):
+    """
+    Return the Start and End records of the calls, in arrival order.
+
+    Records arrive in timestamp order, except for out_of_order_ratio of the
+    calls, whose End record arrives just before the Start one.
+    """
+    generator = random.Random(seed)
+
+    arrivals = []
+    for call_id, source, destination, started_at, ended_at in calls:
+        start = {
+            'call_id': call_id,
+            'type': 'start',
+            'timestamp': format_timestamp(started_at),
+            'source': source,
+            'destination': destination,
+        }
+        end = {
+            'call_id': call_id,
+            'type': 'end',
+            'timestamp': format_timestamp(ended_at),
+        }
+        if generator.random() < out_of_order_ratio:
+            arrivals.append((started_at, call_id, 0, end))
+            arrivals.append((started_at, call_id, 1, start))
+        else:
+            arrivals.append((started_at, call_id, 0, start))
+            arrivals.append((ended_at, call_id, 1, end))
+
+    arrivals.sort(key=lambda arrival: arrival[:3])
+    return [record for _, _, _, record in arrivals]
+
+
+def make_call_details(calls):
+    """Build the completed CallDetails of the calls, priced, without saving."""
+    from core.models import CallDetail
+
+    return [
+        CallDetail(
+            call_id=call_id, source=source, destination=destination,
+            started_at=started_at, ended_at=ended_at,
+            duration=int((ended_at - started_at).total_seconds()),
+            price=get_price(started_at, ended_at),
+            reference_period=ended_at.strftime('%m/%Y'),
+            is_completed=True)
+        for call_id, source, destination, started_at, ended_at in calls
+    ]
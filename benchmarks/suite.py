@@ -0,0 +1,287 @@
+"""
+Run the ingestion, billing and pricing benchmarks on synthetic call records
+and write the results as JSON, to compare them across commits.
+
+The records are generated from a fixed seed, so every run measures the same
+workload. Benchmarks run against a throwaway test database of the configured
+engine: SQLite by default, or eg. a local PostgreSQL with
+CD_DB_ENGINE=postgresql_psycopg2 and the CD_DB_* variables.
+
+Usage: python -m benchmarks.suite [--output results.json] [options]
+       python -m benchmarks.suite --compare old.json new.json
+"""
+
+import argparse
+from contextlib import redirect_stdout
+from datetime import datetime, timezone
+import json
+import math
+import platform
+import subprocess
+import sys
+
+from benchmarks.cdrs import (
+    generate_calls, generate_records, make_call_details, subscriber_number)
+from benchmarks.utils import (
+    percentile, report, report_latency, setup_django, test_database, timer)
+
+BENCHMARKS = ('get_price', 'ingest_single', 'ingest_batch', 'bill_get')
+
+
+def result(name, count, seconds, unit, latencies=None, **extra):
+    """Build a benchmark result, with p50/p99 latencies in milliseconds."""
+    data = {
+        'name': name,
+        'count': count,
+        'unit': unit,
+        'seconds': round(seconds, 6),
+        'rate': round(count / seconds, 3) if seconds else None,
+    }
+    if latencies:
+        data['p50_ms'] = round(percentile(latencies, 50) * 1000, 3)
+        data['p99_ms'] = round(percentile(latencies, 99) * 1000, 3)
+    data.update(extra)
+
+    report(name, count, seconds, unit=unit)
+    if latencies:
+        report_latency(name, latencies)
+    return data
+
+
+def workload(args, calls, seed, **kwargs):
+    """Generate calls of the subscribers needed for the number of calls."""
+    subscribers = math.ceil(calls / args.calls_per_month)
+    return list(generate_calls(
+        subscribers, args.calls_per_month, night_ratio=args.night_ratio,
+        seed=seed, **kwargs))[:calls]
+
+
+def bench_get_price(args):
+    from core.pricing import get_prices, to_epoch_seconds
+    from core.utils import get_price
+
+    calls = workload(args, args.price_calls, args.seed)
+
+    with timer({}) as elapsed:
+        expected = [get_price(call[3], call[4]) for call in calls]
+    yield result('get_price', len(calls), elapsed['seconds'], 'calls')
+
+    with timer({}) as elapsed:
+        prices = get_prices(to_epoch_seconds(call[3] for call in calls),
+                            to_epoch_seconds(call[4] for call in calls))
+    yield result('get_prices', len(calls), elapsed['seconds'], 'calls')
+
+    assert prices.tolist() == expected
+
+
+def post_records(client, url, batches):
+    """POST each batch, returning the elapsed seconds and the latencies."""
+    latencies = []
+    with timer({}) as elapsed:
+        for batch in batches:
+            with timer({}) as request:
+                response = client.post(url, batch, format='json')
+            latencies.append(request['seconds'])
+            assert response.status_code in (200, 204), response.content
+    return elapsed['seconds'], latencies
+
+
+def bench_ingest_single(args):
+    from rest_framework.test import APIClient
+
+    records = generate_records(
+        workload(args, args.single_calls, args.seed),
+        args.out_of_order_ratio, args.seed)
+
+    seconds, latencies = post_records(APIClient(), '/calls/', records)
+    yield result('ingest_single', len(records), seconds, 'records',
+                 latencies)
+
+
+def bench_ingest_batch(args):
+    from rest_framework.test import APIClient
+
+    # Calls of other subscribers than the single record ingestion
+    records = generate_records(
+        workload(args, args.batch_calls, args.seed + 1,
+                 first_call_id=args.single_calls + 1,
+                 first_subscriber=args.single_calls),
+        args.out_of_order_ratio, args.seed + 1)
+    batches = [records[i:i + args.batch_size]
+               for i in range(0, len(records), args.batch_size)]
+
+    seconds, latencies = post_records(APIClient(), '/calls/batch/', batches)
+    yield result('ingest_batch', len(records), seconds, 'records', latencies,
+                 batch_size=args.batch_size)
+
+
+def get_bill(client, number):
+    with timer({}) as request:
+        response = client.get(
+            '/calls/', {'number': number, 'period': '09/2019'})
+    assert response.status_code == 200, response.content
+    return request['seconds'], len(response.data['call_records'])
+
+
+def bench_bill_get(args):
+    from rest_framework.test import APIClient
+    from core.models import CallDetail, MonthlyBill
+
+    client = APIClient()
+    first_call_id = 10 ** 9
+    for index, size in enumerate(args.bill_sizes):
+        # A subscriber of its own for each bill size, all calls in September
+        subscriber = 10 ** 6 + index
+        calls = [
+            call for call in generate_calls(
+                1, size, night_ratio=args.night_ratio, seed=args.seed,
+                first_call_id=first_call_id, first_subscriber=subscriber)
+            if call[4].month == 9]
+        CallDetail.objects.bulk_create(make_call_details(calls))
+        first_call_id += size
+        number = subscriber_number(subscriber)
+
+        latencies = []
+        for _ in range(args.repeat):
+            MonthlyBill.objects.filter(number=number).delete()
+            seconds, count = get_bill(client, number)
+            latencies.append(seconds)
+        yield result('bill_get_{}'.format(size), len(latencies),
+                     sum(latencies), 'requests', latencies, calls=count)
+
+        latencies = [get_bill(client, number)[0] for _ in range(args.repeat)]
+        yield result('bill_get_{}_cached'.format(size), len(latencies),
+                     sum(latencies), 'requests', latencies, calls=count)
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL,
+            universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def database_version(connection):
+    if connection.vendor == 'sqlite':
+        return connection.Database.sqlite_version
+    if connection.vendor == 'postgresql':
+        return connection.pg_version
+    return None
+
+
+def run(args):
+    setup_django()
+
+    import django
+    from django.conf import settings
+
+    # Measure the requests alone, without sampling them for /metrics
+    settings.METRICS_SAMPLE_RATE = 0
+    settings.INGEST_QUEUE = False
+
+    functions = {
+        'get_price': bench_get_price,
+        'ingest_single': bench_ingest_single,
+        'ingest_batch': bench_ingest_batch,
+        'bill_get': bench_bill_get,
+    }
+    results = []
+    with test_database() as connection:
+        database = {
+            'vendor': connection.vendor,
+            'version': database_version(connection),
+        }
+        for name in args.only or BENCHMARKS:
+            results.extend(functions[name](args))
+
+    parameters = vars(args).copy()
+    del parameters['output'], parameters['compare'], parameters['only']
+    return {
+        'commit': git_commit(),
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'database': database,
+        'parameters': parameters,
+        'results': results,
+    }
+
+
+def compare(old_path, new_path):
+    """Print the change of rate and latencies between two result files."""
+    with open(old_path) as old_file, open(new_path) as new_file:
+        old, new = json.load(old_file), json.load(new_file)
+
+    old_results = {data['name']: data for data in old['results']}
+    print('{:<28} {:>14} {:>14} {:>8}'.format('benchmark', 'old', 'new', ''))
+    for data in new['results']:
+        previous = old_results.get(data['name'])
+        if previous is None:
+            continue
+        key = 'p50_ms' if 'p50_ms' in data else 'rate'
+        change = (data[key] - previous[key]) / previous[key] * 100
+        # Positive changes are faster, for both rates and latencies
+        if key == 'p50_ms':
+            change = -change
+        print('{:<28} {:>14.3f} {:>14.3f} {:>+7.1f}%  {}'.format(
+            data['name'], previous[key], data[key], change, key))
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        prog='python -m benchmarks.suite', description=__doc__.split('\n')[1])
+    parser.add_argument(
+        '--output', default='-',
+        help='File to write the JSON results to, standard output by default.')
+    parser.add_argument(
+        '--compare', nargs=2, metavar=('OLD', 'NEW'),
+        help='Compare two result files instead of running the benchmarks.')
+    parser.add_argument(
+        '--only', nargs='+', choices=BENCHMARKS,
+        help='Benchmarks to run, all of them by default.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument(
+        '--calls-per-month', type=int, default=50,
+        help='Calls of each subscriber in the generated month.')
+    parser.add_argument(
+        '--night-ratio', type=float, default=0.2,
+        help='Fraction of calls starting in the reduced tariff time.')
+    parser.add_argument(
+        '--out-of-order-ratio', type=float, default=0.1,
+        help='Fraction of calls whose End record arrives before the Start.')
+    parser.add_argument('--price-calls', type=int, default=100000)
+    parser.add_argument('--single-calls', type=int, default=500)
+    parser.add_argument('--batch-calls', type=int, default=10000)
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument(
+        '--bill-sizes', type=lambda value: [int(x) for x in value.split(',')],
+        default=[10, 100, 1000, 10000],
+        help='Calls in each bill, comma separated.')
+    parser.add_argument(
+        '--repeat', type=int, default=5,
+        help='Requests of each bill, uncached and cached.')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    # Progress goes to standard error, keeping the JSON apart
+    with redirect_stdout(sys.stderr):
+        results = run(args)
+
+    content = json.dumps(results, indent=2) + '\n'
+    if args.output == '-':
+        sys.stdout.write(content)
+    else:
+        with open(args.output, 'w') as output_file:
+            output_file.write(content)
+
+
+if __name__ == '__main__':
+    main()
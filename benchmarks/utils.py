@@ -0,0 +1,60 @@
+"""Helpers shared by the benchmark scripts."""
+
+from contextlib import contextmanager
+import math
+import os
+import time
+
+import django
+
+
+def setup_django():
+    """Configure Django so benchmarks can be run as plain scripts."""
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'calldetails.settings')
+    django.setup()
+
+
+@contextmanager
+def test_database():
+    """Create a throwaway test database, like the test runner does."""
+    from django.db import connection
+    from django.test.utils import (
+        setup_test_environment, teardown_test_environment)
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        yield connection
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+
+@contextmanager
+def timer(result):
+    """Store the elapsed wall time in seconds in result['seconds']."""
+    start = time.perf_counter()
+    try:
+        yield result
+    finally:
+        result['seconds'] = time.perf_counter() - start
+
+
+def report(name, count, seconds, unit='records'):
+    """Print a benchmark result line."""
+    rate = count / seconds if seconds else float('inf')
+    print('{:<32} {:>10} {} in {:>8.3f}s  {:>12.1f} {}/s'.format(
+        name, count, unit, seconds, rate, unit))
+
+
+def percentile(values, percent):
+    """Return the percentile of the values, by the nearest rank method."""
+    values = sorted(values)
+    return values[max(0, math.ceil(percent / 100 * len(values)) - 1)]
+
+
+def report_latency(name, latencies):
+    """Print the p50 and p99 latencies, in milliseconds, of requests."""
+    print('{:<32} {:>10} requests  p50 {:>8.2f}ms  p99 {:>8.2f}ms'.format(
+        name, len(latencies), percentile(latencies, 50) * 1000,
+        percentile(latencies, 99) * 1000))
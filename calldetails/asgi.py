@@ -0,0 +1,18 @@
+"""
+ASGI config for calldetails project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+Django 2.2 has no ASGI support, the WSGI application is served by
+core.asgi.ASGIHandler, running requests in a pool of threads.
+"""
+
+import os
+
+from django.conf import settings
+from django.core.wsgi import get_wsgi_application
+
+from core.asgi import ASGIHandler
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'calldetails.settings')
+
+application = ASGIHandler(get_wsgi_application(), settings.ASGI_THREADS)
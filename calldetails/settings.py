@@ -34,6 +34,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -41,6 +42,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'core.profiling.ProfilingMiddleware',
 ]
 
 ROOT_URLCONF = 'calldetails.urls'
@@ -63,6 +65,10 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'calldetails.wsgi.application'
 
+# Threads running the requests of each ASGI server process, each one with its
+# own database connection
+ASGI_THREADS = int(os.environ.get('CD_ASGI_THREADS', 16))
+
 
 # Database
 db_engine = os.environ.get('CD_DB_ENGINE')
@@ -70,7 +76,8 @@ db_engine = os.environ.get('CD_DB_ENGINE')
 if not db_engine or (db_engine == 'sqlite3'):
     db_config = {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        'NAME': os.environ.get(
+            'CD_DB_NAME', os.path.join(BASE_DIR, 'db.sqlite3')),
     }
 else:
     db_config = {
@@ -86,6 +93,70 @@ DATABASES = {
     'default': db_config
 }
 
+# Partition the calls by reference period in PostgreSQL 11+. It must be set
+# before running the migrations, and partitions of next months created with
+# the create_partition command
+CALL_DETAIL_PARTITIONS = os.environ.get('CD_CALL_DETAIL_PARTITIONS') == 'true'
+
+
+# Seconds a worker keeps its compiled tariff lookup before reloading it
+TARIFF_LOOKUP_TTL = int(os.environ.get('CD_TARIFF_LOOKUP_TTL', 60))
+
+
+# Number of calls fetched and rendered at once in streamed bills
+BILL_STREAM_CHUNK_SIZE = int(os.environ.get('CD_BILL_STREAM_CHUNK_SIZE', 2000))
+
+
+# Maximum number of calls in a page of a paginated bill
+BILL_PAGE_MAX_LIMIT = int(os.environ.get('CD_BILL_PAGE_MAX_LIMIT', 1000))
+
+
+# Queue the call records to be saved by the process_queue command, instead of
+# saving them within the request
+INGEST_QUEUE = os.environ.get('CD_INGEST_QUEUE') == 'true'
+# Maximum number of queued records saved at once by process_queue
+INGEST_BATCH_SIZE = int(os.environ.get('CD_INGEST_BATCH_SIZE', 1000))
+# Seconds process_queue waits for more records when there isn't a full batch
+INGEST_FLUSH_INTERVAL = float(os.environ.get('CD_INGEST_FLUSH_INTERVAL', 1))
+
+# KiB of memory used by import_cdrs to cache the unmatched call record halves,
+# the remaining ones are kept on disk
+IMPORT_SPILL_CACHE_SIZE = int(
+    os.environ.get('CD_IMPORT_SPILL_CACHE_SIZE', 2048))
+
+# Directory of the Parquet files of the archived periods, or the URI of a
+# shared storage, eg. s3://bucket/archive
+ARCHIVE_DIR = os.environ.get('CD_ARCHIVE_DIR', os.path.join(BASE_DIR, 'archive'))
+
+
+# Fraction of the requests whose latency, stages and database queries are
+# recorded and exposed in /metrics, 0 to record none
+METRICS_SAMPLE_RATE = float(os.environ.get('CD_METRICS_SAMPLE_RATE', 0.1))
+# Seconds between the saves of the metrics of each process to the database,
+# where /metrics sums them
+METRICS_FLUSH_INTERVAL = float(
+    os.environ.get('CD_METRICS_FLUSH_INTERVAL', 15))
+# Seconds after which the metrics of a process not saved since, mostly of a
+# stopped process, are folded into a single row of expired processes
+METRICS_SNAPSHOT_TTL = float(os.environ.get('CD_METRICS_SNAPSHOT_TTL', 3600))
+# Bearer token of the requests to /metrics, disabled when empty
+METRICS_TOKEN = os.environ.get('CD_METRICS_TOKEN', '')
+# Bearer token of the requests to /calls/export/, disabled when empty
+EXPORT_TOKEN = os.environ.get('CD_EXPORT_TOKEN', '')
+
+# Directory where the requests flagged to be profiled write their profile and
+# SQL queries, or the URI of a shared storage, eg. s3://bucket/profiles,
+# profiling is disabled when empty
+PROFILING_DIR = os.environ.get('CD_PROFILING_DIR', '')
+# Client addresses allowed to profile requests, besides the staff users
+PROFILING_ALLOWED_IPS = [
+    address for address in
+    os.environ.get('CD_PROFILING_ALLOWED_IPS', '').split(',') if address]
+# Proxies in front of the app adding the client address to X-Forwarded-For,
+# 1 behind the Heroku router, 0 to use the address of the connection
+PROFILING_TRUSTED_PROXIES = int(
+    os.environ.get('CD_PROFILING_TRUSTED_PROXIES', 0))
+
 
 # Password validation
 
@@ -127,3 +198,19 @@ STATIC_URL = '/static/'
 # WhiteNoise (for static assets), Logging, and Heroku CI for your application.
 
 django_heroku.settings(locals())
+
+
+# Database connections, set after the Heroku settings, that replace the
+# default database when DATABASE_URL is defined
+
+# Seconds a connection is kept open to be reused by the next requests of the
+# worker, 0 to open a connection per request
+DATABASES['default']['CONN_MAX_AGE'] = int(
+    os.environ.get('CD_DB_CONN_MAX_AGE', 60))
+# Check the reused connections still work before each request
+DB_CONN_HEALTH_CHECKS = (
+    os.environ.get('CD_DB_CONN_HEALTH_CHECKS', 'true') == 'true')
+# Connecting through an external pooler in transaction mode, like PgBouncer,
+# server-side cursors can't be used, so large results are fetched at once
+DATABASES['default']['DISABLE_SERVER_SIDE_CURSORS'] = (
+    os.environ.get('CD_DB_POOLER') == 'true')
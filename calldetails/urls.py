@@ -1,8 +1,13 @@
 """calldetails URL Configuration"""
 
+from django.contrib import admin
 from django.urls import path
 from core import views
 
 urlpatterns = [
+    path('admin/', admin.site.urls),
     path('calls/', views.calls),
+    path('calls/batch/', views.calls_batch),
+    path('calls/export/', views.calls_export),
+    path('metrics', views.metrics),
 ]
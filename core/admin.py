@@ -1 +1,22 @@
 from django.contrib import admin
+
+from core.models import MonthlyRollup, Tariff
+
+
+@admin.register(Tariff)
+class TariffAdmin(admin.ModelAdmin):
+    list_display = [
+        'effective_from', 'effective_to', 'standing_charge',
+        'standard_minute_charge', 'reduced_minute_charge', 'standard_start',
+        'standard_end',
+    ]
+
+
+@admin.register(MonthlyRollup)
+class MonthlyRollupAdmin(admin.ModelAdmin):
+    list_display = [
+        'source', 'reference_period', 'call_count', 'total_duration',
+        'total_price',
+    ]
+    list_filter = ['reference_period']
+    search_fields = ['source']
@@ -3,3 +3,9 @@ from django.apps import AppConfig
 
 class CoreConfig(AppConfig):
     name = 'core'
+
+    def ready(self):
+        # Connect the signals that refresh the tariff lookup and check the
+        # database connections
+        import core.db  # noqa: F401
+        import core.tariffs  # noqa: F401
@@ -0,0 +1,316 @@
+from array import array
+from heapq import merge
+from itertools import dropwhile, islice
+import os
+from uuid import uuid4
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from core.models import ArchivedPeriod, CallDetail
+from core.storage import open_filesystem
+
+# Columns of the archived calls, a row per completed call
+ARCHIVE_SCHEMA = pa.schema([
+    ('id', pa.int64()),
+    ('call_id', pa.int64()),
+    ('source', pa.int64()),
+    ('destination', pa.int64()),
+    ('started_at', pa.timestamp('s', tz='UTC')),
+    ('ended_at', pa.timestamp('s', tz='UTC')),
+    ('duration', pa.int64()),
+    ('price', pa.int64()),
+])
+
+# Number of calls deleted from the database at once, after being archived
+DELETE_CHUNK_SIZE = 900
+
+
+def archive_file(period):
+    """Path of the current file of a period, None if it is not archived."""
+    return ArchivedPeriod.objects.filter(period=period).values_list(
+        'path', flat=True).first()
+
+
+def archive_path(period):
+    """Location of the current file of a period, in ARCHIVE_DIR."""
+    return '{}/{}'.format(settings.ARCHIVE_DIR.rstrip('/'),
+                          archive_file(period))
+
+
+def is_archived(period):
+    return ArchivedPeriod.objects.filter(period=period).exists()
+
+
+def archived_periods():
+    """Return the archived periods, in the format MM/YYYY."""
+    return list(ArchivedPeriod.objects.order_by('period').values_list(
+        'period', flat=True))
+
+
+def to_aware(value):
+    if timezone.is_naive(value):
+        return timezone.make_aware(value, timezone.utc)
+    return value
+
+
+def open_archive(path):
+    """Open a file of the archive, by its path relative to ARCHIVE_DIR."""
+    filesystem, base_path = open_filesystem(settings.ARCHIVE_DIR)
+    return pq.ParquetFile(
+        filesystem.open_input_file('{}/{}'.format(base_path, path)))
+
+
+def read_archive(period, number=None, path=None):
+    """
+    Generate the archived calls of a period as CallDetails, ordered by
+    subscriber and start, only the ones of a subscriber if number is given.
+
+    Calls are read from the file at path, the current file of the period by
+    default. Local files are memory-mapped and only the row groups that may
+    hold calls of the subscriber are read, by their min/max statistics.
+    """
+    parquet_file = open_archive(path or archive_file(period))
+    source_index = ARCHIVE_SCHEMA.names.index('source')
+    # Phone numbers are stored as integers, like in the database
+    if number is not None:
+        number = CallDetail._meta.get_field('source').get_prep_value(number)
+
+    for i in range(parquet_file.num_row_groups):
+        statistics = parquet_file.metadata.row_group(i).column(
+            source_index).statistics
+        if number is not None and statistics and statistics.has_min_max and \
+                not statistics.min <= number <= statistics.max:
+            continue
+
+        table = parquet_file.read_row_group(i)
+        columns = [table.column(name).to_pylist()
+                   for name in ARCHIVE_SCHEMA.names]
+
+        for pk, call_id, source, destination, started_at, ended_at, \
+                duration, price in zip(*columns):
+            if number is not None and source != number:
+                continue
+
+            yield CallDetail(
+                pk=pk, call_id=call_id, source=str(source),
+                destination=str(destination),
+                started_at=to_aware(started_at),
+                ended_at=to_aware(ended_at), duration=duration, price=price,
+                reference_period=period, is_completed=True)
+
+
+def sort_key(call):
+    """Position of a call in a period, as ordered by the database."""
+    return (int(call.source), call.started_at, call.pk)
+
+
+def bill_key(call):
+    """Position of a call in a bill, as ordered by the database."""
+    return (call.started_at, call.pk)
+
+
+def period_calls(period, chunk_size, path=None):
+    """
+    Generate the completed calls of an archived period, along with the late
+    calls still in the database, ordered by subscriber and start.
+    """
+    return merge(
+        read_archive(period, path=path),
+        CallDetail.objects.export(period).iterator(chunk_size=chunk_size),
+        key=sort_key)
+
+
+def to_table(calls):
+    """Convert a list of CallDetails into an Arrow table of ARCHIVE_SCHEMA."""
+    return pa.Table.from_arrays([
+        pa.array([call.pk for call in calls], pa.int64()),
+        pa.array([call.call_id for call in calls], pa.int64()),
+        pa.array([int(call.source) for call in calls], pa.int64()),
+        pa.array([int(call.destination) for call in calls], pa.int64()),
+        pa.array([int(call.started_at.timestamp()) for call in calls],
+                 ARCHIVE_SCHEMA.field('started_at').type),
+        pa.array([int(call.ended_at.timestamp()) for call in calls],
+                 ARCHIVE_SCHEMA.field('ended_at').type),
+        pa.array([call.duration for call in calls], pa.int64()),
+        pa.array([call.price for call in calls], pa.int64()),
+    ], schema=ARCHIVE_SCHEMA)
+
+
+def check_archive(path, call_count):
+    """
+    Read every row group of a written file back, raising OSError unless it
+    holds call_count calls.
+    """
+    parquet_file = open_archive(path)
+    count = sum(parquet_file.read_row_group(i).num_rows
+                for i in range(parquet_file.num_row_groups))
+    if count != call_count:
+        raise OSError('{} holds {} calls instead of {}.'.format(
+            path, count, call_count))
+
+
+def delete_file(filesystem, location):
+    try:
+        filesystem.delete_file(location)
+    except FileNotFoundError:
+        pass
+
+
+def write_archive(period, chunk_size):
+    """
+    Write the completed calls of a period to a new Parquet file, along with
+    the calls already archived, and delete them from the database.
+
+    Calls are written ordered by subscriber and start, in row groups of
+    chunk_size calls. Calls are only deleted once the file is read back,
+    in the transaction that makes it the current file of the period, and
+    the previous file is removed afterwards. Returns the number of calls
+    moved out of the database.
+    """
+    previous = archive_file(period)
+    month, year = period.split('/')
+    path = 'reference_period={}-{}/calls-{}.parquet'.format(
+        year, month, uuid4().hex[:8])
+    filesystem, base_path = open_filesystem(settings.ARCHIVE_DIR)
+    location = '{}/{}'.format(base_path, path)
+    filesystem.create_dir(os.path.dirname(location), recursive=True)
+
+    # Ids of the stored calls written, kept compact to be deleted afterwards
+    pks = array('q')
+
+    def stored_calls():
+        for call in CallDetail.objects.export(period).iterator(
+                chunk_size=chunk_size):
+            pks.append(call.pk)
+            yield call
+
+    calls = stored_calls()
+    if previous:
+        calls = merge(read_archive(period, path=previous), calls,
+                      key=sort_key)
+
+    try:
+        call_count = 0
+        with filesystem.open_output_stream(location) as stream:
+            writer = pq.ParquetWriter(
+                stream, ARCHIVE_SCHEMA, compression='snappy')
+            try:
+                chunk = []
+                for call in calls:
+                    chunk.append(call)
+                    if len(chunk) == chunk_size:
+                        writer.write_table(to_table(chunk))
+                        call_count += len(chunk)
+                        chunk = []
+
+                if chunk:
+                    writer.write_table(to_table(chunk))
+                    call_count += len(chunk)
+            finally:
+                writer.close()
+
+        check_archive(path, call_count)
+
+        with transaction.atomic():
+            # Locked, so a concurrent archive of the period can't be lost
+            current = ArchivedPeriod.objects.select_for_update().filter(
+                period=period).first()
+            if (current and current.path) != previous:
+                raise OSError(
+                    'period {} was archived concurrently.'.format(period))
+
+            for i in range(0, len(pks), DELETE_CHUNK_SIZE):
+                CallDetail.objects.filter(
+                    reference_period=period,
+                    pk__in=pks[i:i + DELETE_CHUNK_SIZE]).delete()
+            ArchivedPeriod.objects.update_or_create(
+                period=period,
+                defaults={'path': path, 'call_count': call_count})
+    except BaseException:
+        delete_file(filesystem, location)
+        raise
+
+    if previous:
+        delete_file(filesystem, '{}/{}'.format(base_path, previous))
+
+    return len(pks)
+
+
+class ArchivedBill:
+    """
+    The calls of a bill of an archived period, read in order from the row
+    groups of the file of the subscriber along with the late calls still in
+    the database, with the methods of the CallDetail queryset used to render
+    bills.
+    """
+
+    def __init__(self, number, period, path, position=None, fields=None):
+        self.number = number
+        self.period = period
+        self.path = path
+        self.position = position
+        self.fields = fields
+
+    def __iter__(self):
+        return self.iterator()
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return list(islice(self, index.start, index.stop, index.step))
+        return next(islice(self, index, None))
+
+    def iterator(self, chunk_size=2000):
+        stored = CallDetail.objects.bill(self.number, self.period)
+        archived = read_archive(self.period, self.number, self.path)
+        if self.position:
+            stored = stored.after(*self.position)
+            archived = dropwhile(
+                lambda call: bill_key(call) <= self.position, archived)
+
+        calls = merge(archived, stored.iterator(chunk_size=chunk_size),
+                      key=bill_key)
+        if not self.fields:
+            return calls
+        return (tuple(getattr(call, field) for field in self.fields)
+                for call in calls)
+
+    def after(self, started_at, pk):
+        """Calls after the position (started_at, id) in the bill."""
+        return ArchivedBill(self.number, self.period, self.path,
+                            (started_at, pk), self.fields)
+
+    def values_list(self, *fields):
+        """Values of the fields of each call, in tuples."""
+        return ArchivedBill(self.number, self.period, self.path,
+                            self.position, fields)
+
+    def summary(self):
+        """Totals of the calls per destination, ordered by destination."""
+        destinations = {}
+        for call in self:
+            totals = destinations.setdefault(call.destination, {
+                'destination': call.destination,
+                'call_count': 0,
+                'total_duration': 0,
+                'total_price': 0
+            })
+            totals['call_count'] += 1
+            totals['total_duration'] += call.duration
+            totals['total_price'] += call.price
+
+        return [destinations[destination]
+                for destination in sorted(destinations, key=int)]
+
+
+def bill_calls(number, period, path):
+    """
+    Return the calls of the bill of a subscriber in a period, read from the
+    file at path if the period is archived, as returned by archive_file.
+    """
+    if path:
+        return ArchivedBill(number, period, path)
+    return CallDetail.objects.bill(number, period)
@@ -0,0 +1,222 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import sys
+import threading
+
+# Chunks of a request body received ahead of the application reading them
+BODY_QUEUE_SIZE = 16
+
+
+class RequestBody:
+    """
+    The wsgi.input of a request, read by the application thread as the body
+    is received by the event loop, so large bodies are parsed while they are
+    uploaded instead of being kept in memory first.
+
+    Raises OSError if the client disconnects before sending the whole body.
+    """
+
+    def __init__(self, loop):
+        self.loop = loop
+        # Chunks of the body, then b'' at its end or None on a disconnect
+        self.chunks = asyncio.Queue(BODY_QUEUE_SIZE)
+        self.buffer = b''
+        self.finished = False
+        self.discarded = False
+
+    def receive_chunk(self):
+        if self.finished:
+            return
+        chunk = asyncio.run_coroutine_threadsafe(
+            self.chunks.get(), self.loop).result()
+        if chunk is None:
+            self.finished = True
+            raise OSError('Client disconnected before sending the body.')
+        if not chunk:
+            self.finished = True
+        self.buffer += chunk
+
+    def read(self, size=-1):
+        while not self.finished and (
+                size is None or size < 0 or len(self.buffer) < size):
+            self.receive_chunk()
+        if size is None or size < 0:
+            size = len(self.buffer)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+    def readline(self, size=-1):
+        while not self.finished and b'\n' not in self.buffer and (
+                size is None or size < 0 or len(self.buffer) < size):
+            self.receive_chunk()
+        end = self.buffer.find(b'\n') + 1 or len(self.buffer)
+        if size is not None and size >= 0:
+            end = min(end, size)
+        data, self.buffer = self.buffer[:end], self.buffer[end:]
+        return data
+
+    def __iter__(self):
+        while True:
+            line = self.readline()
+            if not line:
+                return
+            yield line
+
+    def discard(self):
+        """Drop the rest of the body, once the application responded."""
+        self.discarded = True
+
+        async def drain():
+            while not self.chunks.empty():
+                self.chunks.get_nowait()
+
+        asyncio.run_coroutine_threadsafe(drain(), self.loop).result()
+
+
+def get_environ(scope, body):
+    """Build the WSGI environ of an ASGI HTTP request."""
+    server_name, server_port = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server_name,
+        'SERVER_PORT': str(server_port),
+        'SERVER_PROTOCOL': 'HTTP/{}'.format(scope['http_version']),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+
+    for name, value in scope['headers']:
+        name = name.decode('latin-1')
+        if name == 'content-length':
+            key = 'CONTENT_LENGTH'
+        elif name == 'content-type':
+            key = 'CONTENT_TYPE'
+        else:
+            key = 'HTTP_' + name.upper().replace('-', '_')
+
+        value = value.decode('latin-1')
+        if key in environ:
+            value = environ[key] + ',' + value
+        environ[key] = value
+
+    return environ
+
+
+class ASGIHandler:
+    """
+    Serve a WSGI application over ASGI.
+
+    Django 2.2 only serves WSGI, so the event loop holds the connections and
+    reads the requests, while each request runs in a thread of a pool, with
+    the thread database connection. Responses are sent in the chunks yielded
+    by the application as soon as they are generated, so streamed bills are
+    still sent without being kept in memory.
+    """
+
+    def __init__(self, wsgi_application, max_threads):
+        self.wsgi_application = wsgi_application
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_threads, thread_name_prefix='asgi')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+
+        loop = asyncio.get_event_loop()
+        body = RequestBody(loop)
+        disconnected = threading.Event()
+        receiving = loop.create_task(
+            self.receive(receive, body, disconnected))
+        try:
+            await loop.run_in_executor(
+                self.executor, self.run, get_environ(scope, body), send,
+                loop, disconnected)
+        finally:
+            receiving.cancel()
+
+    async def receive(self, receive, body, disconnected):
+        """
+        Queue the chunks of the body as the application reads them, then
+        wait for the client to disconnect, while the response is sent.
+        """
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                break
+
+            chunk = message.get('body', b'')
+            if chunk and not body.discarded:
+                await body.chunks.put(chunk)
+            if not message.get('more_body'):
+                await body.chunks.put(b'')
+                while (await receive())['type'] != 'http.disconnect':
+                    pass
+                break
+
+        disconnected.set()
+        # Wakes up the application waiting for the rest of the body
+        while not body.chunks.empty():
+            body.chunks.get_nowait()
+        body.chunks.put_nowait(None)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def run(self, environ, send, loop, disconnected):
+        """
+        Run the WSGI application, sending the response from the thread, and
+        stop generating it if the client disconnects.
+        """
+        def send_message(message):
+            # Waits for the message to be sent, not to outpace the client
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        start = {}
+
+        def start_response(status, headers, exc_info=None):
+            start['status'] = int(status.split(' ', 1)[0])
+            start['headers'] = [
+                (name.lower().encode('latin-1'), value.encode('latin-1'))
+                for name, value in headers
+            ]
+
+        response = self.wsgi_application(environ, start_response)
+        environ['wsgi.input'].discard()
+        try:
+            started = False
+            for chunk in response:
+                if disconnected.is_set():
+                    return
+                if not started:
+                    send_message(dict(type='http.response.start', **start))
+                    started = True
+                if chunk:
+                    send_message({'type': 'http.response.body', 'body': chunk,
+                                  'more_body': True})
+
+            if not started:
+                send_message(dict(type='http.response.start', **start))
+            send_message({'type': 'http.response.body', 'body': b''})
+        finally:
+            # Ends the request, closing the database connection if needed
+            if hasattr(response, 'close'):
+                response.close()
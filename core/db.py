@@ -0,0 +1,21 @@
+from django.conf import settings
+from django.core.signals import request_started
+from django.db import connections
+from django.dispatch import receiver
+
+
+def check_connections():
+    """
+    Close the persistent database connections that are no longer usable, eg.
+    after a database restart, so they are opened again when needed instead of
+    failing the next query.
+    """
+    for connection in connections.all():
+        if connection.connection is not None and not connection.is_usable():
+            connection.close()
+
+
+@receiver(request_started)
+def check_connections_on_request(sender, **kwargs):
+    if settings.DB_CONN_HEALTH_CHECKS:
+        check_connections()
@@ -0,0 +1,88 @@
+import csv
+
+from core.archive import archive_file, period_calls
+from core.models import CallDetail
+from core.streaming import dumps
+
+# Columns of the exported calls, in order
+EXPORT_FIELDS = [
+    'source', 'destination', 'call_id', 'started_at', 'ended_at', 'duration',
+    'price',
+]
+
+EXPORT_CONTENT_TYPES = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+class Echo:
+    """File-like object returning what is written, for csv.writer."""
+
+    def write(self, value):
+        return value
+
+
+def format_timestamp(value):
+    return value.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def export_rows(calls, chunk_size):
+    """
+    Generate the exported rows of the calls, as tuples of EXPORT_FIELDS.
+
+    Rows are fetched chunk_size at a time with a server-side cursor, where
+    the database supports it, without creating model instances.
+    """
+    rows = calls.values_list(*EXPORT_FIELDS).iterator(chunk_size=chunk_size)
+    for source, destination, call_id, started_at, ended_at, duration, \
+            price in rows:
+        yield (source, destination, call_id, format_timestamp(started_at),
+               format_timestamp(ended_at), duration, price)
+
+
+def archived_rows(period, path, chunk_size):
+    """Generate the exported rows of the calls of an archived period."""
+    for call in period_calls(period, chunk_size, path):
+        yield (call.source, call.destination, call.call_id,
+               format_timestamp(call.started_at),
+               format_timestamp(call.ended_at), call.duration, call.price)
+
+
+def render_csv(rows):
+    """Generate the CSV lines of the rows, after a header line."""
+    writer = csv.writer(Echo())
+    yield writer.writerow(EXPORT_FIELDS)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def render_ndjson(rows):
+    """Generate a JSON object per row, one per line."""
+    for row in rows:
+        yield dumps(dict(zip(EXPORT_FIELDS, row))) + '\n'
+
+
+def export_calls(period, file_format, chunk_size):
+    """
+    Generate the CSV or NDJSON export of the completed calls of a period in
+    pieces of chunk_size lines, so memory usage does not grow with the number
+    of calls.
+    """
+    render = render_csv if file_format == 'csv' else render_ndjson
+    path = archive_file(period)
+    if path:
+        rows = archived_rows(period, path, chunk_size)
+    else:
+        rows = export_rows(CallDetail.objects.export(period), chunk_size)
+
+    lines = []
+    for line in render(rows):
+        lines.append(line)
+
+        if len(lines) == chunk_size:
+            yield ''.join(lines)
+            lines = []
+
+    if lines:
+        yield ''.join(lines)
@@ -0,0 +1,53 @@
+from django.db import models
+
+from core.utils import format_period, parse_period
+
+
+class PhoneNumberField(models.BigIntegerField):
+    """
+    A phone number of 10 or 11 digits, stored as an integer.
+
+    Values are strings of digits in Python and integers in the database, so
+    numbers can't start with 0.
+    """
+
+    def from_db_value(self, value, expression, connection):
+        if value is None:
+            return value
+        return str(value)
+
+    def to_python(self, value):
+        if value is None or isinstance(value, str):
+            return value
+        return str(value)
+
+    def get_prep_value(self, value):
+        # The leading zero would be lost, matching another number
+        if isinstance(value, str) and value.startswith('0'):
+            raise ValueError(
+                'Phone number {!r} must not start with 0.'.format(value))
+        return super().get_prep_value(value)
+
+
+class PeriodField(models.IntegerField):
+    """
+    A month/year period, stored as an integer YYYYMM.
+
+    Values are strings in MM/YYYY format in Python and integers in the
+    database, so periods are ordered chronologically.
+    """
+
+    def from_db_value(self, value, expression, connection):
+        if value is None:
+            return value
+        return format_period(value)
+
+    def to_python(self, value):
+        if value is None or isinstance(value, str):
+            return value
+        return format_period(value)
+
+    def get_prep_value(self, value):
+        if isinstance(value, str):
+            value = parse_period(value)
+        return super().get_prep_value(value)
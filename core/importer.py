@@ -0,0 +1,170 @@
+import csv
+import json
+import os
+import sqlite3
+
+# Maximum number of call ids looked up at once in the unmatched halves
+SQLITE_MAX_VARIABLES = 900
+
+
+def parse_csv_line(line, fields):
+    """Convert a CSV line into a call record, as it would be sent in JSON."""
+    values = next(csv.reader([line]))
+    record = {
+        field: value for field, value in zip(fields, values) if value != ''
+    }
+
+    # Only call_id is an integer, invalid ones are kept to be reported
+    call_id = record.get('call_id')
+    if call_id is not None and call_id.isdigit():
+        record['call_id'] = int(call_id)
+
+    return record
+
+
+def read_records(stream, file_format, offset=0):
+    """
+    Read call records from a binary stream of CSV or NDJSON lines.
+
+    Yields (offset, record) tuples, the offset being the position right after
+    the record, where reading can be resumed. Records that can't be decoded or
+    parsed are yielded as None. CSV files must have a UTF-8 header with the
+    columns of the call records, in any order.
+    """
+    fields = None
+    if file_format == 'csv':
+        header = stream.readline().decode('utf-8').strip()
+        fields = next(csv.reader([header]))
+        offset = max(offset, stream.tell())
+
+    stream.seek(offset)
+    for line in stream:
+        offset += len(line)
+        try:
+            line = line.decode('utf-8').strip()
+            if not line:
+                continue
+            if file_format == 'csv':
+                record = parse_csv_line(line, fields)
+            else:
+                record = json.loads(line)
+        except ValueError:
+            record = None
+
+        yield offset, record
+
+
+def load_checkpoint(path):
+    """Return the offset saved in a checkpoint file, 0 if there is none."""
+    if not os.path.exists(path):
+        return 0
+
+    with open(path) as checkpoint:
+        return json.load(checkpoint)['offset']
+
+
+def save_checkpoint(path, offset):
+    """Save the offset where an import can be resumed, atomically."""
+    temporary_path = path + '.tmp'
+    with open(temporary_path, 'w') as checkpoint:
+        json.dump({'offset': offset}, checkpoint)
+    os.replace(temporary_path, path)
+
+
+class SpilledPairing:
+    """
+    Pair the start and end records of calls while importing, keeping the
+    unmatched halves in a SQLite file instead of memory.
+
+    The records of a call are only saved once both halves were read, so calls
+    are written already completed. Memory is bounded by the chunk of records
+    being paired and by the SQLite page cache, in KiB.
+    """
+
+    def __init__(self, path='', cache_size=2048):
+        # An empty path is a temporary file, removed when closed
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute('PRAGMA cache_size = -{:d}'.format(cache_size))
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS halves (call_id INTEGER, type TEXT, '
+            'offset INTEGER, record TEXT, PRIMARY KEY (call_id, type))')
+        self.connection.commit()
+
+    def pair(self, items):
+        """
+        Pair (offset, call_id, record) items of valid records with the
+        unmatched halves.
+
+        Returns the (offset, record) items of the calls having both halves, in
+        file order. The remaining items are kept as unmatched halves, until
+        commit is called.
+        """
+        calls = {}
+        for offset, call_id, record in items:
+            calls.setdefault(call_id, []).append((offset, record))
+
+        for call_id, offset, record in self.take(list(calls)):
+            calls[call_id].insert(0, (offset, record))
+
+        paired = []
+        unmatched = []
+        for call_id, call_items in calls.items():
+            if len({record['type'] for _, record in call_items}) == 2:
+                paired.extend(call_items)
+            else:
+                unmatched.extend(
+                    (call_id, record['type'], offset, json.dumps(record))
+                    for offset, record in call_items)
+
+        # A repeated half replaces the previous one, as it would when saved
+        self.connection.executemany(
+            'INSERT OR REPLACE INTO halves VALUES (?, ?, ?, ?)', unmatched)
+
+        return sorted(paired, key=lambda item: item[0])
+
+    def take(self, call_ids):
+        """Remove the unmatched halves of the calls, in file order."""
+        items = []
+        for i in range(0, len(call_ids), SQLITE_MAX_VARIABLES):
+            chunk = call_ids[i:i + SQLITE_MAX_VARIABLES]
+            where = 'WHERE call_id IN ({})'.format(','.join('?' * len(chunk)))
+
+            rows = self.connection.execute(
+                'SELECT call_id, offset, record FROM halves ' + where, chunk)
+            items.extend((call_id, offset, json.loads(record))
+                         for call_id, offset, record in rows)
+            self.connection.execute('DELETE FROM halves ' + where, chunk)
+
+        return sorted(items, key=lambda item: item[1])
+
+    def drain(self, chunk_size):
+        """
+        Remove the unmatched halves, yielding lists of (offset, record) items
+        in file order. Each list must be committed before the next one.
+        """
+        while True:
+            rows = self.connection.execute(
+                'SELECT rowid, offset, record FROM halves '
+                'ORDER BY offset LIMIT ?', [chunk_size]).fetchall()
+            if not rows:
+                break
+
+            self.connection.executemany(
+                'DELETE FROM halves WHERE rowid = ?',
+                [(rowid,) for rowid, _, _ in rows])
+            yield [(offset, json.loads(record)) for _, offset, record in rows]
+
+    def count(self):
+        """Return the number of unmatched halves."""
+        return self.connection.execute(
+            'SELECT COUNT(*) FROM halves').fetchone()[0]
+
+    def commit(self):
+        self.connection.commit()
+
+    def close(self, remove=False):
+        """Close the SQLite file, removing it if asked."""
+        self.connection.close()
+        if remove and self.path and os.path.exists(self.path):
+            os.remove(self.path)
@@ -0,0 +1,140 @@
+from django.db import IntegrityError, transaction
+
+from core.models import CallDetail, MonthlyBill, MonthlyRollup
+from core.partitions import lock_calls
+from core.serializers import merge_record
+from core.validators import validate_call_order, validate_call_record
+
+# Fields written back when an already stored CallDetail is completed
+CALL_DETAIL_FIELDS = [
+    'source', 'destination', 'duration', 'price', 'reference_period',
+    'started_at', 'ended_at', 'is_completed',
+]
+
+# Maximum number of call ids sent in a single "IN" lookup, kept under the
+# SQLite limit of variables per statement
+LOOKUP_CHUNK_SIZE = 900
+
+# Times a batch is saved when calls are created concurrently
+INGEST_ATTEMPTS = 3
+
+
+def fetch_calls(call_ids):
+    """Return a dict of the stored CallDetails indexed by call_id."""
+    call_ids = list(call_ids)
+    lock_calls(call_ids)
+    calls = {}
+
+    for i in range(0, len(call_ids), LOOKUP_CHUNK_SIZE):
+        chunk = call_ids[i:i + LOOKUP_CHUNK_SIZE]
+        queryset = CallDetail.objects.select_for_update().filter(
+            call_id__in=chunk)
+        for call in queryset:
+            calls[call.call_id] = call
+
+    return calls
+
+
+def validate_records(records):
+    """
+    Validate Call Records on their own, without the saved calls.
+
+    Returns a list of (index, call type, validated data) of the valid records
+    and a list of per-record errors, each one holding the record index.
+    """
+    valid = []
+    errors = []
+
+    for index, record in enumerate(records):
+        if not isinstance(record, dict):
+            errors.append({
+                'index': index,
+                'errors': {'record': 'record must be a JSON object.'}
+            })
+            continue
+
+        validated_data, record_errors = validate_call_record(record)
+        if record_errors:
+            errors.append({'index': index, 'errors': record_errors})
+        else:
+            valid.append((index, record['type'], validated_data))
+
+    return valid, errors
+
+
+def ingest_records(records):
+    """
+    Save a batch of Start and End Call Records.
+
+    Every record is validated with the same rules of CallDetailSerializer.
+    Stored CallDetails are fetched in bulk, records are paired in memory
+    following the batch order and the result is written with bulk_create and
+    bulk_update in a single transaction.
+
+    Calls created by a concurrent batch after they were fetched make the
+    transaction fail on the unique call_id, it is then retried, merging the
+    records into the calls now stored.
+
+    Returns the number of saved records and a list of per-record errors,
+    each one holding the record index in the batch.
+    """
+    valid, errors = validate_records(records)
+
+    for attempt in range(INGEST_ATTEMPTS):
+        try:
+            saved, order_errors = save_records(valid)
+            break
+        except IntegrityError:
+            if attempt == INGEST_ATTEMPTS - 1:
+                raise
+
+    errors.extend(order_errors)
+    errors.sort(key=lambda error: error['index'])
+    return saved, errors
+
+
+def save_records(valid):
+    """
+    Save the validated records of a batch, in a transaction.
+
+    Returns the number of saved records and the errors of the records out of
+    order with their stored call.
+    """
+    errors = []
+    saved = 0
+    with transaction.atomic():
+        calls = fetch_calls({data['call_id'] for _, _, data in valid})
+        changed = {}
+        previous_totals = {}
+
+        for index, call_type, validated_data in valid:
+            call = calls.get(validated_data['call_id'])
+
+            if call is None:
+                call = CallDetail(call_id=validated_data['call_id'])
+                calls[call.call_id] = call
+            else:
+                order_errors = validate_call_order(
+                    call, call_type, validated_data)
+                if order_errors:
+                    errors.append({'index': index, 'errors': order_errors})
+                    continue
+
+            if call.call_id not in changed:
+                previous_totals[call.call_id] = call.totals()
+
+            merge_record(call, call_type, validated_data)
+            changed[call.call_id] = call
+            saved += 1
+
+        new_calls = [call for call in changed.values() if call.pk is None]
+        old_calls = [call for call in changed.values() if call.pk is not None]
+
+        CallDetail.objects.bulk_create(new_calls)
+        CallDetail.objects.bulk_update(old_calls, CALL_DETAIL_FIELDS)
+        changes = [(previous_totals[call.call_id], call.totals())
+                   for call in changed.values()]
+        MonthlyRollup.objects.apply_changes(changes)
+        MonthlyBill.objects.invalidate(changes)
+
+    return saved, errors
@@ -0,0 +1,34 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.archive import archive_path, write_archive
+from core.utils import is_closed_period
+
+
+class Command(BaseCommand):
+    help = ('Move the completed calls of a closed period out of the database, '
+            'into a Parquet file.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'period', help='Reference period in the format: MM/YYYY')
+        parser.add_argument(
+            '--chunk-size', type=int, default=10000,
+            help='Number of calls in each row group of the file.')
+
+    def handle(self, *args, **options):
+        period = options['period']
+
+        try:
+            datetime.strptime(period, "%m/%Y")
+        except ValueError:
+            raise CommandError('period must be in the format: "MM/YYYY"')
+
+        if not is_closed_period(period):
+            raise CommandError('period must be of a closed (previous) month.')
+
+        count = write_archive(period, options['chunk_size'])
+
+        self.stdout.write('Archived {} calls of period {} in {}.'.format(
+            count, period, archive_path(period)))
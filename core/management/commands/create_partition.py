@@ -0,0 +1,35 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.partitions import (
+    create_partition, is_partitioned, next_period, partition_name)
+
+
+class Command(BaseCommand):
+    help = ('Create the partition of the calls of a period, by default of the '
+            'next month.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--period', help='Reference period in the format: MM/YYYY')
+
+    def handle(self, *args, **options):
+        period = options['period'] or next_period()
+
+        try:
+            datetime.strptime(period, "%m/%Y")
+        except ValueError:
+            raise CommandError('period must be in the format: "MM/YYYY"')
+
+        # SQLite, used in development, keeps all calls in a single table
+        if not is_partitioned():
+            self.stdout.write('Calls are not partitioned, nothing to do.')
+            return
+
+        if create_partition(period):
+            self.stdout.write('Created partition {}.'.format(
+                partition_name(period)))
+        else:
+            self.stdout.write('Partition {} already exists.'.format(
+                partition_name(period)))
@@ -0,0 +1,47 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.export import export_calls
+
+
+class Command(BaseCommand):
+    help = ('Export the completed calls of every subscriber in a period as '
+            'CSV or NDJSON, ordered by subscriber and start.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'period', help='Reference period in the format: MM/YYYY')
+        parser.add_argument(
+            '--format', choices=['csv', 'ndjson'], default='csv',
+            help='Output format.')
+        parser.add_argument(
+            '--output', help='File to write, by default the standard output.')
+        parser.add_argument(
+            '--chunk-size', type=int, default=2000,
+            help='Number of calls fetched and written at once.')
+
+    def handle(self, *args, **options):
+        period = options['period']
+
+        try:
+            datetime.strptime(period, "%m/%Y")
+        except ValueError:
+            raise CommandError('period must be in the format: "MM/YYYY"')
+
+        chunks = export_calls(period, options['format'],
+                              options['chunk_size'])
+
+        if not options['output']:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
+            return
+
+        try:
+            output = open(options['output'], 'w', newline='')
+        except OSError as exc:
+            raise CommandError(exc)
+
+        with output:
+            for chunk in chunks:
+                output.write(chunk)
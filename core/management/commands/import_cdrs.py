@@ -0,0 +1,121 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core.importer import (
+    SpilledPairing, load_checkpoint, read_records, save_checkpoint)
+from core.ingest import ingest_records, validate_records
+
+
+class Command(BaseCommand):
+    help = ('Import Start and End Call Records from a CSV or NDJSON file, '
+            'pairing them with the saved calls.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV or NDJSON file to import.')
+        parser.add_argument(
+            '--format', choices=['csv', 'ndjson'],
+            help='File format, by default given by the file extension.')
+        parser.add_argument(
+            '--chunk-size', type=int, default=5000,
+            help='Number of records saved in each transaction.')
+        parser.add_argument(
+            '--offset', type=int, default=0,
+            help='Byte offset of the file to start importing from.')
+        parser.add_argument(
+            '--checkpoint',
+            help='File where the offset of the last saved chunk is kept. If '
+                 'it exists, the import resumes from its offset. The '
+                 'unmatched records are kept next to it, in a ".spill" file.')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or (
+            'csv' if path.lower().endswith('.csv') else 'ndjson')
+        chunk_size = options['chunk_size']
+        checkpoint = options['checkpoint']
+
+        offset = options['offset']
+        if checkpoint:
+            offset = max(offset, load_checkpoint(checkpoint))
+
+        self.imported = 0
+        self.invalid = 0
+        self.start = time.perf_counter()
+
+        try:
+            stream = open(path, 'rb')
+        except OSError as exc:
+            raise CommandError(exc)
+
+        if file_format == 'csv':
+            try:
+                stream.readline().decode('utf-8')
+            except UnicodeDecodeError:
+                stream.close()
+                raise CommandError('The CSV header is not valid UTF-8.')
+            stream.seek(0)
+
+        # Unmatched halves must survive an interrupted import to be resumed
+        self.pairing = SpilledPairing(
+            checkpoint + '.spill' if checkpoint else '',
+            settings.IMPORT_SPILL_CACHE_SIZE)
+
+        with stream:
+            chunk = []
+            for offset, record in read_records(stream, file_format, offset):
+                chunk.append((offset, record))
+
+                if len(chunk) == chunk_size:
+                    self.import_chunk(chunk, checkpoint)
+                    chunk = []
+
+            if chunk:
+                self.import_chunk(chunk, checkpoint)
+
+        # Halves never matched in the file are paired with the saved calls
+        self.stdout.write('Saving {} unmatched records.'.format(
+            self.pairing.count()))
+        for items in self.pairing.drain(chunk_size):
+            self.save(items)
+            self.pairing.commit()
+        self.pairing.close(remove=True)
+
+        self.stdout.write('Imported {} records, {} invalid.'.format(
+            self.imported, self.invalid))
+
+    def import_chunk(self, chunk, checkpoint):
+        """
+        Pair a chunk of records with the unmatched ones, saving the calls
+        having both halves, and report progress.
+        """
+        valid, errors = validate_records([record for _, record in chunk])
+        self.report_errors(chunk, errors)
+
+        self.save(self.pairing.pair(
+            (chunk[index][0], validated_data['call_id'], chunk[index][1])
+            for index, _, validated_data in valid))
+        self.pairing.commit()
+
+        if checkpoint:
+            save_checkpoint(checkpoint, chunk[-1][0])
+
+        elapsed = time.perf_counter() - self.start
+        self.stdout.write('{} records imported, {} invalid, {:.0f} '
+                          'records/s.'.format(
+                              self.imported, self.invalid,
+                              (self.imported + self.invalid) / elapsed))
+
+    def save(self, items):
+        """Save (offset, record) items in a transaction."""
+        saved, errors = ingest_records([record for _, record in items])
+        self.report_errors(items, errors)
+        self.imported += saved
+
+    def report_errors(self, items, errors):
+        for error in errors:
+            offset, record = items[error['index']]
+            self.stderr.write('Invalid record ending at byte {}: {} {}'.format(
+                offset, record, error['errors']))
+        self.invalid += len(errors)
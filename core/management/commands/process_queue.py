@@ -0,0 +1,52 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from core.db import check_connections
+from core.queue import process_queue, queue_lag
+
+
+class Command(BaseCommand):
+    help = 'Save the queued call records, in batches, as they arrive.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=settings.INGEST_BATCH_SIZE,
+            help='Maximum number of records saved at once.')
+        parser.add_argument(
+            '--flush-interval', type=float,
+            default=settings.INGEST_FLUSH_INTERVAL,
+            help='Seconds to wait for more records when the queue has less '
+                 'than a batch.')
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Exit when the queue is empty.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        flush_interval = options['flush_interval']
+
+        while True:
+            # The worker runs like a request per batch, closing connections
+            # past their age and broken ones
+            close_old_connections()
+            if settings.DB_CONN_HEALTH_CHECKS:
+                check_connections()
+
+            start = time.perf_counter()
+            processed = process_queue(batch_size)
+
+            if processed:
+                elapsed = time.perf_counter() - start
+                depth, age = queue_lag()
+                self.stdout.write(
+                    'Saved {} records in {:.3f}s ({:.0f} records/s), '
+                    'queue depth {}, lag {:.1f}s.'.format(
+                        processed, elapsed, processed / elapsed, depth, age))
+
+            if processed < batch_size:
+                if options['once']:
+                    break
+                time.sleep(flush_interval)
@@ -0,0 +1,33 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.archive import archived_periods
+from core.models import MonthlyRollup
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the monthly rollups of subscribers from their calls.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--period',
+            help='Rebuild only the period in the format: MM/YYYY')
+
+    def handle(self, *args, **options):
+        period = options['period']
+
+        if period:
+            try:
+                datetime.strptime(period, "%m/%Y")
+            except ValueError:
+                raise CommandError('period must be in the format: "MM/YYYY"')
+
+        # Calls of archived periods are no longer in the database
+        archived = archived_periods()
+        if period in archived:
+            raise CommandError('period {} is archived.'.format(period))
+
+        count = MonthlyRollup.objects.rebuild(period, exclude=archived)
+
+        self.stdout.write('Rebuilt {} rollups.'.format(count))
@@ -0,0 +1,63 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from core.archive import is_archived
+from core.models import CallDetail, MonthlyBill, MonthlyRollup
+from core.pricing import get_prices_by_tariff, to_epoch_seconds
+from core.tariffs import get_tariff_lookup
+
+
+class Command(BaseCommand):
+    help = 'Recalculate the price of all completed calls of a period.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'period', help='Reference period in the format: MM/YYYY')
+        parser.add_argument(
+            '--chunk-size', type=int, default=10000,
+            help='Number of calls priced and saved at once.')
+
+    def handle(self, *args, **options):
+        period = options['period']
+        chunk_size = options['chunk_size']
+
+        try:
+            datetime.strptime(period, "%m/%Y")
+        except ValueError:
+            raise CommandError('period must be in the format: "MM/YYYY"')
+
+        if is_archived(period):
+            raise CommandError('period {} is archived.'.format(period))
+
+        calls = CallDetail.objects.filter(
+            reference_period=period, is_completed=True
+        ).order_by('pk').values_list('pk', 'started_at', 'ended_at')
+
+        lookup = get_tariff_lookup()
+        total = 0
+        last_pk = 0
+        while True:
+            chunk = list(calls.filter(pk__gt=last_pk)[:chunk_size])
+            if not chunk:
+                break
+
+            pks, started_at, ended_at = zip(*chunk)
+            prices = get_prices_by_tariff(to_epoch_seconds(started_at),
+                                          to_epoch_seconds(ended_at), lookup)
+
+            with transaction.atomic():
+                CallDetail.objects.bulk_update(
+                    [CallDetail(pk=pk, price=int(price))
+                     for pk, price in zip(pks, prices)],
+                    ['price'], batch_size=1000)
+
+            total += len(chunk)
+            last_pk = pks[-1]
+
+        MonthlyBill.objects.filter(period=period).delete()
+        MonthlyRollup.objects.rebuild(period)
+
+        self.stdout.write('Repriced {} calls of period {}.'.format(
+            total, period))
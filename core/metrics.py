@@ -0,0 +1,409 @@
+import json
+import os
+import random
+import socket
+import threading
+import time
+from bisect import bisect_left
+from datetime import timedelta
+from uuid import uuid4
+
+from django.conf import settings
+from django.db import DatabaseError, connection, transaction
+from django.utils import timezone
+
+from core.models import MetricsSnapshot
+
+# Upper bounds of the histogram buckets, in seconds for latencies
+LATENCY_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+    2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+# Metrics of the request being handled by the current thread, if sampled
+_local = threading.local()
+
+
+def format_labels(names, values):
+    """Format label names and values in the Prometheus text format."""
+    if not names:
+        return ''
+    return '{{{}}}'.format(','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', r'\\').replace(
+            '"', r'\"').replace('\n', r'\n'))
+        for name, value in zip(names, values)))
+
+
+def format_gauge(name, help_text, value):
+    """Format a single gauge value in the Prometheus text format."""
+    return '# HELP {0} {1}\n# TYPE {0} gauge\n{0} {2}\n'.format(
+        name, help_text, value)
+
+
+class Histogram:
+    """
+    Distribution of the values observed for each combination of labels,
+    counted in buckets by upper bound, like Prometheus histograms.
+    """
+
+    def __init__(self, name, help_text, labels, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = buckets
+        # Label values -> [count per bucket, plus +Inf], sum of values
+        self.samples = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            sample = self.samples.get(label_values)
+            if sample is None:
+                sample = self.samples[label_values] = [
+                    [0] * (len(self.buckets) + 1), 0]
+            sample[0][index] += 1
+            sample[1] += value
+
+    def clear(self):
+        with self.lock:
+            self.samples = {}
+
+    def dump(self):
+        """Return the samples as a list of [label values, counts, sum]."""
+        with self.lock:
+            return [[list(values), list(counts), total]
+                    for values, (counts, total) in self.samples.items()]
+
+    def render(self, samples=None):
+        """
+        Return the histogram in the Prometheus text format, of the samples
+        of this process or of the given ones, in the format of dump().
+        """
+        lines = [
+            '# HELP {} {}'.format(self.name, self.help_text),
+            '# TYPE {} histogram'.format(self.name),
+        ]
+        if samples is None:
+            samples = self.dump()
+        samples = sorted((tuple(values), counts, total)
+                         for values, counts, total in samples)
+
+        names = self.labels + ('le',)
+        for values, counts, total in samples:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                lines.append('{}_bucket{} {}'.format(
+                    self.name, format_labels(names, values + (bound,)),
+                    cumulative))
+            labels = format_labels(self.labels, values)
+            lines.append('{}_sum{} {}'.format(self.name, labels, total))
+            lines.append('{}_count{} {}'.format(
+                self.name, labels, cumulative))
+
+        return '\n'.join(lines) + '\n'
+
+
+REQUEST_SECONDS = Histogram(
+    'calldetails_request_duration_seconds',
+    'Latency of the sampled requests, until the response is sent.',
+    ('view', 'method', 'status'), LATENCY_BUCKETS)
+STAGE_SECONDS = Histogram(
+    'calldetails_stage_duration_seconds',
+    'Latency of each stage of the sampled requests.',
+    ('view', 'stage'), LATENCY_BUCKETS)
+DB_QUERIES = Histogram(
+    'calldetails_request_db_queries',
+    'Database queries run by each sampled request.',
+    ('view',), QUERY_BUCKETS)
+DB_SECONDS = Histogram(
+    'calldetails_request_db_duration_seconds',
+    'Time spent by each sampled request running database queries.',
+    ('view',), LATENCY_BUCKETS)
+
+HISTOGRAMS = [REQUEST_SECONDS, STAGE_SECONDS, DB_QUERIES, DB_SECONDS]
+
+
+# Name of this process in the saved snapshots, named again in forked workers,
+# the samples last saved and the ones folded into the expired snapshot
+_process = {'pid': None, 'name': None, 'flushed': float('-inf'),
+            'saved': None, 'folded': None}
+_flush_lock = threading.Lock()
+
+# Snapshot where the samples of the processes not seen for a while are summed
+EXPIRED_PROCESS = 'expired'
+
+
+def flush_metrics(force=False):
+    """
+    Save the samples of this process to the database, at most every
+    METRICS_FLUSH_INTERVAL seconds unless forced, so /metrics exposes the
+    requests of every process, whichever process serves it.
+    """
+    with _flush_lock:
+        if _process['pid'] != os.getpid():
+            _process.update(
+                pid=os.getpid(), flushed=float('-inf'), saved=None,
+                folded=None, name='{}-{}-{}'.format(
+                    socket.gethostname(), os.getpid(), uuid4().hex[:8]))
+
+        now = time.monotonic()
+        if not force and (
+                now - _process['flushed'] < settings.METRICS_FLUSH_INTERVAL):
+            return
+        samples = {histogram.name: histogram.dump()
+                   for histogram in HISTOGRAMS}
+        if not any(samples.values()):
+            return
+        _process['flushed'] = now
+
+        snapshots = MetricsSnapshot.objects.filter(process=_process['name'])
+        if _process['saved'] is not None:
+            if snapshots.update(
+                    samples=json.dumps(
+                        subtract_samples(samples, _process['folded'])),
+                    updated_at=timezone.now()):
+                _process['saved'] = samples
+                return
+            # Folded into the expired snapshot, only the samples taken since
+            # are saved from now on
+            _process['folded'] = _process['saved']
+
+        MetricsSnapshot.objects.create(
+            process=_process['name'],
+            samples=json.dumps(subtract_samples(samples, _process['folded'])))
+        _process['saved'] = samples
+
+
+def merge_samples(snapshots):
+    """Sum the samples of each histogram of the snapshots, by label values."""
+    merged = {histogram.name: {} for histogram in HISTOGRAMS}
+    for snapshot in snapshots:
+        for name, samples in json.loads(snapshot).items():
+            totals = merged.get(name)
+            if totals is None:
+                continue
+            for values, counts, total in samples:
+                sample = totals.setdefault(
+                    tuple(values), [[0] * len(counts), 0])
+                sample[0] = [a + b for a, b in zip(sample[0], counts)]
+                sample[1] += total
+
+    return {name: [[values, counts, total]
+                   for values, (counts, total) in totals.items()]
+            for name, totals in merged.items()}
+
+
+def subtract_samples(samples, folded):
+    """Return the samples taken after the folded ones, by label values."""
+    if not folded:
+        return samples
+
+    result = {}
+    for name, histogram_samples in samples.items():
+        previous = {tuple(values): (counts, total)
+                    for values, counts, total in folded.get(name, [])}
+        result[name] = []
+        for values, counts, total in histogram_samples:
+            folded_counts, folded_total = previous.get(
+                tuple(values), ([0] * len(counts), 0))
+            counts = [a - b for a, b in zip(counts, folded_counts)]
+            if any(counts):
+                result[name].append([values, counts, total - folded_total])
+    return result
+
+
+def expire_snapshots():
+    """
+    Fold the snapshots not saved for METRICS_SNAPSHOT_TTL seconds, mostly of
+    stopped processes, into the expired snapshot, so the totals are kept
+    without a row per process ever started.
+    """
+    expired_at = timezone.now() - timedelta(
+        seconds=settings.METRICS_SNAPSHOT_TTL)
+    with transaction.atomic():
+        # Locked, so a process saving its snapshot meanwhile sees it folded
+        stale = list(MetricsSnapshot.objects.select_for_update().filter(
+            updated_at__lt=expired_at).exclude(process=EXPIRED_PROCESS))
+        if not stale:
+            return
+
+        expired, _ = MetricsSnapshot.objects.select_for_update(
+        ).get_or_create(process=EXPIRED_PROCESS, defaults={'samples': '{}'})
+        expired.samples = json.dumps(merge_samples(
+            [expired.samples] + [snapshot.samples for snapshot in stale]))
+        expired.save()
+        MetricsSnapshot.objects.filter(
+            pk__in=[snapshot.pk for snapshot in stale]).delete()
+
+
+def render_metrics():
+    """
+    Return every histogram in the Prometheus text format, with the samples
+    saved by every process.
+    """
+    flush_metrics(force=True)
+    expire_snapshots()
+    merged = merge_samples(
+        MetricsSnapshot.objects.values_list('samples', flat=True))
+    return ''.join(histogram.render(merged[histogram.name])
+                   for histogram in HISTOGRAMS)
+
+
+def clear_metrics():
+    for histogram in HISTOGRAMS:
+        histogram.clear()
+    # Saved again from scratch, as a new process
+    with _flush_lock:
+        _process['pid'] = None
+
+
+class RequestMetrics:
+    """Stage latencies and database queries of a sampled request."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.view = None
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.finished = False
+
+    def __call__(self, execute, sql, params, many, context):
+        # Database execute wrapper, counting the queries and their time
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.db_seconds += time.perf_counter() - started
+
+    def observe_stage(self, stage, seconds):
+        if self.view is not None:
+            STAGE_SECONDS.observe(seconds, self.view, stage)
+
+    def finish(self, method, status_code):
+        """Record the request, once, and stop measuring its queries."""
+        if self.finished:
+            return
+        self.finished = True
+
+        if self in connection.execute_wrappers:
+            connection.execute_wrappers.remove(self)
+        if getattr(_local, 'request', None) is self:
+            _local.request = None
+
+        # Requests not routed to a view are not recorded
+        if self.view is not None:
+            REQUEST_SECONDS.observe(
+                time.perf_counter() - self.started,
+                self.view, method, status_code)
+            DB_QUERIES.observe(self.queries, self.view)
+            DB_SECONDS.observe(self.db_seconds, self.view)
+
+            # Not to fail the request, the samples are saved by a later one
+            try:
+                flush_metrics()
+            except DatabaseError:
+                pass
+
+
+class timer:
+    """
+    Measure a stage of the request handled by the current thread.
+
+    Used as a context manager, it does nothing when the request is not
+    sampled. Stages may be nested, each one includes its inner stages.
+    """
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.request = getattr(_local, 'request', None)
+        if self.request is not None:
+            self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.request is not None:
+            self.request.observe_stage(
+                self.stage, time.perf_counter() - self.started)
+
+
+class MeteredContent:
+    """
+    Content of a streaming response, measuring the time spent rendering
+    each chunk. The request is recorded when the response is closed.
+    """
+
+    def __init__(self, content, metrics, method, status_code):
+        self.content = content
+        self.metrics = metrics
+        self.method = method
+        self.status_code = status_code
+        self.seconds = 0.0
+
+    def __iter__(self):
+        iterator = iter(self.content)
+        while True:
+            started = time.perf_counter()
+            try:
+                chunk = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self.seconds += time.perf_counter() - started
+            yield chunk
+
+    def close(self):
+        if not self.metrics.finished:
+            self.metrics.observe_stage('rendering', self.seconds)
+            self.metrics.finish(self.method, self.status_code)
+
+
+class MetricsMiddleware:
+    """
+    Record the latency, stages and database queries of a sample of the
+    requests, with the rate of the METRICS_SAMPLE_RATE setting.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if random.random() >= settings.METRICS_SAMPLE_RATE:
+            return self.get_response(request)
+
+        metrics = RequestMetrics()
+        _local.request = metrics
+        connection.execute_wrappers.append(metrics)
+        try:
+            response = self.get_response(request)
+        except Exception:
+            metrics.finish(request.method, 500)
+            raise
+
+        if response.streaming:
+            # Rendered while sent, the request ends when the response closes
+            response.streaming_content = MeteredContent(
+                response.streaming_content, metrics, request.method,
+                response.status_code)
+        else:
+            metrics.finish(request.method, response.status_code)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        metrics = getattr(_local, 'request', None)
+        if metrics is not None:
+            metrics.view = request.resolver_match.view_name
+
+    def process_template_response(self, request, response):
+        # REST framework responses are rendered after the view returns
+        metrics = getattr(_local, 'request', None)
+        if metrics is not None:
+            started = time.perf_counter()
+            response.add_post_render_callback(
+                lambda response: metrics.observe_stage(
+                    'rendering', time.perf_counter() - started))
+        return response
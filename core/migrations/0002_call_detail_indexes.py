@@ -0,0 +1,111 @@
+# Generated by Django 2.2.5 on 2026-10-18 05:02
+
+from django.db import migrations, models
+
+
+def get_price(start_date, end_date):
+    """
+    Price of a call by the default tariff, frozen as core.utils.get_price was
+    when this migration was written. Calls can be priced again by the current
+    rules with the reprice_calls command.
+    """
+
+    # Calculations if the call started and ended in the same day
+    if start_date.day == end_date.day:
+        reduced_tariff = (
+            start_date.hour >= 22 and end_date.hour >= 22 or
+            start_date.hour < 6 and end_date.hour < 6)
+
+        if reduced_tariff:
+            # Charge only Standing charge
+            return 36
+
+        if start_date.hour < 6:
+            start_date = start_date.replace(hour=6, minute=0, second=0)
+        if end_date.hour >= 22:
+            end_date = end_date.replace(hour=22, minute=0, second=0)
+
+        billed_minutes = (end_date - start_date).seconds // 60
+
+        return billed_minutes * 9 + 36
+
+    # Calculations if the call ended in a following day
+    if end_date.day == start_date.day + 1:
+        if start_date.hour >= 22 and end_date.hour < 6:
+            # Charge only Standing charge
+            return 36
+
+        billed_minutes = 0
+
+        # Calculate minutes that should be billed in day 1
+        if start_date.hour >= 6 and start_date.hour < 22:
+            proxy_end_date = start_date.replace(hour=22, minute=0, second=0)
+            billed_minutes += (proxy_end_date - start_date).seconds // 60
+
+        # Calculate minutes that should be billed in day 2
+        if end_date.hour >= 6 and end_date.hour < 22:
+            proxy_start_date = start_date.replace(hour=6, minute=0, second=0)
+            billed_minutes += (end_date - proxy_start_date).seconds // 60
+
+        return billed_minutes * 9 + 36
+
+    return 36
+
+
+def merge_duplicate_calls(apps, schema_editor):
+    """
+    Merge the CallDetails sharing a call_id into the oldest one, so call_id
+    can be unique.
+
+    Concurrent records of the same call could each create a CallDetail with
+    one of its halves. The first start and the first end found are kept, and
+    the call is completed with the default tariff when it has both.
+    """
+    CallDetail = apps.get_model('core', 'CallDetail')
+
+    call_ids = CallDetail.objects.values('call_id').annotate(
+        count=models.Count('id')).filter(count__gt=1).values_list(
+            'call_id', flat=True)
+
+    for call_id in list(call_ids):
+        calls = list(CallDetail.objects.filter(call_id=call_id).order_by('id'))
+        call = calls[0]
+
+        for other in calls[1:]:
+            if call.started_at is None and other.started_at is not None:
+                call.source = other.source
+                call.destination = other.destination
+                call.started_at = other.started_at
+            if call.ended_at is None and other.ended_at is not None:
+                call.ended_at = other.ended_at
+                call.reference_period = other.reference_period
+
+        if (call.started_at and call.ended_at and
+                call.started_at <= call.ended_at):
+            call.is_completed = True
+            call.duration = int(
+                (call.ended_at - call.started_at).total_seconds())
+            call.price = get_price(call.started_at, call.ended_at)
+
+        call.save()
+        CallDetail.objects.filter(call_id=call_id).exclude(pk=call.pk).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_calls, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='calldetail',
+            name='call_id',
+            field=models.IntegerField(unique=True),
+        ),
+        migrations.AddIndex(
+            model_name='calldetail',
+            index=models.Index(condition=models.Q(is_completed=True), fields=['source', 'reference_period', 'started_at'], name='calldetail_bill_idx'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 2.2.5 on 2026-10-18 05:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_call_detail_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MonthlyBill',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('number', models.CharField(max_length=11)),
+                ('period', models.CharField(max_length=7)),
+                ('call_records', models.TextField()),
+            ],
+            options={
+                'unique_together': {('number', 'period')},
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 2.2.5 on 2026-10-18 05:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_monthly_bill'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tariff',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('effective_from', models.DateTimeField()),
+                ('effective_to', models.DateTimeField(blank=True, null=True)),
+                ('standing_charge', models.IntegerField()),
+                ('standard_minute_charge', models.IntegerField()),
+                ('reduced_minute_charge', models.IntegerField(default=0)),
+                ('standard_start', models.TimeField()),
+                ('standard_end', models.TimeField()),
+            ],
+            options={
+                'ordering': ['effective_from'],
+            },
+        ),
+    ]
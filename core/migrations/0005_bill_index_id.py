@@ -0,0 +1,21 @@
+# Generated by Django 2.2.5 on 2026-10-18 05:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_tariff'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='calldetail',
+            name='calldetail_bill_idx',
+        ),
+        migrations.AddIndex(
+            model_name='calldetail',
+            index=models.Index(condition=models.Q(is_completed=True), fields=['source', 'reference_period', 'started_at', 'id'], name='calldetail_bill_idx'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+from django.db import migrations, models
+
+
+def clear_cached_bills(apps, schema_editor):
+    # Cached bills have no summary, they are rendered again when requested
+    MonthlyBill = apps.get_model('core', 'MonthlyBill')
+    MonthlyBill.objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_bill_index_id'),
+    ]
+
+    operations = [
+        migrations.RunPython(clear_cached_bills, migrations.RunPython.noop),
+        migrations.AddField(
+            model_name='monthlybill',
+            name='summary',
+            field=models.TextField(default='{}'),
+            preserve_default=False,
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 2.2.5 on 2026-10-18 05:12
+
+from django.db import migrations, models
+
+
+def rebuild_rollups(apps, schema_editor):
+    """Roll up the calls completed before the rollups were kept."""
+    CallDetail = apps.get_model('core', 'CallDetail')
+    MonthlyRollup = apps.get_model('core', 'MonthlyRollup')
+
+    totals = CallDetail.objects.filter(is_completed=True).order_by().values(
+        'source', 'reference_period'
+    ).annotate(
+        call_count=models.Count('pk'),
+        total_duration=models.Sum('duration'),
+        total_price=models.Sum('price')
+    )
+    MonthlyRollup.objects.bulk_create(
+        (MonthlyRollup(**row) for row in totals.iterator()), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_monthly_bill_summary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MonthlyRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(max_length=11)),
+                ('reference_period', models.CharField(max_length=7)),
+                ('call_count', models.IntegerField(default=0)),
+                ('total_duration', models.BigIntegerField(default=0)),
+                ('total_price', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'unique_together': {('source', 'reference_period')},
+            },
+        ),
+        migrations.RunPython(rebuild_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 2.2.5 on 2026-10-18 05:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_monthly_rollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QueuedCallRecord',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('record', models.TextField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,96 @@
+from django.conf import settings
+from django.db import migrations
+
+# The partitioned table keeps the columns and id sequence of the original
+# one. Partitions can't have unique constraints without the partition key, so
+# the primary key and call_id are only unique per partition.
+PARTITION_TABLE_SQL = [
+    'ALTER TABLE core_calldetail RENAME TO core_calldetail_unpartitioned',
+    'ALTER INDEX calldetail_bill_idx RENAME TO calldetail_bill_idx_old',
+    'CREATE TABLE core_calldetail ('
+    '    LIKE core_calldetail_unpartitioned INCLUDING DEFAULTS'
+    ') PARTITION BY LIST (reference_period)',
+    'ALTER SEQUENCE core_calldetail_id_seq OWNED BY core_calldetail.id',
+    'CREATE INDEX calldetail_bill_idx ON core_calldetail '
+    '(source, reference_period, started_at, id) WHERE is_completed',
+    'CREATE TABLE core_calldetail_pending PARTITION OF core_calldetail ('
+    '    PRIMARY KEY (id), UNIQUE (call_id)'
+    ') FOR VALUES IN (NULL)',
+    'CREATE TABLE core_calldetail_default PARTITION OF core_calldetail ('
+    '    PRIMARY KEY (id), UNIQUE (call_id)'
+    ') DEFAULT',
+]
+
+PARTITION_SQL = """
+    CREATE TABLE {partition} PARTITION OF core_calldetail (
+        PRIMARY KEY (id), UNIQUE (call_id)
+    ) FOR VALUES IN (%s)
+"""
+
+COPY_CALLS_SQL = [
+    'INSERT INTO core_calldetail SELECT * FROM core_calldetail_unpartitioned',
+    'DROP TABLE core_calldetail_unpartitioned',
+]
+
+UNPARTITION_TABLE_SQL = [
+    'ALTER TABLE core_calldetail RENAME TO core_calldetail_partitioned',
+    'ALTER INDEX calldetail_bill_idx RENAME TO calldetail_bill_idx_old',
+    'CREATE TABLE core_calldetail ('
+    '    LIKE core_calldetail_partitioned INCLUDING DEFAULTS,'
+    '    PRIMARY KEY (id), UNIQUE (call_id)'
+    ')',
+    'ALTER SEQUENCE core_calldetail_id_seq OWNED BY core_calldetail.id',
+    'CREATE INDEX calldetail_bill_idx ON core_calldetail '
+    '(source, reference_period, started_at, id) WHERE is_completed',
+    'INSERT INTO core_calldetail SELECT * FROM core_calldetail_partitioned',
+    'DROP TABLE core_calldetail_partitioned',
+]
+
+
+def use_partitions(schema_editor):
+    # Declarative partitioning with default partitions needs PostgreSQL 11
+    connection = schema_editor.connection
+    return (settings.CALL_DETAIL_PARTITIONS and
+            connection.vendor == 'postgresql' and
+            connection.pg_version >= 110000)
+
+
+def partition_calls(apps, schema_editor):
+    """Partition the calls by reference period, a partition per period."""
+    if not use_partitions(schema_editor):
+        return
+
+    with schema_editor.connection.cursor() as cursor:
+        for sql in PARTITION_TABLE_SQL:
+            cursor.execute(sql)
+
+        cursor.execute(
+            'SELECT DISTINCT reference_period FROM core_calldetail_unpartitioned '
+            'WHERE reference_period IS NOT NULL')
+        for period, in cursor.fetchall():
+            month, year = period.split('/')
+            partition = 'core_calldetail_p{}_{}'.format(year, month)
+            cursor.execute(PARTITION_SQL.format(partition=partition), [period])
+
+        for sql in COPY_CALLS_SQL:
+            cursor.execute(sql)
+
+
+def unpartition_calls(apps, schema_editor):
+    if not use_partitions(schema_editor):
+        return
+
+    with schema_editor.connection.cursor() as cursor:
+        for sql in UNPARTITION_TABLE_SQL:
+            cursor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_queued_call_record'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_calls, unpartition_calls),
+    ]
@@ -0,0 +1,116 @@
+import importlib
+
+import core.fields
+from django.db import migrations, models
+
+# Partitions are by the reference period, whose type can't be changed while
+# the table is partitioned
+partitions = importlib.import_module(
+    'core.migrations.0009_call_detail_partitions')
+
+# Periods become strings of digits in YYYYMM format, cast to integers when
+# their fields are altered
+PERIOD_TO_INTEGER_SQL = [
+    "UPDATE {} SET reference_period = "
+    "substr(reference_period, 4, 4) || substr(reference_period, 1, 2)"
+    .format(table) for table in ('core_calldetail', 'core_monthlyrollup')
+]
+
+PERIOD_TO_STRING_SQL = [
+    "UPDATE {} SET reference_period = "
+    "substr(reference_period, 5, 2) || '/' || substr(reference_period, 1, 4)"
+    .format(table) for table in ('core_calldetail', 'core_monthlyrollup')
+]
+
+# Numbers starting with 0 would lose it when cast to integers, and could
+# then match the numbers of other subscribers
+LEADING_ZERO_SQL = [
+    "SELECT COUNT(*) FROM core_calldetail "
+    "WHERE source LIKE '0%' OR destination LIKE '0%'",
+    "SELECT COUNT(*) FROM core_monthlyrollup WHERE source LIKE '0%'",
+]
+
+
+def check_phone_numbers(apps, schema_editor):
+    """Stop before altering the fields if a number starts with 0."""
+    with schema_editor.connection.cursor() as cursor:
+        for sql in LEADING_ZERO_SQL:
+            cursor.execute(sql)
+            count, = cursor.fetchone()
+            if count:
+                raise ValueError(
+                    '{} rows have phone numbers starting with 0, fix or '
+                    'delete them before migrating.'.format(count))
+
+
+def partition_calls(apps, schema_editor):
+    """Partition the calls again, by the integer reference period."""
+    if not partitions.use_partitions(schema_editor):
+        return
+
+    with schema_editor.connection.cursor() as cursor:
+        for sql in partitions.PARTITION_TABLE_SQL:
+            cursor.execute(sql)
+
+        cursor.execute(
+            'SELECT DISTINCT reference_period FROM core_calldetail_unpartitioned '
+            'WHERE reference_period IS NOT NULL')
+        for period, in cursor.fetchall():
+            partition = 'core_calldetail_p{}_{:02d}'.format(
+                period // 100, period % 100)
+            cursor.execute(
+                partitions.PARTITION_SQL.format(partition=partition),
+                [period])
+
+        for sql in partitions.COPY_CALLS_SQL:
+            cursor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_call_detail_partitions'),
+    ]
+
+    operations = [
+        migrations.RunPython(check_phone_numbers, migrations.RunPython.noop),
+        migrations.RunPython(partitions.unpartition_calls,
+                             partitions.partition_calls),
+        migrations.RunSQL(PERIOD_TO_INTEGER_SQL, PERIOD_TO_STRING_SQL),
+        # SQLite can't rebuild the table with the partial index, it is
+        # created again once the fields are altered
+        migrations.RemoveIndex(
+            model_name='calldetail',
+            name='calldetail_bill_idx',
+        ),
+        migrations.AlterField(
+            model_name='calldetail',
+            name='destination',
+            field=core.fields.PhoneNumberField(null=True),
+        ),
+        migrations.AlterField(
+            model_name='calldetail',
+            name='reference_period',
+            field=core.fields.PeriodField(null=True),
+        ),
+        migrations.AlterField(
+            model_name='calldetail',
+            name='source',
+            field=core.fields.PhoneNumberField(null=True),
+        ),
+        migrations.AlterField(
+            model_name='monthlyrollup',
+            name='reference_period',
+            field=core.fields.PeriodField(),
+        ),
+        migrations.AlterField(
+            model_name='monthlyrollup',
+            name='source',
+            field=core.fields.PhoneNumberField(),
+        ),
+        migrations.AddIndex(
+            model_name='calldetail',
+            index=models.Index(condition=models.Q(is_completed=True), fields=['source', 'reference_period', 'started_at', 'id'], name='calldetail_bill_idx'),
+        ),
+        migrations.RunPython(partition_calls, partitions.unpartition_calls),
+    ]
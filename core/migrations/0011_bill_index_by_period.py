@@ -0,0 +1,21 @@
+# Generated by Django 2.2.5 on 2026-10-18 05:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_compact_call_fields'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='calldetail',
+            name='calldetail_bill_idx',
+        ),
+        migrations.AddIndex(
+            model_name='calldetail',
+            index=models.Index(condition=models.Q(is_completed=True), fields=['reference_period', 'source', 'started_at', 'id'], name='calldetail_bill_idx'),
+        ),
+    ]
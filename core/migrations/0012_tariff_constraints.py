@@ -0,0 +1,22 @@
+# Generated by Django 2.2.5 on 2026-10-18 05:46
+
+from django.db import migrations, models
+import django.db.models.expressions
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_bill_index_by_period'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='tariff',
+            constraint=models.CheckConstraint(check=models.Q(('effective_to__isnull', True), ('effective_to__gt', django.db.models.expressions.F('effective_from')), _connector='OR'), name='tariff_effective_interval'),
+        ),
+        migrations.AddConstraint(
+            model_name='tariff',
+            constraint=models.CheckConstraint(check=models.Q(standard_end__gt=django.db.models.expressions.F('standard_start')), name='tariff_standard_window'),
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 2.2.5 on 2026-10-18 05:53
+
+import os
+import re
+
+import core.fields
+import pyarrow.parquet as pq
+from django.conf import settings
+from django.db import migrations, models
+
+# Files of the periods archived before they were recorded in the database
+ARCHIVE_FILE_RE = re.compile(
+    'reference_period=([0-9]{4})-([0-9]{2})/calls.parquet')
+
+
+def record_archived_periods(apps, schema_editor):
+    """Record the periods archived in the local ARCHIVE_DIR."""
+    ArchivedPeriod = apps.get_model('core', 'ArchivedPeriod')
+    if not os.path.isdir(settings.ARCHIVE_DIR):
+        return
+
+    for name in sorted(os.listdir(settings.ARCHIVE_DIR)):
+        path = '{}/calls.parquet'.format(name)
+        match = ARCHIVE_FILE_RE.fullmatch(path)
+        if not match or not os.path.exists(
+                os.path.join(settings.ARCHIVE_DIR, path)):
+            continue
+
+        metadata = pq.read_metadata(os.path.join(settings.ARCHIVE_DIR, path))
+        ArchivedPeriod.objects.create(
+            period='{}/{}'.format(match[2], match[1]), path=path,
+            call_count=metadata.num_rows)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_tariff_constraints'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedPeriod',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', core.fields.PeriodField(unique=True)),
+                ('path', models.CharField(max_length=255)),
+                ('call_count', models.BigIntegerField()),
+                ('archived_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(record_archived_periods,
+                             migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.5 on 2026-10-18 06:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_metrics_snapshot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='monthlybill',
+            name='version',
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -1,4 +1,53 @@
-from django.db import models
+from collections import defaultdict
+
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, models, transaction
+
+from core.fields import PeriodField, PhoneNumberField
+from core.utils import TariffTable, is_closed_period
+
+# Number of rollups written at once when rebuilding
+ROLLUP_CHUNK_SIZE = 5000
+
+
+class CallDetailQuerySet(models.QuerySet):
+    def bill(self, number, period):
+        """Completed calls of a subscriber in a period, ordered by start."""
+        return self.filter(
+            source=number,
+            reference_period=period,
+            is_completed=True
+        ).order_by('started_at', 'pk')
+
+    def after(self, started_at, pk):
+        """Calls after the position (started_at, id) in a bill."""
+        # The first condition bounds the index range, the second skips the
+        # calls started at the same time before the position
+        return self.filter(started_at__gte=started_at).filter(
+            models.Q(started_at__gt=started_at) | models.Q(pk__gt=pk))
+
+    def export(self, period):
+        """
+        Completed calls of every subscriber in a period, ordered by
+        subscriber and start.
+        """
+        return self.filter(
+            reference_period=period,
+            is_completed=True
+        ).order_by('source', 'started_at', 'pk')
+
+    def summary(self):
+        """
+        Totals of the calls per destination, computed by the database in a
+        single query, ordered by destination.
+        """
+        return list(self.order_by('destination').values(
+            'destination'
+        ).annotate(
+            call_count=models.Count('pk'),
+            total_duration=models.Sum('duration'),
+            total_price=models.Sum('price')
+        ))
 
 
 class CallDetail(models.Model):
@@ -13,19 +62,20 @@ class CallDetail(models.Model):
     """
 
     # Call Id from telephone central
-    call_id = models.IntegerField()
-    # Phone number that started the call
-    source = models.CharField(max_length=11, null=True)
-    # Phone number that received the call
-    destination = models.CharField(max_length=11, null=True)
+    call_id = models.IntegerField(unique=True)
+    # Phone number that started the call, stored as an integer
+    source = PhoneNumberField(null=True)
+    # Phone number that received the call, stored as an integer
+    destination = PhoneNumberField(null=True)
 
     # Duration is stored in seconds for easier formatting
     duration = models.IntegerField(null=True)
     # Price is stored in cents for more acurate currency handling
     price = models.IntegerField(null=True)
 
-    # month/year format: MM/YYYY, defined by the time the call ended
-    reference_period = models.CharField(max_length=7, null=True)
+    # month/year format: MM/YYYY, defined by the time the call ended, stored
+    # as an integer YYYYMM
+    reference_period = PeriodField(null=True)
     # Call start datetime in UTC
     started_at = models.DateTimeField(null=True)
     # Call end datetime in UTC
@@ -33,3 +83,341 @@ class CallDetail(models.Model):
 
     # Field to tell if start and end records where filled in the db record
     is_completed = models.BooleanField(default=False)
+
+    objects = CallDetailQuerySet.as_manager()
+
+    def totals(self):
+        """
+        Return what the call adds to the rollup of its subscriber and period,
+        as a (source, reference_period, duration, price) tuple, or None if the
+        call is not completed.
+        """
+        if not self.is_completed:
+            return None
+        return (self.source, self.reference_period, self.duration, self.price)
+
+    class Meta:
+        indexes = [
+            # Covers the bill query: filter by subscriber and period of
+            # completed calls, ordered by start datetime and id, which is
+            # also the position of the keyset pagination. Leading with the
+            # period, it also covers the export of every subscriber in a
+            # period, ordered by subscriber, start datetime and id
+            models.Index(
+                fields=['reference_period', 'source', 'started_at', 'id'],
+                name='calldetail_bill_idx',
+                condition=models.Q(is_completed=True)),
+        ]
+
+
+class MonthlyBillQuerySet(models.QuerySet):
+    def invalidate(self, changes):
+        """
+        Invalidate the cached bills of the calls changed, given as
+        (previous totals, totals) pairs of the calls.
+
+        A call leaves the bill it belonged to when a repeated record changes
+        its subscriber or period, so both bills are invalidated. Their
+        records are emptied and their version bumped, the row being created
+        if the bill was not cached, so a bill rendered from the calls read
+        before the change is not cached afterwards.
+        """
+        keys = {
+            (totals[0], totals[1])
+            for change in changes for totals in change
+            if totals is not None and is_closed_period(totals[1])
+        }
+        if not keys:
+            return
+
+        for number, period in sorted(keys):
+            bills = self.filter(number=number, period=period)
+            invalidated = {'version': models.F('version') + 1,
+                           'call_records': '', 'summary': ''}
+            if bills.update(**invalidated):
+                continue
+            # Created by a concurrent request in between otherwise
+            try:
+                with transaction.atomic():
+                    self.create(number=number, period=period, version=1,
+                                call_records='', summary='')
+            except IntegrityError:
+                bills.update(**invalidated)
+
+    def cache(self, number, period, version, call_records, summary):
+        """
+        Cache the rendered records and summary of a bill, unless it was
+        invalidated since its version was read, None if it had no row.
+        """
+        rendered = {'call_records': call_records, 'summary': summary}
+        if version is None:
+            self.get_or_create(number=number, period=period, defaults=rendered)
+        else:
+            self.filter(number=number, period=period,
+                        version=version).update(**rendered)
+
+
+class MonthlyBill(models.Model):
+    """
+    Cache of the call records of a subscriber bill in a closed period.
+
+    Bills of closed periods only change when a late record completes a call,
+    so the rendered call records are stored and served by a single key lookup
+    until a call of that subscriber and period is completed. Bills without
+    calls are not cached.
+    """
+
+    # Phone number of the subscriber
+    number = models.CharField(max_length=11)
+    # month/year format: MM/YYYY
+    period = models.CharField(max_length=7)
+
+    # Rendered call records of the bill as a JSON list, empty while the bill
+    # is invalidated
+    call_records = models.TextField()
+    # Rendered summary of the bill as a JSON object
+    summary = models.TextField()
+    # Bumped each time the bill is invalidated
+    version = models.IntegerField(default=0)
+
+    objects = MonthlyBillQuerySet.as_manager()
+
+    class Meta:
+        unique_together = [['number', 'period']]
+
+
+class Tariff(models.Model):
+    """
+    Call charges effective in an interval of time.
+
+    Calls are priced by the tariff effective when they ended. Intervals are
+    closed at the start and open at the end, a tariff without an end date is
+    effective until further notice. When no tariff is effective the default
+    tariff table is used.
+    """
+
+    # Datetime in UTC when the tariff starts to be charged
+    effective_from = models.DateTimeField()
+    # Datetime in UTC when the tariff stops being charged (excluding)
+    effective_to = models.DateTimeField(null=True, blank=True)
+
+    # Charges are stored in cents
+    standing_charge = models.IntegerField()
+    standard_minute_charge = models.IntegerField()
+    reduced_minute_charge = models.IntegerField(default=0)
+
+    # Standard time window, the rest of the day is reduced tariff time
+    standard_start = models.TimeField()
+    standard_end = models.TimeField()
+
+    class Meta:
+        ordering = ['effective_from']
+        constraints = [
+            models.CheckConstraint(
+                check=(models.Q(effective_to__isnull=True) |
+                       models.Q(effective_to__gt=models.F('effective_from'))),
+                name='tariff_effective_interval'),
+            models.CheckConstraint(
+                check=models.Q(standard_end__gt=models.F('standard_start')),
+                name='tariff_standard_window'),
+        ]
+
+    def clean(self):
+        """
+        Validate the intervals, a call must have a single effective tariff.
+
+        The intervals order is also checked by the database, overlapping
+        tariffs only here, as the lookup picks one of them.
+        """
+        if self.effective_to and self.effective_from and (
+                self.effective_to <= self.effective_from):
+            raise ValidationError({
+                'effective_to': 'effective_to must be after effective_from.'
+            })
+
+        if self.standard_start and self.standard_end and (
+                self.standard_end <= self.standard_start):
+            raise ValidationError({
+                'standard_end': 'standard_end must be after standard_start.'
+            })
+
+        if self.effective_from:
+            overlapping = Tariff.objects.exclude(pk=self.pk).filter(
+                models.Q(effective_to__isnull=True) |
+                models.Q(effective_to__gt=self.effective_from))
+            if self.effective_to:
+                overlapping = overlapping.filter(
+                    effective_from__lt=self.effective_to)
+            if overlapping.exists():
+                raise ValidationError(
+                    'The tariff overlaps the tariff effective from {}.'.format(
+                        overlapping.first().effective_from))
+
+    def as_table(self):
+        """Return the TariffTable used to price calls."""
+        return TariffTable(
+            standing_charge=self.standing_charge,
+            standard_minute_charge=self.standard_minute_charge,
+            reduced_minute_charge=self.reduced_minute_charge,
+            standard_start=time_to_seconds(self.standard_start),
+            standard_end=time_to_seconds(self.standard_end),
+        )
+
+
+def time_to_seconds(time):
+    """Seconds since the beginning of the day"""
+    return time.hour * 3600 + time.minute * 60 + time.second
+
+
+class MonthlyRollupQuerySet(models.QuerySet):
+    def add(self, source, period, call_count, total_duration, total_price):
+        """Add totals to the rollup of a subscriber and period."""
+        updated = self.filter(source=source, reference_period=period).update(
+            call_count=models.F('call_count') + call_count,
+            total_duration=models.F('total_duration') + total_duration,
+            total_price=models.F('total_price') + total_price)
+        if updated:
+            return
+
+        try:
+            with transaction.atomic():
+                self.create(
+                    source=source, reference_period=period,
+                    call_count=call_count, total_duration=total_duration,
+                    total_price=total_price)
+        except IntegrityError:
+            # Created meanwhile by a concurrent request
+            self.add(source, period, call_count, total_duration, total_price)
+
+    def apply_changes(self, changes):
+        """
+        Update the rollups from the changed calls.
+
+        changes are pairs of CallDetail.totals(), before and after the change.
+        """
+        deltas = defaultdict(lambda: [0, 0, 0])
+        for before, after in changes:
+            if before == after:
+                continue
+
+            for totals, sign in [(before, -1), (after, 1)]:
+                if totals is None:
+                    continue
+                source, period, duration, price = totals
+                delta = deltas[(source, period)]
+                delta[0] += sign
+                delta[1] += sign * duration
+                delta[2] += sign * price
+
+        for (source, period), delta in deltas.items():
+            if any(delta):
+                self.add(source, period, *delta)
+
+    def rebuild(self, period=None, exclude=()):
+        """
+        Rebuild the rollups from the completed calls, of all periods or of a
+        single one, returning the number of rollups created. Rollups of the
+        excluded periods are kept.
+        """
+        calls = CallDetail.objects.filter(is_completed=True).exclude(
+            reference_period__in=exclude)
+        rollups = self.exclude(reference_period__in=exclude)
+        if period:
+            calls = calls.filter(reference_period=period)
+            rollups = rollups.filter(reference_period=period)
+
+        totals = calls.order_by().values(
+            'source', 'reference_period'
+        ).annotate(
+            call_count=models.Count('pk'),
+            total_duration=models.Sum('duration'),
+            total_price=models.Sum('price')
+        )
+
+        with transaction.atomic():
+            rollups.delete()
+
+            count = 0
+            chunk = []
+            for row in totals.iterator(chunk_size=ROLLUP_CHUNK_SIZE):
+                chunk.append(MonthlyRollup(**row))
+                if len(chunk) == ROLLUP_CHUNK_SIZE:
+                    self.bulk_create(chunk)
+                    count += len(chunk)
+                    chunk = []
+
+            self.bulk_create(chunk)
+            count += len(chunk)
+
+        return count
+
+
+class MonthlyRollup(models.Model):
+    """
+    Totals of the completed calls of a subscriber in a period.
+
+    Rollups are updated as calls are completed, so spending of all subscribers
+    can be read without going through the calls. They can be rebuilt from the
+    calls with the rebuild_rollups command.
+    """
+
+    # Phone number of the subscriber
+    source = PhoneNumberField()
+    # month/year format: MM/YYYY, stored as an integer YYYYMM
+    reference_period = PeriodField()
+
+    call_count = models.IntegerField(default=0)
+    # Duration is stored in seconds
+    total_duration = models.BigIntegerField(default=0)
+    # Price is stored in cents
+    total_price = models.BigIntegerField(default=0)
+
+    objects = MonthlyRollupQuerySet.as_manager()
+
+    class Meta:
+        unique_together = [['source', 'reference_period']]
+
+
+class ArchivedPeriod(models.Model):
+    """
+    Period whose completed calls were moved out of the database, into a
+    Parquet file of the archive.
+
+    The file is replaced along with the calls deleted from the database in
+    the same transaction, so bills never read the calls of both.
+    """
+
+    # month/year format: MM/YYYY, stored as an integer YYYYMM
+    period = PeriodField(unique=True)
+    # Path of the current file of the period, relative to ARCHIVE_DIR
+    path = models.CharField(max_length=255)
+    # Number of calls in the file
+    call_count = models.BigIntegerField()
+    archived_at = models.DateTimeField(auto_now=True)
+
+
+class QueuedCallRecord(models.Model):
+    """
+    Start or End Call Record waiting to be saved by the queue worker.
+
+    Records are validated before being queued and saved in arrival order, in
+    batches, by the process_queue command.
+    """
+
+    # Call record as received, in JSON
+    record = models.TextField()
+    # Datetime the record was queued, to measure the queue lag
+    created_at = models.DateTimeField(auto_now_add=True)
+
+
+class MetricsSnapshot(models.Model):
+    """
+    Histograms of the sampled requests of a process, saved periodically, so
+    /metrics exposes the requests of every worker process of every instance.
+    """
+
+    # Host, process id and a random suffix, unique to each process
+    process = models.CharField(max_length=255, unique=True)
+    # Samples of each histogram, by name, in JSON
+    samples = models.TextField()
+    updated_at = models.DateTimeField(auto_now=True)
@@ -0,0 +1,40 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime, timezone
+
+
+def encode_cursor(call):
+    """Encode the position of a call in the bill as an opaque cursor."""
+    position = '{}:{}'.format(int(call.started_at.timestamp()), call.pk)
+    return urlsafe_b64encode(position.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """
+    Decode a cursor into the start datetime and id of a call.
+
+    Raises ValueError if the cursor is invalid.
+    """
+    try:
+        position = urlsafe_b64decode(cursor.encode()).decode()
+        timestamp, pk = position.split(':')
+        started_at = datetime.fromtimestamp(int(timestamp), timezone.utc)
+        return started_at, int(pk)
+    except (TypeError, ValueError, OverflowError, OSError):
+        raise ValueError('Invalid cursor: {}'.format(cursor))
+
+
+def paginate_bill(calls, cursor, limit):
+    """
+    Return a page of the calls of a bill and the cursor of the next page.
+
+    Pages are found by the position of the last call of the previous page,
+    (started_at, id), so every page costs the same for the database whatever
+    its position in the bill. The next cursor is None on the last page.
+    """
+    if cursor:
+        calls = calls.after(*decode_cursor(cursor))
+
+    page = list(calls[:limit + 1])
+    if len(page) > limit:
+        return page[:limit], encode_cursor(page[limit - 1])
+    return page, None
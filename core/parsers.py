@@ -0,0 +1,27 @@
+import json
+
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+
+
+class NDJSONParser(BaseParser):
+    """Parse newline delimited JSON, one record per line, into a list."""
+
+    media_type = 'application/x-ndjson'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', 'utf-8')
+
+        records = []
+        for number, line in enumerate(stream, start=1):
+            try:
+                line = line.decode(encoding).strip()
+                if not line:
+                    continue
+                records.append(json.loads(line))
+            except ValueError as exc:
+                raise ParseError(
+                    'NDJSON parse error on line %d - %s' % (number, exc))
+
+        return records
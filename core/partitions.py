@@ -0,0 +1,112 @@
+from datetime import date, timedelta
+
+from django.db import connection, transaction
+
+from core.utils import parse_period
+
+# Partitions of the calls without a reference period (not ended yet) and of
+# the periods without a partition of their own
+PENDING_PARTITION = 'core_calldetail_pending'
+DEFAULT_PARTITION = 'core_calldetail_default'
+
+# A partition is created detached, filled with the calls of its period saved
+# in the default partition, and attached, so periods can be partitioned even
+# after their calls started to be saved
+CREATE_PARTITION_SQL = """
+    CREATE TABLE {partition} (
+        LIKE core_calldetail INCLUDING DEFAULTS,
+        PRIMARY KEY (id),
+        UNIQUE (call_id)
+    )
+"""
+
+MOVE_CALLS_SQL = """
+    WITH moved AS (
+        DELETE FROM {default} WHERE reference_period = %s RETURNING *
+    )
+    INSERT INTO {partition} SELECT * FROM moved
+"""
+
+ATTACH_PARTITION_SQL = """
+    ALTER TABLE core_calldetail ATTACH PARTITION {partition}
+        FOR VALUES IN (%s)
+"""
+
+IS_PARTITIONED_SQL = """
+    SELECT EXISTS (
+        SELECT 1 FROM pg_partitioned_table
+        WHERE partrelid = to_regclass('core_calldetail')
+    )
+"""
+
+# Transaction locks of call ids, taken in order to avoid deadlocks
+LOCK_CALLS_SQL = """
+    SELECT COUNT(pg_advisory_xact_lock(call_id))
+    FROM (SELECT unnest(%s::integer[]) AS call_id ORDER BY 1) AS calls
+"""
+
+
+def is_partitioned():
+    """
+    Tell if the CallDetail table is partitioned by reference period, as found
+    in the catalog once per database connection.
+    """
+    if connection.vendor != 'postgresql' or connection.pg_version < 100000:
+        return False
+
+    # Partitioning is set by the migrations, whatever the setting is now
+    partitioned = getattr(connection, 'calldetail_partitioned', None)
+    if partitioned is None:
+        with connection.cursor() as cursor:
+            cursor.execute(IS_PARTITIONED_SQL)
+            partitioned = cursor.fetchone()[0]
+        connection.calldetail_partitioned = partitioned
+    return partitioned
+
+
+def partition_name(period):
+    month, year = period.split('/')
+    return 'core_calldetail_p{}_{}'.format(year, month)
+
+
+def next_period():
+    """Return the period of the next month, in the format MM/YYYY."""
+    next_month = date.today().replace(day=1) + timedelta(days=32)
+    return next_month.strftime('%m/%Y')
+
+
+def create_partition(period):
+    """
+    Create the partition of the calls of a period, returning False if it
+    already exists.
+    """
+    partition = partition_name(period)
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute('SELECT to_regclass(%s)', [partition])
+        if cursor.fetchone()[0] is not None:
+            return False
+
+        cursor.execute(CREATE_PARTITION_SQL.format(partition=partition))
+        # Periods are stored as integers YYYYMM
+        cursor.execute(MOVE_CALLS_SQL.format(
+            default=DEFAULT_PARTITION, partition=partition),
+            [parse_period(period)])
+        cursor.execute(ATTACH_PARTITION_SQL.format(partition=partition),
+                       [parse_period(period)])
+
+    return True
+
+
+def lock_calls(call_ids):
+    """
+    Lock call ids until the end of the transaction.
+
+    Partitions can't have a unique constraint on call_id alone, so records
+    of the same call are serialized by these locks instead.
+    """
+    if not is_partitioned():
+        return
+
+    with connection.cursor() as cursor:
+        cursor.execute(LOCK_CALLS_SQL, [sorted(call_ids)])
@@ -0,0 +1,65 @@
+import numpy as np
+
+from core.utils import DEFAULT_TARIFF, SECONDS_PER_DAY
+
+
+def to_epoch_seconds(dates):
+    """Convert timezone aware datetimes to an array of UTC epoch seconds"""
+    return np.fromiter((int(date.timestamp()) for date in dates),
+                       dtype=np.int64)
+
+
+def get_prices(started_at, ended_at, tariff=DEFAULT_TARIFF):
+    """
+    Calculate prices of many calls at once, with the rules of get_price
+
+    started_at and ended_at are sequences of UTC epoch seconds, the prices
+    are returned in cents as an array of the same size.
+    """
+    started_at = np.asarray(started_at, dtype=np.int64)
+    ended_at = np.asarray(ended_at, dtype=np.int64)
+
+    window_minutes = (tariff.standard_end - tariff.standard_start) // 60
+    start_day, start_time = np.divmod(started_at, SECONDS_PER_DAY)
+    end_day, end_time = np.divmod(ended_at, SECONDS_PER_DAY)
+    days = end_day - start_day
+
+    # Standard time seconds from the beginning of the day until the time
+    start_standard = np.clip(
+        start_time, tariff.standard_start, tariff.standard_end
+    ) - tariff.standard_start
+    end_standard = np.clip(
+        end_time, tariff.standard_start, tariff.standard_end
+    ) - tariff.standard_start
+
+    same_day_minutes = (end_standard - start_standard) // 60
+    many_days_minutes = (
+        window_minutes - (start_standard + 59) // 60 +
+        end_standard // 60 +
+        np.maximum(days - 1, 0) * window_minutes)
+
+    standard_minutes = np.where(
+        days == 0, same_day_minutes, many_days_minutes)
+    reduced_minutes = (ended_at - started_at) // 60 - standard_minutes
+
+    return (tariff.standing_charge +
+            standard_minutes * tariff.standard_minute_charge +
+            reduced_minutes * tariff.reduced_minute_charge)
+
+
+def get_prices_by_tariff(started_at, ended_at, lookup):
+    """
+    Calculate prices of many calls at once, each call priced by the tariff
+    of the TariffLookup effective when it ended
+    """
+    started_at = np.asarray(started_at, dtype=np.int64)
+    ended_at = np.asarray(ended_at, dtype=np.int64)
+
+    indexes = lookup.indexes(ended_at)
+    prices = np.empty(len(ended_at), dtype=np.int64)
+    for index in np.unique(indexes):
+        calls = indexes == index
+        prices[calls] = get_prices(
+            started_at[calls], ended_at[calls], lookup.table(index))
+
+    return prices
@@ -0,0 +1,158 @@
+import cProfile
+import marshal
+import time
+from uuid import uuid4
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+from core.storage import open_filesystem
+
+
+def client_address(request):
+    """
+    Return the address of the client, as seen by the outermost of the
+    PROFILING_TRUSTED_PROXIES proxies in front of the app, like the Heroku
+    router, which append it to the X-Forwarded-For header.
+    """
+    proxies = settings.PROFILING_TRUSTED_PROXIES
+    if not proxies:
+        return request.META.get('REMOTE_ADDR')
+
+    # Addresses before the ones added by the trusted proxies can be forged
+    addresses = [
+        address.strip() for address in
+        request.META.get('HTTP_X_FORWARDED_FOR', '').split(',')
+        if address.strip()]
+    if len(addresses) < proxies:
+        return None
+    return addresses[-proxies]
+
+
+def profiling_requested(request):
+    """Tell if the request asks to be profiled and is allowed to."""
+    if not settings.PROFILING_DIR:
+        return False
+    if (request.META.get('HTTP_X_PROFILE') != 'true' and
+            request.GET.get('profile') != 'true'):
+        return False
+
+    # Only staff users, logged in with a session, or allowed addresses
+    user = getattr(request, 'user', None)
+    return bool(
+        (user is not None and user.is_staff) or
+        client_address(request) in settings.PROFILING_ALLOWED_IPS)
+
+
+class RequestProfile:
+    """
+    Python profile and SQL queries of a request, written to PROFILING_DIR, a
+    local directory or the URI of a shared storage, as a pstats file (.prof)
+    and a text file (.sql) with the same name.
+    """
+
+    def __init__(self, request):
+        self.name = '{}-{}'.format(
+            timezone.now().strftime('%Y%m%dT%H%M%S'), uuid4().hex[:8])
+        self.request_line = '{} {}'.format(
+            request.method, request.get_full_path())
+        self.profile = cProfile.Profile()
+        self.queries = []
+        self.saved = False
+
+    def __call__(self, execute, sql, params, many, context):
+        # Database execute wrapper, keeping the queries and their time
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append(
+                (sql, params, time.perf_counter() - started))
+
+    def __enter__(self):
+        connection.execute_wrappers.append(self)
+        self.profile.enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profile.disable()
+        connection.execute_wrappers.remove(self)
+
+    def save(self):
+        """Write the profile and the queries, once."""
+        if self.saved:
+            return
+        self.saved = True
+
+        filesystem, base_path = open_filesystem(settings.PROFILING_DIR)
+        filesystem.create_dir(base_path, recursive=True)
+        path = '{}/{}'.format(base_path, self.name)
+
+        # The pstats format, as written by Profile.dump_stats
+        self.profile.create_stats()
+        with filesystem.open_output_stream(path + '.prof') as stream:
+            stream.write(marshal.dumps(self.profile.stats))
+
+        lines = [
+            '-- {}\n'.format(self.request_line),
+            '-- {} queries in {:.2f}ms\n'.format(
+                len(self.queries),
+                sum(seconds for _, _, seconds in self.queries) * 1000),
+        ]
+        for sql, params, seconds in self.queries:
+            lines.append('\n-- {:.2f}ms, params: {!r}\n{};\n'.format(
+                seconds * 1000, params, sql.strip()))
+        with filesystem.open_output_stream(path + '.sql') as stream:
+            stream.write(''.join(lines).encode())
+
+
+class ProfiledContent:
+    """
+    Content of a streaming response, profiling the rendering of each chunk.
+    The profile is written when the response is closed.
+    """
+
+    def __init__(self, content, profile):
+        self.content = content
+        self.profile = profile
+
+    def __iter__(self):
+        iterator = iter(self.content)
+        while True:
+            with self.profile:
+                try:
+                    chunk = next(iterator)
+                except StopIteration:
+                    return
+            yield chunk
+
+    def close(self):
+        self.profile.save()
+
+
+class ProfilingMiddleware:
+    """
+    Profile the requests flagged with the "X-Profile: true" header or the
+    "profile=true" query parameter, when PROFILING_DIR is set.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not profiling_requested(request):
+            return self.get_response(request)
+
+        profile = RequestProfile(request)
+        with profile:
+            response = self.get_response(request)
+
+        if response.streaming:
+            # Rendered while sent, profiled until the response closes
+            response.streaming_content = ProfiledContent(
+                response.streaming_content, profile)
+        else:
+            profile.save()
+        response['X-Profile'] = profile.name
+        return response
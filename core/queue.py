@@ -0,0 +1,60 @@
+import json
+import logging
+
+from django.db import connection, transaction
+from django.db.models import Count, Min
+from django.utils import timezone
+
+from core.ingest import ingest_records
+from core.models import QueuedCallRecord
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue_records(records):
+    """Append validated records to the queue, in a single statement."""
+    QueuedCallRecord.objects.bulk_create([
+        QueuedCallRecord(record=json.dumps(record)) for record in records
+    ])
+
+
+def process_queue(batch_size):
+    """
+    Save the oldest batch of queued records, pairing and pricing them with
+    the batch ingestion, and remove them from the queue.
+
+    Records are locked while saved, so many workers can process the queue at
+    the same time on databases supporting SKIP LOCKED. Returns the number of
+    records taken from the queue.
+    """
+    queued = QueuedCallRecord.objects.order_by('pk')
+    if connection.features.has_select_for_update_skip_locked:
+        queued = queued.select_for_update(skip_locked=True)
+
+    with transaction.atomic():
+        batch = list(queued[:batch_size])
+        if not batch:
+            return 0
+
+        records = [json.loads(queued_record.record) for queued_record in batch]
+        _, errors = ingest_records(records)
+
+        # Invalid records can't be saved at all, they are dropped and logged
+        for error in errors:
+            logger.warning('Dropped queued call record %s: %s',
+                           records[error['index']], error['errors'])
+
+        QueuedCallRecord.objects.filter(
+            pk__in=[queued_record.pk for queued_record in batch]).delete()
+
+    return len(batch)
+
+
+def queue_lag():
+    """Return the number of queued records and the age of the oldest one."""
+    lag = QueuedCallRecord.objects.aggregate(
+        depth=Count('pk'), oldest=Min('created_at'))
+    oldest = lag['oldest']
+    age = (timezone.now() - oldest).total_seconds() if oldest else 0.0
+
+    return lag['depth'], age
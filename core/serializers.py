@@ -1,122 +1,29 @@
-from datetime import date, datetime, timedelta, timezone
+from datetime import datetime, timedelta
 import re
 
+from django.conf import settings
 from rest_framework import serializers
-from core.models import CallDetail
-from core.utils import get_price, format_duration
+from core.metrics import timer
+from core.models import CallDetail, MonthlyBill, MonthlyRollup
+from core.pagination import decode_cursor
+from core.tariffs import get_tariff_lookup
+from core.utils import (
+    format_duration, format_price, get_price, is_closed_period)
+from core.validators import validate_call_order, validate_call_record
 
 
 class CallDetailSerializer(serializers.BaseSerializer):
     def to_internal_value(self, data):
-        call_id = data.get("call_id")
-        call_type = data.get("type")
-        timestamp = data.get("timestamp")
-        source = data.get("source")
-        destination = data.get("destination")
-
-        # Validate required fields
-        if not call_id:
-            raise serializers.ValidationError({
-                'call_id': 'This field is required.'
-            })
-
-        if not call_type:
-            raise serializers.ValidationError({
-                'type': 'This field is required.'
-            })
-
-        if not timestamp:
-            raise serializers.ValidationError({
-                'timestamp': 'This field is required.'
-            })
-
-        if call_type == "start" and not source:
-            raise serializers.ValidationError({
-                'source': 'This field is required if call type is start.'
-            })
-
-        if call_type == "start" and not destination:
-            raise serializers.ValidationError({
-                'destination': 'This field is required if call type is start.'
-            })
-
-        # Validate field types
-        if not isinstance(timestamp, str):
-            raise serializers.ValidationError({
-                'timestamp': 'timestamp must be a string.'
-            })
-
-        if not isinstance(call_id, int):
-            raise serializers.ValidationError({
-                'call_id': 'call_id must be an integer.'
-            })
-
-        if call_type == "start":
-            if not isinstance(source, str):
-                raise serializers.ValidationError({
-                    'source': 'source must be a string.'
-                })
-
-            if not isinstance(destination, str):
-                raise serializers.ValidationError({
-                    'destination': 'destination must be a string.'
-                })
-
-        # Validate field formats
-        if call_type not in ["start", "end"]:
-            raise serializers.ValidationError({
-                'type':
-                    'type must be a string with value "start" or "end".'
-            })
-
-        try:
-            date = datetime.strptime(timestamp, "%Y-%m-%dT%H:%M:%SZ")
-            date = date.replace(tzinfo=timezone.utc)
-        except ValueError:
-            raise serializers.ValidationError({
-                'timestamp':
-                    'timestamp must be in the format: "YYYY-MM-DDThh:mm:ssZ"'
-            })
-
-        if call_type == "start":
-            if not re.match("^\d{10}$|^\d{11}$", source):
-                raise serializers.ValidationError({
-                    'source':
-                        'source must be a string of 10 or 11 digits.'
-                })
-
-            if not re.match("^\d{10}$|^\d{11}$", destination):
-                raise serializers.ValidationError({
-                    'destination':
-                        'destination must be a string of 10 or 11 digits.'
-                })
-
-        validated_data = {
-            'call_id': call_id,
-        }
+        validated_data, errors = validate_call_record(data)
+        if errors:
+            raise serializers.ValidationError(errors)
 
         # Check if this is an already created register to validate dates
         if self.instance:
-            if call_type == "start" and date > self.instance.ended_at:
-                raise serializers.ValidationError({
-                    'timestamp': ('Start Record Call timestamp cannot be '
-                                  'after End Record Call timestamp.')
-                })
-
-            if call_type == "end" and date < self.instance.started_at:
-                raise serializers.ValidationError({
-                    'timestamp': ('End Record Call timestamp cannot be '
-                                  'before Start Record Call timestamp.')
-                })
-
-        # import pdb; pdb.set_trace()
-        if call_type == "start":
-            validated_data['source'] = source
-            validated_data['destination'] = destination
-            validated_data['started_at'] = date
-        elif call_type == "end":
-            validated_data['ended_at'] = date
-            validated_data['reference_period'] = date.strftime("%m/%Y")
+            errors = validate_call_order(
+                self.instance, data['type'], validated_data)
+            if errors:
+                raise serializers.ValidationError(errors)
 
         return validated_data
 
@@ -127,34 +34,50 @@ class CallDetailSerializer(serializers.BaseSerializer):
         return CallDetail.objects.create(**validated_data)
 
     def update(self, instance, validated_data):
-        if self.initial_data["type"] == "start":
-            instance.source = validated_data['source']
-            instance.destination = validated_data['destination']
-            instance.started_at = validated_data['started_at']
-
-            # If instance already saved the "end" portion of the call,
-            # mark it as complete and calculate duration
-            if (instance.ended_at):
-                instance.is_completed = True
-                instance.duration = (
-                    instance.ended_at - instance.started_at).seconds
-
-        elif self.initial_data["type"] == "end":
-            instance.ended_at = validated_data['ended_at']
-            instance.reference_period = validated_data['reference_period']
-
-            # If instance already saved the "start" portion of the call,
-            # mark it as complete and calculate duration
-            if (instance.started_at):
-                instance.is_completed = True
-                instance.duration = (
-                    instance.ended_at - instance.started_at).seconds
-
-        instance.price = get_price(instance.started_at, instance.ended_at)
+        previous_totals = instance.totals()
+        self.merge(instance, validated_data)
 
         instance.save()
+        changes = [(previous_totals, instance.totals())]
+        MonthlyRollup.objects.apply_changes(changes)
+        # A late record may change the bill of an already closed period
+        MonthlyBill.objects.invalidate(changes)
         return instance
 
+    def merge(self, instance, validated_data):
+        """Fill the instance with the Start or End record, without saving."""
+        return merge_record(
+            instance, self.initial_data["type"], validated_data)
+
+
+def merge_record(call, call_type, validated_data):
+    """Fill the call with a Start or End record, without saving."""
+    if call_type == "start":
+        call.source = validated_data['source']
+        call.destination = validated_data['destination']
+        call.started_at = validated_data['started_at']
+
+    elif call_type == "end":
+        call.ended_at = validated_data['ended_at']
+        call.reference_period = validated_data['reference_period']
+
+    # If call already saved the other portion of the call,
+    # mark it as complete and calculate duration and price
+    if call.started_at and call.ended_at:
+        complete_call(call)
+
+    return call
+
+
+def complete_call(call):
+    """Mark a call with both records as completed, with duration and price."""
+    call.is_completed = True
+    call.duration = int((call.ended_at - call.started_at).total_seconds())
+
+    with timer('get_price'):
+        tariff = get_tariff_lookup().get(call.ended_at)
+        call.price = get_price(call.started_at, call.ended_at, tariff)
+
 
 class MonthlyBillSerializer(serializers.BaseSerializer):
     def to_internal_value(self, data):
@@ -174,28 +97,60 @@ class MonthlyBillSerializer(serializers.BaseSerializer):
             period = last_month.strftime("%m/%Y")
 
         # Validate if subscriber phone number match corret format
-        if not re.match("^\d{10}$|^\d{11}$", number):
+        if not re.match(r"^\d{10}$|^\d{11}$", number):
             raise serializers.ValidationError({
                 'number': 'number must be a string of 10 or 11 digits.'
             })
 
-        # Validate if period match corret format
-        if not re.match("^\d{2}/\d{4}$", period):
+        # Numbers are stored as integers, area codes never start with 0
+        if number[0] == '0':
             raise serializers.ValidationError({
-                'period': 'period must be in the format: "MM/YYYY"'
+                'number': 'number must not start with 0.'
             })
 
+        # Validate if period match corret format, with a valid month
+        period_error = serializers.ValidationError({
+            'period': 'period must be in the format: "MM/YYYY"'
+        })
+        if not re.match(r"^\d{2}/\d{4}$", period):
+            raise period_error
+        try:
+            closed = is_closed_period(period)
+        except ValueError:
+            raise period_error
+
         # Validate if period is a closed period (previous month)
-        current_month = date.today().replace(day=1)
-        period_date = datetime.strptime(period, "%m/%Y").date()
-        if period_date >= current_month:
+        if not closed:
             raise serializers.ValidationError({
                 'period': 'period must be of a closed (previous) month.'
             })
 
+        # Validate pagination params, only if informed
+        limit = data.get('limit')
+        if limit is not None:
+            max_limit = settings.BILL_PAGE_MAX_LIMIT
+            if not re.match(r"^\d+$", limit) or not (
+                    0 < int(limit) <= max_limit):
+                raise serializers.ValidationError({
+                    'limit': ('limit must be an integer between 1 and '
+                              '{}.'.format(max_limit))
+                })
+            limit = int(limit)
+
+        cursor = data.get('cursor')
+        if cursor is not None:
+            try:
+                decode_cursor(cursor)
+            except ValueError:
+                raise serializers.ValidationError({
+                    'cursor': 'cursor is invalid.'
+                })
+
         return {
             'number': number,
-            'period': period
+            'period': period,
+            'limit': limit,
+            'cursor': cursor
         }
 
     def to_representation(self, obj):
@@ -210,5 +165,108 @@ class MonthlyBillSerializer(serializers.BaseSerializer):
             'call_start_date': obj.started_at.strftime('%Y-%m-%d'),
             'call_start_time': obj.started_at.strftime('%H:%M:%S'),
             'call_duration': format_duration(obj.duration),
-            'call_price': 'R$ {:.2f}'.format(obj.price / 100).replace('.', ',')
+            'call_price': format_price(obj.price)
+        }
+
+
+# Columns of the calls read to render the call records of a bill, in order
+BILL_RECORD_FIELDS = ('destination', 'started_at', 'duration', 'price')
+
+
+def iter_call_records(rows):
+    """
+    Generate the call records of a bill, as rendered by
+    MonthlyBillSerializer, from rows of the BILL_RECORD_FIELDS values.
+
+    Rows are plain tuples, without model instances, and the durations and
+    prices repeated along the bill are formatted only once.
+    """
+    durations = {}
+    prices = {}
+    for destination, started_at, duration, price in rows:
+        call_duration = durations.get(duration)
+        if call_duration is None:
+            call_duration = durations[duration] = format_duration(duration)
+        call_price = prices.get(price)
+        if call_price is None:
+            call_price = prices[price] = format_price(price)
+
+        yield {
+            'destination': destination,
+            'call_start_date': started_at.date().isoformat(),
+            'call_start_time': started_at.time().isoformat('seconds'),
+            'call_duration': call_duration,
+            'call_price': call_price
+        }
+
+
+def render_call_records(calls):
+    """Render the call records of the calls of a bill, in a list."""
+    return list(iter_call_records(calls.values_list(*BILL_RECORD_FIELDS)))
+
+
+class BillExportSerializer(serializers.BaseSerializer):
+    """Validate the params of a period-wide export of the bills."""
+
+    def to_internal_value(self, data):
+        # Tries to get period parameter
+        period = data.get('period')
+        if not period:
+            raise serializers.ValidationError({
+                'period': 'This field is required.'
+            })
+
+        # Validate if period match corret format, with a valid month
+        period_error = serializers.ValidationError({
+            'period': 'period must be in the format: "MM/YYYY"'
+        })
+        if not re.match(r"^\d{2}/\d{4}$", period):
+            raise period_error
+        try:
+            closed = is_closed_period(period)
+        except ValueError:
+            raise period_error
+
+        # Validate if period is a closed period (previous month)
+        if not closed:
+            raise serializers.ValidationError({
+                'period': 'period must be of a closed (previous) month.'
+            })
+
+        output = data.get('output', 'csv')
+        if output not in ('csv', 'ndjson'):
+            raise serializers.ValidationError({
+                'output': 'output must be "csv" or "ndjson".'
+            })
+
+        return {
+            'period': period,
+            'output': output
+        }
+
+    def to_representation(self, obj):
+        return {
+            'period': obj['period'],
+            'output': obj['output']
+        }
+
+
+class BillSummarySerializer(serializers.BaseSerializer):
+    """Render the totals of a bill from the per destination totals."""
+
+    def to_representation(self, destinations):
+        call_count = sum(d['call_count'] for d in destinations)
+        total_duration = sum(d['total_duration'] for d in destinations)
+        total_price = sum(d['total_price'] for d in destinations)
+
+        return {
+            'call_count': call_count,
+            'total_duration': format_duration(total_duration),
+            'total_price': format_price(total_price),
+            'destinations': [{
+                'destination': d['destination'],
+                'call_count': d['call_count'],
+                'total_duration': format_duration(d['total_duration']),
+                'total_price': format_price(d['total_price'])
+            } for d in destinations]
         }
@@ -0,0 +1,14 @@
+import os
+
+import pyarrow.fs as fs
+
+
+def open_filesystem(location):
+    """
+    Return the filesystem and the base path of a location, a local directory
+    or the URI of a shared storage, eg. s3://bucket/path. Local files are
+    memory-mapped when read.
+    """
+    if '://' in location:
+        return fs.FileSystem.from_uri(location)
+    return fs.LocalFileSystem(use_mmap=True), os.path.abspath(location)
@@ -0,0 +1,36 @@
+import json
+
+from core.serializers import BILL_RECORD_FIELDS, iter_call_records
+
+
+def dumps(data):
+    """Serialize to compact JSON, like the REST framework JSON renderer."""
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+
+
+def stream_bill(number, period, summary, calls, chunk_size):
+    """
+    Generate the JSON document of a bill in pieces.
+
+    The calls are fetched and rendered chunk_size at a time, so memory usage
+    does not grow with the number of calls in the bill.
+    """
+    yield '{{"number":{},"period":{},"summary":{},"call_records":['.format(
+        dumps(number), dumps(period), dumps(summary))
+
+    rows = calls.values_list(*BILL_RECORD_FIELDS).iterator(
+        chunk_size=chunk_size)
+    separator = ''
+    records = []
+    for record in iter_call_records(rows):
+        records.append(dumps(record))
+
+        if len(records) == chunk_size:
+            yield separator + ','.join(records)
+            separator = ','
+            records = []
+
+    if records:
+        yield separator + ','.join(records)
+
+    yield ']}'
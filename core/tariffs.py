@@ -0,0 +1,91 @@
+from bisect import bisect_right
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from core.models import Tariff
+from core.utils import DEFAULT_TARIFF
+
+
+class TariffLookup:
+    """
+    Compiled lookup of the tariff effective at a given moment.
+
+    Tariff intervals are kept as sorted arrays of UTC epoch seconds, so the
+    tariff of a call is found with a binary search instead of a query.
+    """
+
+    def __init__(self, tariffs):
+        tariffs = sorted(tariffs, key=lambda tariff: tariff.effective_from)
+
+        self.starts = [int(t.effective_from.timestamp()) for t in tariffs]
+        # Open ended tariffs are effective until the end of times
+        self.ends = [
+            int(t.effective_to.timestamp()) if t.effective_to else np.iinfo(
+                np.int64).max
+            for t in tariffs
+        ]
+        self.tables = [t.as_table() for t in tariffs]
+
+    def get(self, moment):
+        """Return the TariffTable effective at a datetime."""
+        timestamp = int(moment.timestamp())
+        index = bisect_right(self.starts, timestamp) - 1
+
+        if index >= 0 and timestamp < self.ends[index]:
+            return self.tables[index]
+        return DEFAULT_TARIFF
+
+    def indexes(self, timestamps):
+        """
+        Return the index of the effective tariff for an array of UTC epoch
+        seconds, or -1 where the default tariff is effective.
+        """
+        timestamps = np.asarray(timestamps, dtype=np.int64)
+        indexes = np.searchsorted(self.starts, timestamps, side='right') - 1
+
+        # The extra end is the one of index -1, always expired
+        ends = np.asarray(self.ends + [0], dtype=np.int64)
+        expired = timestamps >= ends[indexes]
+        indexes[expired] = -1
+        return indexes
+
+    def table(self, index):
+        """Return the TariffTable of an index returned by indexes."""
+        return self.tables[index] if index >= 0 else DEFAULT_TARIFF
+
+
+_lookup = None
+_lookup_built_at = 0
+_lookup_lock = threading.Lock()
+
+
+def get_tariff_lookup():
+    """
+    Return the TariffLookup of this process.
+
+    The lookup is rebuilt when a tariff is saved or deleted by this process,
+    and every TARIFF_LOOKUP_TTL seconds to see the changes of other processes.
+    """
+    global _lookup, _lookup_built_at
+
+    ttl = getattr(settings, 'TARIFF_LOOKUP_TTL', 60)
+    with _lookup_lock:
+        if _lookup is None or time.monotonic() - _lookup_built_at > ttl:
+            _lookup = TariffLookup(Tariff.objects.all())
+            _lookup_built_at = time.monotonic()
+        return _lookup
+
+
+@receiver(post_save, sender=Tariff)
+@receiver(post_delete, sender=Tariff)
+def clear_tariff_lookup(**kwargs):
+    """Discard the TariffLookup of this process after a tariff change."""
+    global _lookup
+
+    with _lookup_lock:
+        _lookup = None
@@ -0,0 +1,40 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from core.models import CallDetail
+
+
+@pytest.fixture(autouse=True)
+def metrics_not_sampled(settings):
+    """Requests are only sampled by the tests of the metrics."""
+    settings.METRICS_SAMPLE_RATE = 0
+
+
+@pytest.fixture
+def create_call():
+    """Return a function creating a completed call of a day of 2011."""
+    def create(call_id, source="2212345678", destination="3312345678",
+               day=1, month=10):
+        return CallDetail.objects.create(
+            call_id=call_id, source=source, destination=destination,
+            duration=585, price=117,
+            reference_period="{:02d}/2011".format(month),
+            started_at=datetime(2011, month, day, 8, 30, 15,
+                                tzinfo=timezone.utc),
+            ended_at=datetime(2011, month, day, 8, 40, 0,
+                              tzinfo=timezone.utc),
+            is_completed=True)
+    return create
+
+
+@pytest.fixture
+def create_calls(create_call):
+    """
+    Return a function creating calls of 2212345678 in October 2011, one a
+    day from the 1st.
+    """
+    def create(count):
+        for call_id in range(1, count + 1):
+            create_call(call_id, day=call_id)
+    return create
@@ -1,9 +1,19 @@
-from datetime import datetime, timezone
+import json
+from datetime import datetime, time, timezone
 
 import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from rest_framework.test import APIClient
 
-from core.models import CallDetail
+from core import ingest, views
+from core.models import CallDetail, MonthlyBill, MonthlyRollup, Tariff
+from core.serializers import (
+    CallDetailSerializer, MonthlyBillSerializer, render_call_records)
+from core.tariffs import clear_tariff_lookup, get_tariff_lookup
+from core.upsert import supports_upsert
+from core.utils import get_price
+from core.validators import validate_call_record
 
 
 @pytest.mark.django_db
@@ -615,6 +625,12 @@ def test_get_calls_wrong_number_format():
         'number':
             'number must be a string of 10 or 11 digits.'}
 
+    # Numbers are stored as integers, 01234567890 would be 1234567890
+    params['number'] = "01234567890"
+    response = client.get('/calls/', params, format="json")
+    assert response.status_code == 400
+    assert response.json() == {'number': 'number must not start with 0.'}
+
 
 @pytest.mark.django_db
 def test_get_calls_wrong_period_format():
@@ -632,6 +648,14 @@ def test_get_calls_wrong_period_format():
         'period':
             'period must be in the format: "MM/YYYY"'}
 
+    # Months out of 01-12 are wrong too
+    params['period'] = "13/2011"
+    response = client.get('/calls/', params, format="json")
+    assert response.status_code == 400
+    assert response.json() == {
+        'period':
+            'period must be in the format: "MM/YYYY"'}
+
 
 @pytest.mark.django_db
 @pytest.mark.freeze_time('2011-12-13')
@@ -679,7 +703,7 @@ def test_get_calls():
 
     # A -> B (not completed call)
     CallDetail.objects.create(
-        call_id=1, source="2212345678", destination="3312345678",
+        call_id=5, source="2212345678", destination="3312345678",
         duration=1240, price=54, reference_period="10/2011",
         started_at=datetime(2011, 10, 13, 21, 57, 13, tzinfo=timezone.utc),
         ended_at=None, is_completed=False)
@@ -696,7 +720,7 @@ def test_get_calls():
 
     # B -> A
     CallDetail.objects.create(
-        call_id=2, source="3312345678", destination="2212345678",
+        call_id=6, source="3312345678", destination="2212345678",
         duration=585, price=117, reference_period="11/2011",
         started_at=datetime(2011, 11, 13, 9, 30, 15, tzinfo=timezone.utc),
         ended_at=datetime(2011, 11, 13, 9, 40, 0, tzinfo=timezone.utc),
@@ -731,6 +755,22 @@ def test_get_calls():
     assert response.json() == {
         'number': '2212345678',
         'period': '10/2011',
+        'summary': {
+            'call_count': 2,
+            'total_duration': '16h50m40s',
+            'total_price': 'R$ 87,30',
+            'destinations': [{
+                'destination': '3312345678',
+                'call_count': 1,
+                'total_duration': '0h20m40s',
+                'total_price': 'R$ 0,54'
+            }, {
+                'destination': '4412345678',
+                'call_count': 1,
+                'total_duration': '16h30m0s',
+                'total_price': 'R$ 86,76'
+            }]
+        },
         'call_records': [{
             'destination': '4412345678',
             'call_start_date': '2011-10-13',
@@ -755,6 +795,17 @@ def test_get_calls():
     assert response.json() == {
         'number': '2212345678',
         'period': '11/2011',
+        'summary': {
+            'call_count': 1,
+            'total_duration': '0h9m45s',
+            'total_price': 'R$ 1,17',
+            'destinations': [{
+                'destination': '3312345678',
+                'call_count': 1,
+                'total_duration': '0h9m45s',
+                'total_price': 'R$ 1,17'
+            }]
+        },
         'call_records': [{
             'destination': '3312345678',
             'call_start_date': '2011-11-13',
@@ -763,3 +814,778 @@ def test_get_calls():
             'call_price': 'R$ 1,17'
         }]
     }
+
+
+# Section: Batch Save Call Details ===========================================
+
+@pytest.mark.django_db
+def test_post_calls_batch():
+    """Test batch saving of records pairing start and end in memory."""
+    client = APIClient()
+
+    # Previous CallDetail with Record Call Start info already present
+    CallDetail.objects.create(
+        call_id=123, source="11987654321", destination="1187654321",
+        started_at=datetime(2019, 9, 30, 8, 30, 15, tzinfo=timezone.utc))
+
+    records = [{
+        "call_id": 123,
+        "type": "end",
+        "timestamp": "2019-09-30T08:40:00Z"
+    }, {
+        "call_id": 124,
+        "type": "end",
+        "timestamp": "2019-09-30T08:40:00Z"
+    }, {
+        "call_id": 124,
+        "type": "start",
+        "timestamp": "2019-09-30T08:30:15Z",
+        "source": "11987654321",
+        "destination": "1187654321"
+    }, {
+        "call_id": 125,
+        "type": "start",
+        "timestamp": "2019-09-30T08:30:15Z",
+        "source": "11987654321",
+        "destination": "1187654321"
+    }]
+
+    response = client.post('/calls/batch/', records, format='json')
+    assert response.status_code == 200
+    assert response.json() == {'saved': 4, 'errors': []}
+    assert CallDetail.objects.count() == 3
+
+    for call_id in [123, 124]:
+        call = CallDetail.objects.get(call_id=call_id)
+        assert call.duration == 585
+        assert call.price == 117
+        assert call.reference_period == "09/2019"
+        assert call.is_completed == True
+
+    call = CallDetail.objects.get(call_id=125)
+    assert call.source == "11987654321"
+    assert call.ended_at == None
+    assert call.price == None
+    assert call.is_completed == False
+
+
+@pytest.mark.django_db
+def test_post_calls_batch_errors():
+    """Test batch saving reports errors per record and saves the others."""
+    client = APIClient()
+
+    records = [{
+        "call_id": 11,
+        "type": "start",
+        "timestamp": "2016-02-29T12:00:00Z",
+        "source": "11987654321",
+        "destination": "11123456789"
+    }, {
+        "call_id": 11,
+        "type": "end",
+        "timestamp": "2016-02-29T11:00:00Z"
+    }, {
+        "type": "end",
+        "timestamp": "2016-02-29T12:00:00Z"
+    }, "not a record"]
+
+    response = client.post('/calls/batch/', records, format='json')
+    assert response.status_code == 200
+    assert response.json() == {
+        'saved': 1,
+        'errors': [{
+            'index': 1,
+            'errors': {
+                'timestamp': ('End Record Call timestamp cannot be before '
+                              'Start Record Call timestamp.')}
+        }, {
+            'index': 2,
+            'errors': {'call_id': 'This field is required.'}
+        }, {
+            'index': 3,
+            'errors': {'record': 'record must be a JSON object.'}
+        }]
+    }
+
+    call = CallDetail.objects.get(call_id=11)
+    assert call.ended_at == None
+    assert call.is_completed == False
+
+    response = client.post('/calls/batch/', {"call_id": 11}, format='json')
+    assert response.status_code == 400
+    assert response.json() == {'records': 'records must be a list.'}
+
+
+@pytest.mark.django_db
+def test_post_calls_batch_ndjson():
+    """Test batch saving with a newline delimited JSON body."""
+    client = APIClient()
+
+    body = (
+        '{"call_id": 11, "type": "start", "timestamp": "2016-02-29T05:00:00Z",'
+        ' "source": "11987654321", "destination": "11123456789"}\n'
+        '\n'
+        '{"call_id": 11, "type": "end", "timestamp": "2016-02-29T05:40:00Z"}\n'
+    )
+
+    response = client.post('/calls/batch/', body,
+                           content_type='application/x-ndjson')
+    assert response.status_code == 200
+    assert response.json() == {'saved': 2, 'errors': []}
+
+    call = CallDetail.objects.get(call_id=11)
+    assert call.duration == 2400
+    assert call.price == 36
+    assert call.is_completed == True
+
+    response = client.post('/calls/batch/', '{"call_id": 12,\n',
+                           content_type='application/x-ndjson')
+    assert response.status_code == 400
+
+    response = client.post('/calls/batch/', b'{"call_id": 12}\n\xff\n',
+                           content_type='application/x-ndjson')
+    assert response.status_code == 400
+    assert 'line 2' in response.json()['detail']
+
+
+@pytest.mark.django_db
+def test_post_calls_batch_concurrent_call(monkeypatch):
+    """Test a call created by a concurrent batch is merged on a retry."""
+    # Saved by a concurrent request, not yet visible when fetching the calls
+    CallDetail.objects.create(
+        call_id=11, source="11987654321", destination="11123456789",
+        started_at=datetime(2016, 2, 29, 5, 0, tzinfo=timezone.utc))
+    fetch_calls = ingest.fetch_calls
+    attempts = []
+
+    def racing_fetch_calls(call_ids):
+        attempts.append(call_ids)
+        return {} if len(attempts) == 1 else fetch_calls(call_ids)
+
+    monkeypatch.setattr(ingest, 'fetch_calls', racing_fetch_calls)
+    response = APIClient().post('/calls/batch/', [{
+        "call_id": 11, "type": "end", "timestamp": "2016-02-29T05:40:00Z"
+    }], format='json')
+
+    assert response.status_code == 200
+    assert response.json() == {'saved': 1, 'errors': []}
+    assert len(attempts) == 2
+    assert CallDetail.objects.get(call_id=11).is_completed == True
+
+
+# Section: Bill Cache ========================================================
+
+@pytest.mark.django_db
+@pytest.mark.freeze_time('2011-12-13')
+def test_get_calls_cached_bill():
+    """Test closed period bills are cached until a late record arrives."""
+    client = APIClient()
+
+    CallDetail.objects.create(
+        call_id=1, source="2212345678", destination="3312345678",
+        duration=1240, price=54, reference_period="10/2011",
+        started_at=datetime(2011, 10, 13, 21, 57, 13, tzinfo=timezone.utc),
+        ended_at=datetime(2011, 10, 13, 22, 17, 53, tzinfo=timezone.utc),
+        is_completed=True)
+    CallDetail.objects.create(
+        call_id=2, source="2212345678", destination="4412345678",
+        started_at=datetime(2011, 10, 13, 8, 30, 15, tzinfo=timezone.utc))
+
+    params = {
+        'number': "2212345678",
+        'period': '10/2011'
+    }
+    expected = {
+        'number': '2212345678',
+        'period': '10/2011',
+        'summary': {
+            'call_count': 1,
+            'total_duration': '0h20m40s',
+            'total_price': 'R$ 0,54',
+            'destinations': [{
+                'destination': '3312345678',
+                'call_count': 1,
+                'total_duration': '0h20m40s',
+                'total_price': 'R$ 0,54'
+            }]
+        },
+        'call_records': [{
+            'destination': '3312345678',
+            'call_start_date': '2011-10-13',
+            'call_start_time': '21:57:13',
+            'call_duration': '0h20m40s',
+            'call_price': 'R$ 0,54'
+        }]
+    }
+
+    response = client.get('/calls/', params, format="json")
+    assert response.status_code == 200
+    assert response.json() == expected
+    assert MonthlyBill.objects.filter(
+        number="2212345678", period="10/2011").count() == 1
+
+    # Changes bypassing the serializers are not seen, the bill is cached
+    CallDetail.objects.filter(call_id=1).update(price=1000)
+    response = client.get('/calls/', params, format="json")
+    assert response.json() == expected
+
+    # A late End Record of the closed period invalidates the cached bill
+    call_data = {
+        "call_id": 2,
+        "type": "end",
+        "timestamp": "2011-10-13T08:40:00Z"
+    }
+    response = client.post('/calls/', call_data, format='json')
+    assert response.status_code == 204
+    assert not MonthlyBill.objects.exclude(call_records='').exists()
+
+    response = client.get('/calls/', params, format="json")
+    assert response.json()['call_records'] == [{
+        'destination': '4412345678',
+        'call_start_date': '2011-10-13',
+        'call_start_time': '08:30:15',
+        'call_duration': '0h9m45s',
+        'call_price': 'R$ 1,17'
+    }, {
+        'destination': '3312345678',
+        'call_start_date': '2011-10-13',
+        'call_start_time': '21:57:13',
+        'call_duration': '0h20m40s',
+        'call_price': 'R$ 10,00'
+    }]
+
+
+@pytest.mark.django_db
+@pytest.mark.freeze_time('2011-12-13')
+def test_post_calls_batch_invalidates_cached_bill():
+    """Test batch saving invalidates the cached bills it changes."""
+    client = APIClient()
+
+    MonthlyBill.objects.create(
+        number="2212345678", period="10/2011", call_records='[]')
+    MonthlyBill.objects.create(
+        number="2212345678", period="09/2011", call_records='[]')
+
+    records = [{
+        "call_id": 1,
+        "type": "start",
+        "timestamp": "2011-10-13T08:30:15Z",
+        "source": "2212345678",
+        "destination": "3312345678"
+    }, {
+        "call_id": 1,
+        "type": "end",
+        "timestamp": "2011-10-13T08:40:00Z"
+    }]
+
+    response = client.post('/calls/batch/', records, format='json')
+    assert response.status_code == 200
+
+    assert list(MonthlyBill.objects.exclude(call_records='').values_list(
+        'period', flat=True)) == ["09/2011"]
+
+
+@pytest.mark.django_db
+@pytest.mark.freeze_time('2011-12-13')
+@pytest.mark.parametrize('batch', [False, True])
+def test_repeated_records_invalidate_previous_bill(batch):
+    """Test bills a call leaves when a record is repeated are invalidated."""
+    client = APIClient()
+
+    def post(record):
+        if batch:
+            response = client.post('/calls/batch/', [record], format='json')
+            assert response.json()['errors'] == []
+        else:
+            response = client.post('/calls/', record, format='json')
+            assert response.status_code == 204
+
+    def bill_calls(number, period):
+        response = client.get(
+            '/calls/', {'number': number, 'period': period}, format="json")
+        return len(response.json()['call_records'])
+
+    post({"call_id": 1, "type": "start", "timestamp": "2011-10-31T23:50:00Z",
+          "source": "2212345678", "destination": "3312345678"})
+    post({"call_id": 1, "type": "end", "timestamp": "2011-10-31T23:59:00Z"})
+    assert bill_calls("2212345678", "10/2011") == 1
+
+    # A repeated End Record moves the call to the next period
+    post({"call_id": 1, "type": "end", "timestamp": "2011-11-01T00:01:00Z"})
+    assert bill_calls("2212345678", "10/2011") == 0
+    assert bill_calls("2212345678", "11/2011") == 1
+
+    # A repeated Start Record moves the call to another subscriber
+    post({"call_id": 1, "type": "start", "timestamp": "2011-10-31T23:50:00Z",
+          "source": "2287654321", "destination": "3312345678"})
+    assert bill_calls("2212345678", "11/2011") == 0
+    assert bill_calls("2287654321", "11/2011") == 1
+
+
+@pytest.mark.django_db
+@pytest.mark.freeze_time('2011-12-13')
+def test_get_calls_late_record_while_rendered(monkeypatch):
+    """Test bills changed while rendered are not cached."""
+    client = APIClient()
+    params = {'number': "2212345678", 'period': "10/2011"}
+    client.post('/calls/', {
+        "call_id": 1, "type": "start", "timestamp": "2011-10-13T08:30:15Z",
+        "source": "2212345678", "destination": "3312345678"
+    }, format='json')
+    client.post('/calls/', {
+        "call_id": 2, "type": "start", "timestamp": "2011-10-14T08:30:15Z",
+        "source": "2212345678", "destination": "3312345678"
+    }, format='json')
+    client.post('/calls/', {
+        "call_id": 1, "type": "end", "timestamp": "2011-10-13T08:40:00Z"
+    }, format='json')
+
+    def render_with_late_record(calls):
+        call_records = render_call_records(calls)
+        # The call is completed once the bill calls were read
+        APIClient().post('/calls/', {
+            "call_id": 2, "type": "end", "timestamp": "2011-10-14T08:40:00Z"
+        }, format='json')
+        return call_records
+
+    monkeypatch.setattr(views, 'render_call_records', render_with_late_record)
+    response = client.get('/calls/', params, format="json")
+    assert len(response.json()['call_records']) == 1
+    monkeypatch.undo()
+
+    response = client.get('/calls/', params, format="json")
+    assert len(response.json()['call_records']) == 2
+    assert len(json.loads(MonthlyBill.objects.get().call_records)) == 2
+
+
+@pytest.mark.django_db
+@pytest.mark.freeze_time('2011-12-13')
+def test_get_calls_empty_bill_not_cached():
+    """Test bills without calls are not cached."""
+    response = APIClient().get(
+        '/calls/', {'number': "2212345678", 'period': "10/2011"},
+        format="json")
+    assert response.json()['call_records'] == []
+    assert not MonthlyBill.objects.exists()
+
+
+# Section: Streamed Bill =====================================================
+
+@pytest.mark.django_db
+@pytest.mark.freeze_time('2011-12-13')
+def test_get_calls_stream(settings):
+    """Test if GET call streams the bill with the same content"""
+    settings.BILL_STREAM_CHUNK_SIZE = 2
+    client = APIClient()
+
+    for call_id in range(1, 6):
+        CallDetail.objects.create(
+            call_id=call_id, source="2212345678", destination="3312345678",
+            duration=585, price=117, reference_period="10/2011",
+            started_at=datetime(2011, 10, call_id, 8, 30, 15,
+                                tzinfo=timezone.utc),
+            ended_at=datetime(2011, 10, call_id, 8, 40, 0,
+                              tzinfo=timezone.utc),
+            is_completed=True)
+
+    params = {
+        'number': "2212345678",
+        'period': '10/2011',
+        'stream': 'true'
+    }
+    response = client.get('/calls/', params, format="json")
+    assert response.status_code == 200
+    assert response.streaming
+    assert response['Content-Type'] == 'application/json'
+
+    bill = json.loads(b''.join(response.streaming_content))
+    assert bill == {
+        'number': '2212345678',
+        'period': '10/2011',
+        'summary': {
+            'call_count': 5,
+            'total_duration': '0h48m45s',
+            'total_price': 'R$ 5,85',
+            'destinations': [{
+                'destination': '3312345678',
+                'call_count': 5,
+                'total_duration': '0h48m45s',
+                'total_price': 'R$ 5,85'
+            }]
+        },
+        'call_records': [{
+            'destination': '3312345678',
+            'call_start_date': '2011-10-0{}'.format(day),
+            'call_start_time': '08:30:15',
+            'call_duration': '0h9m45s',
+            'call_price': 'R$ 1,17'
+        } for day in range(1, 6)]
+    }
+
+    # Streamed bills are not cached
+    assert MonthlyBill.objects.count() == 0
+
+    params['number'] = "3312345678"
+    response = client.get('/calls/', params, format="json")
+    assert json.loads(b''.join(response.streaming_content)) == {
+        'number': '3312345678',
+        'period': '10/2011',
+        'summary': {
+            'call_count': 0,
+            'total_duration': '0h0m0s',
+            'total_price': 'R$ 0,00',
+            'destinations': []
+        },
+        'call_records': []
+    }
+
+
+@pytest.mark.django_db
+def test_render_call_records():
+    """Test bills rendered from rows match the serializer of the calls"""
+    durations = [0, 59, 3600, 7385, 59, 0]
+    for call_id, duration in enumerate(durations, 1):
+        started_at = datetime(2011, 10, call_id, 23, 5, 9,
+                              tzinfo=timezone.utc)
+        CallDetail.objects.create(
+            call_id=call_id, source="2212345678",
+            destination="3312345678" if call_id % 2 else "33123456789",
+            duration=duration, price=36 + duration // 60 * 9,
+            reference_period="10/2011", started_at=started_at,
+            ended_at=started_at, is_completed=True)
+
+    calls = CallDetail.objects.bill("2212345678", "10/2011")
+    with CaptureQueriesContext(connection) as context:
+        call_records = render_call_records(calls)
+
+    assert call_records == MonthlyBillSerializer(calls, many=True).data
+    assert call_records[3] == {
+        'destination': '33123456789',
+        'call_start_date': '2011-10-04',
+        'call_start_time': '23:05:09',
+        'call_duration': '2h3m5s',
+        'call_price': 'R$ 11,43'
+    }
+    # Only the rendered columns are read
+    assert '"core_calldetail"."ended_at"' not in context.captured_queries[0][
+        'sql']
+
+
+# Section: Paginated Bill ====================================================
+
+@pytest.mark.django_db
+@pytest.mark.freeze_time('2011-12-13')
+def test_get_calls_paginated():
+    """Test if GET call walks the bill in pages following the cursor"""
+    client = APIClient()
+
+    # Calls 1 to 3 start at the same time, pages must not skip or repeat them
+    for call_id in range(1, 6):
+        CallDetail.objects.create(
+            call_id=call_id, source="2212345678",
+            destination="33123456{:02}".format(call_id),
+            duration=585, price=117, reference_period="10/2011",
+            started_at=datetime(2011, 10, max(call_id, 3), 8, 30, 15,
+                                tzinfo=timezone.utc),
+            ended_at=datetime(2011, 10, max(call_id, 3), 8, 40, 0,
+                              tzinfo=timezone.utc),
+            is_completed=True)
+
+    params = {
+        'number': "2212345678",
+        'period': '10/2011',
+        'limit': '2'
+    }
+
+    destinations = []
+    pages = 0
+    while True:
+        response = client.get('/calls/', params, format="json")
+        assert response.status_code == 200
+
+        bill = response.json()
+        assert bill['number'] == '2212345678'
+        assert bill['period'] == '10/2011'
+        destinations += [
+            record['destination'] for record in bill['call_records']]
+        pages += 1
+
+        if not bill['next_cursor']:
+            break
+        params['cursor'] = bill['next_cursor']
+
+    assert pages == 3
+    assert destinations == [
+        '3312345601', '3312345602', '3312345603', '3312345604', '3312345605']
+
+    # Paginated bills are not cached
+    assert MonthlyBill.objects.count() == 0
+
+
+@pytest.mark.django_db
+@pytest.mark.freeze_time('2011-12-13')
+def test_get_calls_wrong_pagination_params():
+    """Test if GET call pagination parameters are wrong."""
+    client = APIClient()
+
+    params = {
+        'number': "2212345678",
+        'period': '10/2011',
+    }
+    expected = {'limit': 'limit must be an integer between 1 and 1000.'}
+
+    for limit in ['0', '-1', 'a', '1001']:
+        params['limit'] = limit
+        response = client.get('/calls/', params, format="json")
+        assert response.status_code == 400
+        assert response.json() == expected
+
+    params['limit'] = '10'
+    params['cursor'] = 'not a cursor'
+    response = client.get('/calls/', params, format="json")
+    assert response.status_code == 400
+    assert response.json() == {'cursor': 'cursor is invalid.'}
+
+
+# Section: Bill Summary ======================================================
+
+@pytest.mark.django_db
+@pytest.mark.freeze_time('2011-12-13')
+def test_get_calls_summary_only(django_assert_num_queries):
+    """Test if GET call returns only the bill totals"""
+    client = APIClient()
+
+    for call_id, destination in enumerate(
+            ["3312345678", "4412345678", "3312345678"], start=1):
+        CallDetail.objects.create(
+            call_id=call_id, source="2212345678", destination=destination,
+            duration=585 * call_id, price=117 * call_id,
+            reference_period="10/2011",
+            started_at=datetime(2011, 10, 13, 8, 30, 15, tzinfo=timezone.utc),
+            ended_at=datetime(2011, 10, 13, 8, 40, 0, tzinfo=timezone.utc),
+            is_completed=True)
+
+    params = {
+        'number': "2212345678",
+        'period': '10/2011',
+        'summary_only': 'true'
+    }
+
+    # Looks up the cached bill and the archived period, and computes the
+    # totals in a single query
+    with django_assert_num_queries(3):
+        response = client.get('/calls/', params, format="json")
+    assert response.status_code == 200
+    assert response.json() == {
+        'number': '2212345678',
+        'period': '10/2011',
+        'summary': {
+            'call_count': 3,
+            'total_duration': '0h58m30s',
+            'total_price': 'R$ 7,02',
+            'destinations': [{
+                'destination': '3312345678',
+                'call_count': 2,
+                'total_duration': '0h39m0s',
+                'total_price': 'R$ 4,68'
+            }, {
+                'destination': '4412345678',
+                'call_count': 1,
+                'total_duration': '0h19m30s',
+                'total_price': 'R$ 2,34'
+            }]
+        }
+    }
+
+    # Totals of cached bills are not computed again
+    del params['summary_only']
+    client.get('/calls/', params, format="json")
+    params['summary_only'] = 'true'
+
+    with django_assert_num_queries(1):
+        cached_response = client.get('/calls/', params, format="json")
+    assert cached_response.json() == response.json()
+
+
+# Section: Upsert of Call Records ============================================
+
+def record_queries(client, call_data):
+    """POST a record, returning the statements run, ignoring savepoints."""
+    with CaptureQueriesContext(connection) as context:
+        response = client.post('/calls/', call_data, format='json')
+    assert response.status_code == 204
+
+    return [
+        query['sql'] for query in context.captured_queries
+        if 'SAVEPOINT' not in query['sql']
+    ]
+
+
+@pytest.mark.django_db
+def test_post_call_upsert():
+    """Test records are merged into the call with a single statement."""
+    if not supports_upsert():
+        pytest.skip('Database does not support upserts.')
+    client = APIClient()
+    # Tariffs are read once in a while, not by each record
+    get_tariff_lookup()
+
+    call_data = {
+        "call_id": 11,
+        "type": "end",
+        "timestamp": "2016-02-29T12:00:00Z"
+    }
+    queries = record_queries(client, call_data)
+    assert len(queries) == 1
+    assert 'ON CONFLICT' in queries[0]
+
+    call_data = {
+        "call_id": 11,
+        "type": "start",
+        "timestamp": "2016-02-29T11:50:00Z",
+        "source": "11987654321",
+        "destination": "11123456789"
+    }
+    queries = record_queries(client, call_data)
+    assert 'ON CONFLICT' in queries[0]
+    assert not any(query.startswith('SELECT') for query in queries)
+
+    call = CallDetail.objects.get(call_id=11)
+    assert call.source == "11987654321"
+    assert call.duration == 600
+    assert call.price == 126
+    assert call.reference_period == "02/2016"
+    assert call.is_completed == True
+    assert MonthlyRollup.objects.get(source="11987654321").total_price == 126
+
+    # A repeated record is saved by the serializer
+    call_data["timestamp"] = "2016-02-29T11:40:00Z"
+    record_queries(client, call_data)
+
+    call = CallDetail.objects.get(call_id=11)
+    assert call.duration == 1200
+    assert call.price == 216
+    assert MonthlyRollup.objects.get(source="11987654321").total_price == 216
+
+
+@pytest.mark.django_db
+def test_post_call_upsert_prices():
+    """Test calls completed by the upsert are priced as by get_price."""
+    if not supports_upsert():
+        pytest.skip('Database does not support upserts.')
+    client = APIClient()
+    Tariff.objects.create(
+        effective_from=datetime(2016, 3, 1, tzinfo=timezone.utc),
+        standing_charge=40, standard_minute_charge=9, reduced_minute_charge=2,
+        standard_start=time(8, 0), standard_end=time(20, 0))
+
+    calls = [
+        ("2016-02-29T12:00:00Z", "2016-02-29T12:10:59Z"),
+        ("2016-02-29T05:59:59Z", "2016-02-29T22:00:01Z"),
+        ("2016-02-29T21:57:13Z", "2016-03-01T06:03:00Z"),
+        ("2016-02-29T23:00:00Z", "2016-03-01T02:00:00Z"),
+        ("2016-02-29T07:59:30Z", "2016-03-01T08:00:30Z"),
+        ("2016-02-28T19:59:01Z", "2016-03-02T20:00:00Z"),
+        ("2016-03-01T20:00:00Z", "2016-03-01T20:00:00Z"),
+    ]
+    try:
+        for call_id, (start, end) in enumerate(calls, 1):
+            record_queries(client, {
+                "call_id": call_id, "type": "start", "timestamp": start,
+                "source": "11987654321", "destination": "11123456789"
+            })
+            queries = record_queries(client, {
+                "call_id": call_id, "type": "end", "timestamp": end
+            })
+            # Completed by the upsert, only the rollup and bills are updated
+            assert not any(query.startswith('UPDATE "core_calldetail"')
+                           for query in queries)
+
+            call = CallDetail.objects.get(call_id=call_id)
+            assert call.is_completed == True
+            assert call.duration == int(
+                (call.ended_at - call.started_at).total_seconds())
+            assert call.price == get_price(
+                call.started_at, call.ended_at,
+                get_tariff_lookup().get(call.ended_at))
+    finally:
+        clear_tariff_lookup()
+
+
+@pytest.mark.django_db
+def test_post_call_without_upsert(monkeypatch):
+    """Test records are saved by the serializer without upsert support."""
+    monkeypatch.setattr('core.upsert.supports_upsert', lambda: False)
+    client = APIClient()
+
+    # Records are validated once, by the view
+    validations = []
+
+    def validate(data):
+        validations.append(data)
+        return validate_call_record(data)
+
+    monkeypatch.setattr('core.views.validate_call_record', validate)
+    monkeypatch.setattr('core.serializers.validate_call_record', validate)
+
+    call_data = {
+        "call_id": 11,
+        "type": "start",
+        "timestamp": "2016-02-29T11:50:00Z",
+        "source": "11987654321",
+        "destination": "11123456789"
+    }
+    queries = record_queries(client, call_data)
+    assert 'ON CONFLICT' not in queries[-1]
+
+    call_data = {
+        "call_id": 11,
+        "type": "end",
+        "timestamp": "2016-02-29T12:00:00Z"
+    }
+    record_queries(client, call_data)
+
+    call = CallDetail.objects.get(call_id=11)
+    assert call.price == 126
+    assert call.is_completed == True
+    assert len(validations) == 2
+
+    # The order of the records is still checked
+    call_data["timestamp"] = "2016-02-29T11:00:00Z"
+    response = client.post('/calls/', call_data, format='json')
+    assert response.status_code == 400
+    assert response.data == {
+        'timestamp': ('End Record Call timestamp cannot be '
+                      'before Start Record Call timestamp.')}
+
+
+@pytest.mark.django_db
+def test_post_call_concurrent_insert(monkeypatch):
+    """Test a call inserted by a concurrent request is merged on a retry."""
+    monkeypatch.setattr('core.upsert.supports_upsert', lambda: False)
+    CallDetail.objects.create(
+        call_id=11, source="11987654321", destination="11123456789",
+        started_at=datetime(2016, 2, 29, 11, 50, tzinfo=timezone.utc))
+
+    # The first lookup runs before the concurrent insert is committed
+    attempts = []
+
+    class RacingSerializer(CallDetailSerializer):
+        def __init__(self, instance=None, **kwargs):
+            attempts.append(instance)
+            if len(attempts) == 1:
+                instance = None
+            super().__init__(instance, **kwargs)
+
+    monkeypatch.setattr('core.views.CallDetailSerializer', RacingSerializer)
+    response = APIClient().post('/calls/', {
+        "call_id": 11,
+        "type": "end",
+        "timestamp": "2016-02-29T12:00:00Z"
+    }, format='json')
+
+    assert response.status_code == 204
+    assert len(attempts) == 2
+    call = CallDetail.objects.get(call_id=11)
+    assert call.price == 126
+    assert call.is_completed == True
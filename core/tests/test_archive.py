@@ -0,0 +1,154 @@
+from datetime import datetime, timezone
+import os
+
+import pytest
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from rest_framework.test import APIClient
+
+from core import archive, views
+from core.archive import archived_periods, is_archived, read_archive
+from core.models import CallDetail, MonthlyBill, MonthlyRollup
+
+
+@pytest.fixture
+def calls(settings, tmp_path, create_call):
+    settings.ARCHIVE_DIR = str(tmp_path / 'archive')
+    for call_id in range(1, 6):
+        create_call(call_id, "2212345678", day=6 - call_id)
+    create_call(6, "3312345678", day=1)
+    create_call(7, "2212345678", day=1, month=9)
+    call_command('rebuild_rollups')
+
+
+def get_bill(client, **params):
+    params.update({'number': '2212345678', 'period': '10/2011'})
+    response = client.get('/calls/', params, format="json")
+    assert response.status_code == 200
+    return response.data
+
+
+@pytest.mark.django_db
+@pytest.mark.freeze_time('2011-12-13')
+def test_archive_period(calls):
+    """Test archived periods are moved out of the database"""
+    call_command('archive_period', '10/2011', chunk_size=2)
+
+    assert is_archived('10/2011')
+    assert archived_periods() == ['10/2011']
+    assert list(CallDetail.objects.values_list('call_id', flat=True)) == [7]
+    assert [call.call_id for call in read_archive('10/2011')] == [
+        5, 4, 3, 2, 1, 6]
+    assert [call.call_id for call in read_archive('10/2011', '3312345678')
+            ] == [6]
+
+    call = next(read_archive('10/2011'))
+    assert call.started_at == datetime(2011, 10, 1, 8, 30, 15,
+                                       tzinfo=timezone.utc)
+    assert (call.duration, call.price) == (585, 117)
+
+    with pytest.raises(CommandError):
+        call_command('archive_period', '12/2011')
+
+
+@pytest.mark.django_db
+@pytest.mark.freeze_time('2011-12-13')
+def test_get_calls_archived(calls, create_call):
+    """Test bills of archived periods are the same, with late calls"""
+    client = APIClient()
+    bill = get_bill(client)
+    page = get_bill(client, limit='3')
+
+    call_command('archive_period', '10/2011')
+    # The bill must be read from the file, not from the cache
+    MonthlyBill.objects.all().delete()
+
+    assert get_bill(client) == bill
+    assert get_bill(client, limit='3') == page
+    assert get_bill(client, cursor=page['next_cursor'])['call_records'] == (
+        bill['call_records'][3:])
+
+    # Late calls are read along with the archived ones
+    create_call(8, "2212345678", day=3)
+    MonthlyBill.objects.all().delete()
+    bill = get_bill(client)
+    assert bill['summary']['call_count'] == 6
+    assert len(bill['call_records']) == 6
+
+
+@pytest.mark.django_db
+@pytest.mark.freeze_time('2011-12-13')
+def test_archive_period_late_calls(calls, settings, create_call):
+    """Test late calls are added to the archive and exported"""
+    settings.EXPORT_TOKEN = 'secret'
+    call_command('archive_period', '10/2011')
+    create_call(8, "2212345678", day=3)
+
+    response = APIClient().get('/calls/export/', {'period': '10/2011'},
+                               HTTP_AUTHORIZATION='Bearer secret')
+    lines = b''.join(response.streaming_content).decode().splitlines()
+    assert [line.split(',')[2] for line in lines[1:]] == [
+        '5', '4', '3', '8', '2', '1', '6']
+
+    call_command('archive_period', '10/2011')
+    assert not CallDetail.objects.filter(reference_period='10/2011').exists()
+    assert [call.call_id for call in read_archive('10/2011')] == [
+        5, 4, 3, 8, 2, 1, 6]
+
+    # The previous file is removed once replaced
+    directory = os.path.dirname(archive.archive_path('10/2011'))
+    assert os.listdir(directory) == [
+        os.path.basename(archive.archive_path('10/2011'))]
+
+
+@pytest.mark.django_db
+@pytest.mark.freeze_time('2011-12-13')
+def test_archive_period_failed(calls, settings, monkeypatch):
+    """Test calls are kept in the database unless the file is read back"""
+    def check_archive(path, call_count):
+        raise OSError('unreadable')
+
+    monkeypatch.setattr(archive, 'check_archive', check_archive)
+    with pytest.raises(OSError):
+        call_command('archive_period', '10/2011')
+
+    assert not is_archived('10/2011')
+    assert CallDetail.objects.filter(reference_period='10/2011').count() == 6
+    assert os.listdir(os.path.join(
+        settings.ARCHIVE_DIR, 'reference_period=2011-10')) == []
+
+
+@pytest.mark.django_db
+@pytest.mark.freeze_time('2011-12-13')
+def test_get_calls_archived_meanwhile(calls, monkeypatch):
+    """Test bills read while their period is archived are not cached"""
+    render_call_records = views.render_call_records
+
+    def archive_and_render(calls):
+        call_records = render_call_records(calls)
+        call_command('archive_period', '10/2011')
+        return call_records
+
+    monkeypatch.setattr(views, 'render_call_records', archive_and_render)
+    client = APIClient()
+    bill = get_bill(client)
+    assert not MonthlyBill.objects.exists()
+
+    monkeypatch.setattr(views, 'render_call_records', render_call_records)
+    assert get_bill(client) == bill
+    assert MonthlyBill.objects.count() == 1
+
+
+@pytest.mark.django_db
+@pytest.mark.freeze_time('2011-12-13')
+def test_archived_rollups(calls):
+    """Test rollups of archived periods are kept when rebuilt"""
+    call_command('archive_period', '10/2011')
+    call_command('rebuild_rollups')
+
+    assert MonthlyRollup.objects.filter(reference_period='10/2011').count() == 2
+
+    with pytest.raises(CommandError):
+        call_command('rebuild_rollups', period='10/2011')
+    with pytest.raises(CommandError):
+        call_command('reprice_calls', '10/2011')
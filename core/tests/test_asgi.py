@@ -0,0 +1,214 @@
+import asyncio
+from datetime import datetime, timezone
+import json
+
+import pytest
+from django.core.wsgi import get_wsgi_application
+
+from core import asgi
+from core.asgi import ASGIHandler
+from core.models import CallDetail
+
+
+def make_scope(method, path, query_string=b'', body=b'',
+               content_type=b'application/json'):
+    return {
+        'type': 'http',
+        'method': method,
+        'path': path,
+        'query_string': query_string,
+        'http_version': '1.1',
+        'headers': [(b'content-type', content_type),
+                    (b'content-length', str(len(body)).encode())],
+        'client': ('127.0.0.1', 5000),
+        'server': ('testserver', 80),
+    }
+
+
+def request(method, path, query_string=b'', body=b''):
+    """Send a request to the ASGI application, returning its messages."""
+    application = ASGIHandler(get_wsgi_application(), 2)
+    received = [{'type': 'http.request', 'body': body, 'more_body': False}]
+    messages = []
+
+    async def receive():
+        if received:
+            return received.pop(0)
+        # The client stays connected until the response is sent
+        await asyncio.Future()
+
+    async def send(message):
+        messages.append(message)
+
+    asyncio.run(application(
+        make_scope(method, path, query_string, body), receive, send))
+    return messages
+
+
+# Requests run in other threads, with their own database connections
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.freeze_time('2011-12-13')
+def test_asgi_post_and_get_calls():
+    """Test calls are saved and billed through the ASGI application"""
+    start = {"call_id": 1, "type": "start",
+             "timestamp": "2011-10-13T08:30:15Z",
+             "source": "2212345678", "destination": "3312345678"}
+    messages = request('POST', '/calls/', body=json.dumps(start).encode())
+    assert messages[0]['status'] == 204
+
+    end = {"call_id": 1, "type": "end", "timestamp": "2011-10-13T08:40:00Z"}
+    request('POST', '/calls/', body=json.dumps(end).encode())
+    assert CallDetail.objects.get(call_id=1).price == 117
+
+    messages = request('GET', '/calls/',
+                       b'number=2212345678&period=10%2F2011')
+    assert messages[0]['status'] == 200
+    assert (b'content-type', b'application/json') in messages[0]['headers']
+    bill = json.loads(b''.join(m.get('body', b'') for m in messages[1:]))
+    assert bill['call_records'][0]['call_price'] == 'R$ 1,17'
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.freeze_time('2011-12-13')
+def test_asgi_streamed_bill(settings):
+    """Test streamed bills are sent in chunks as they are rendered"""
+    settings.BILL_STREAM_CHUNK_SIZE = 2
+    for call_id in range(1, 6):
+        CallDetail.objects.create(
+            call_id=call_id, source="2212345678", destination="3312345678",
+            duration=585, price=117, reference_period="10/2011",
+            started_at=datetime(2011, 10, call_id, 8, 30, 15,
+                                tzinfo=timezone.utc),
+            ended_at=datetime(2011, 10, call_id, 8, 40, 0,
+                              tzinfo=timezone.utc),
+            is_completed=True)
+
+    messages = request('GET', '/calls/',
+                       b'number=2212345678&period=10%2F2011&stream=true')
+    assert messages[0]['status'] == 200
+    chunks = [m['body'] for m in messages[1:] if m['body']]
+    # The head, 3 chunks of calls and the end of the document
+    assert len(chunks) == 5
+    assert len(json.loads(b''.join(chunks))['call_records']) == 5
+    assert messages[-1] == {'type': 'http.response.body', 'body': b''}
+
+
+@pytest.mark.django_db(transaction=True)
+def test_asgi_streamed_body(monkeypatch):
+    """Test request bodies are read while they are received"""
+    reads = []
+    receive_chunk = asgi.RequestBody.receive_chunk
+
+    def count_reads(body):
+        reads.append(len(body.buffer))
+        receive_chunk(body)
+
+    monkeypatch.setattr(asgi.RequestBody, 'receive_chunk', count_reads)
+
+    lines = [json.dumps({
+        "call_id": call_id, "type": "start",
+        "timestamp": "2011-10-13T08:30:15Z",
+        "source": "2212345678", "destination": "3312345678"
+    }).encode() + b'\n' for call_id in range(1, 41)]
+    body = b''.join(lines)
+    received = [{'type': 'http.request', 'body': line, 'more_body': True}
+                for line in lines]
+    received.append({'type': 'http.request', 'body': b'',
+                     'more_body': False})
+    messages = []
+
+    async def receive():
+        if len(received) == 1:
+            # The application started reading before the end of the body
+            assert reads
+        if received:
+            return received.pop(0)
+        await asyncio.Future()
+
+    async def send(message):
+        messages.append(message)
+
+    application = ASGIHandler(get_wsgi_application(), 2)
+    asyncio.run(application(
+        make_scope('POST', '/calls/batch/', body=body,
+                   content_type=b'application/x-ndjson'),
+        receive, send))
+
+    assert messages[0]['status'] == 200
+    assert json.loads(messages[1]['body']) == {'saved': 40, 'errors': []}
+    assert CallDetail.objects.count() == 40
+
+
+@pytest.mark.django_db(transaction=True)
+def test_asgi_disconnect_during_body():
+    """Test requests are not saved when the client leaves during the body"""
+    line = json.dumps({
+        "call_id": 1, "type": "start", "timestamp": "2011-10-13T08:30:15Z",
+        "source": "2212345678", "destination": "3312345678"
+    }).encode() + b'\n'
+    received = [
+        {'type': 'http.request', 'body': line, 'more_body': True},
+        {'type': 'http.disconnect'},
+    ]
+
+    async def receive():
+        return received.pop(0)
+
+    async def send(message):
+        pass
+
+    application = ASGIHandler(get_wsgi_application(), 2)
+    asyncio.run(application(
+        make_scope('POST', '/calls/batch/', body=line * 2,
+                   content_type=b'application/x-ndjson'),
+        receive, send))
+
+    assert not CallDetail.objects.exists()
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.freeze_time('2011-12-13')
+def test_asgi_disconnect_closes_response(settings):
+    """Test streamed bills stop being rendered when the client leaves"""
+    settings.BILL_STREAM_CHUNK_SIZE = 2
+    for call_id in range(1, 6):
+        CallDetail.objects.create(
+            call_id=call_id, source="2212345678", destination="3312345678",
+            duration=585, price=117, reference_period="10/2011",
+            started_at=datetime(2011, 10, call_id, 8, 30, 15,
+                                tzinfo=timezone.utc),
+            ended_at=datetime(2011, 10, call_id, 8, 40, 0,
+                              tzinfo=timezone.utc),
+            is_completed=True)
+
+    messages = []
+
+    async def main():
+        first_chunk = asyncio.Event()
+        disconnected = asyncio.Event()
+        received = [{'type': 'http.request', 'body': b'', 'more_body': False}]
+
+        async def receive():
+            if received:
+                return received.pop(0)
+            await first_chunk.wait()
+            disconnected.set()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            messages.append(message)
+            if message.get('body'):
+                first_chunk.set()
+                # The handler is told before the next chunk is rendered
+                await disconnected.wait()
+
+        application = ASGIHandler(get_wsgi_application(), 2)
+        await application(
+            make_scope('GET', '/calls/',
+                       b'number=2212345678&period=10%2F2011&stream=true'),
+            receive, send)
+
+    asyncio.run(main())
+    assert messages[0]['status'] == 200
+    # Only the head of the document was sent
+    assert [m['body'] for m in messages[1:]] == [messages[1]['body']]
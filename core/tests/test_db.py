@@ -0,0 +1,21 @@
+import pytest
+from django.db import connection
+from rest_framework.test import APIClient
+
+
+@pytest.mark.django_db
+@pytest.mark.freeze_time('2011-12-13')
+def test_unusable_connection_closed_on_request(monkeypatch, settings):
+    """Test broken persistent connections are closed before requests."""
+    closed = []
+    connection.ensure_connection()
+    monkeypatch.setattr(connection, 'is_usable', lambda: False)
+    monkeypatch.setattr(connection, 'close', lambda: closed.append(True))
+
+    settings.DB_CONN_HEALTH_CHECKS = False
+    APIClient().get('/calls/', {'number': '2212345678'})
+    assert closed == []
+
+    settings.DB_CONN_HEALTH_CHECKS = True
+    APIClient().get('/calls/', {'number': '2212345678'})
+    assert closed == [True]
@@ -0,0 +1,132 @@
+import json
+
+import pytest
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from rest_framework.test import APIClient
+
+from core.models import CallDetail
+
+CSV_EXPORT = [
+    'source,destination,call_id,started_at,ended_at,duration,price',
+    '2212345678,3312345678,2,2011-10-01T08:30:15Z,2011-10-01T08:40:00Z,585,'
+    '117',
+    '2212345678,3312345678,1,2011-10-02T08:30:15Z,2011-10-02T08:40:00Z,585,'
+    '117',
+    '3312345678,2212345678,3,2011-10-01T08:30:15Z,2011-10-01T08:40:00Z,585,'
+    '117',
+]
+
+
+@pytest.fixture
+def calls(create_call):
+    create_call(1, "2212345678", "3312345678", 2)
+    create_call(2, "2212345678", "3312345678", 1)
+    create_call(3, "3312345678", "2212345678", 1)
+    # Calls of other periods and incomplete calls are not exported
+    create_call(4, "2212345678", "3312345678", 1, month=9)
+    CallDetail.objects.create(call_id=5, source="2212345678",
+                              destination="3312345678", is_completed=False)
+
+
+@pytest.fixture
+def client(settings):
+    settings.EXPORT_TOKEN = 'secret'
+    client = APIClient()
+    client.credentials(HTTP_AUTHORIZATION='Bearer secret')
+    return client
+
+
+@pytest.mark.django_db
+@pytest.mark.freeze_time('2011-12-13')
+def test_get_calls_export_csv(client, calls, settings):
+    """Test if GET export streams the calls of the period as CSV"""
+    settings.BILL_STREAM_CHUNK_SIZE = 2
+
+    response = client.get('/calls/export/', {'period': '10/2011'})
+    assert response.status_code == 200
+    assert response.streaming
+    assert response['Content-Type'] == 'text/csv'
+    assert response['Content-Disposition'] == (
+        'attachment; filename="10-2011.csv"')
+
+    content = b''.join(response.streaming_content).decode()
+    assert content.splitlines() == CSV_EXPORT
+
+
+@pytest.mark.django_db
+@pytest.mark.freeze_time('2011-12-13')
+def test_get_calls_export_ndjson(client, calls):
+    """Test if GET export streams the calls of the period as NDJSON"""
+
+    response = client.get(
+        '/calls/export/', {'period': '10/2011', 'output': 'ndjson'})
+    assert response.status_code == 200
+    assert response['Content-Type'] == 'application/x-ndjson'
+
+    lines = b''.join(response.streaming_content).decode().splitlines()
+    assert [json.loads(line)['call_id'] for line in lines] == [2, 1, 3]
+    assert json.loads(lines[0]) == {
+        'source': '2212345678',
+        'destination': '3312345678',
+        'call_id': 2,
+        'started_at': '2011-10-01T08:30:15Z',
+        'ended_at': '2011-10-01T08:40:00Z',
+        'duration': 585,
+        'price': 117
+    }
+
+
+@pytest.mark.django_db
+@pytest.mark.freeze_time('2011-12-13')
+def test_get_calls_export_invalid_params(client):
+    """Test if GET export validates the period and the output format"""
+
+    response = client.get('/calls/export/')
+    assert response.status_code == 400
+    assert response.data == {'period': 'This field is required.'}
+
+    response = client.get('/calls/export/', {'period': '13/2011'})
+    assert response.status_code == 400
+    assert response.data == {
+        'period': 'period must be in the format: "MM/YYYY"'}
+
+    response = client.get('/calls/export/', {'period': '12/2011'})
+    assert response.status_code == 400
+    assert response.data == {
+        'period': 'period must be of a closed (previous) month.'}
+
+    response = client.get(
+        '/calls/export/', {'period': '10/2011', 'output': 'xml'})
+    assert response.status_code == 400
+    assert response.data == {'output': 'output must be "csv" or "ndjson".'}
+
+
+@pytest.mark.django_db
+@pytest.mark.freeze_time('2011-12-13')
+def test_get_calls_export_token(calls, settings):
+    """Test the export is only served to requests with the token"""
+    client = APIClient()
+    params = {'period': '10/2011'}
+    settings.EXPORT_TOKEN = ''
+    assert client.get('/calls/export/', params).status_code == 404
+
+    settings.EXPORT_TOKEN = 'secret'
+    response = client.get('/calls/export/', params)
+    assert response.status_code == 401
+    assert response['WWW-Authenticate'] == 'Bearer'
+    assert client.get('/calls/export/', params,
+                      HTTP_AUTHORIZATION='Bearer other').status_code == 401
+    assert client.get('/calls/export/', params,
+                      HTTP_AUTHORIZATION='Bearer secret').status_code == 200
+
+
+@pytest.mark.django_db
+def test_export_calls_command(calls, tmp_path):
+    """Test the export_calls command writes the calls of the period"""
+    path = tmp_path / 'export.csv'
+    call_command('export_calls', '10/2011', output=str(path), chunk_size=1)
+    assert path.read_text().splitlines() == CSV_EXPORT
+
+    with pytest.raises(CommandError):
+        call_command('export_calls', '2011-10')
@@ -0,0 +1,146 @@
+from datetime import datetime, timezone
+import json
+
+import pytest
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from core.importer import SpilledPairing
+from core.models import CallDetail
+
+CSV_LINES = [
+    'type,call_id,timestamp,source,destination',
+    'start,1,2019-09-30T08:30:15Z,2212345678,3312345678',
+    'end,2,2019-09-30T08:40:00Z,,',
+    'start,3,2019-09-30T08:30:15Z,2212345678,3312345678',
+    'end,1,2019-09-30T08:40:00Z,,',
+    'end,a,2019-09-30T08:40:00Z,,',
+    'start,2,2019-09-30T08:30:15Z,2212345678,3312345678',
+]
+
+
+def completed_calls():
+    return list(CallDetail.objects.filter(
+        is_completed=True
+    ).order_by('call_id').values_list('call_id', 'duration', 'price'))
+
+
+@pytest.mark.django_db
+def test_import_cdrs_csv(tmp_path, capsys):
+    """Test CSV import pairs records of different chunks."""
+    path = tmp_path / 'cdrs.csv'
+    path.write_text('\n'.join(CSV_LINES) + '\n')
+
+    call_command('import_cdrs', str(path), chunk_size=2)
+
+    assert completed_calls() == [(1, 585, 117), (2, 585, 117)]
+    assert CallDetail.objects.get(call_id=3).is_completed == False
+
+    out, err = capsys.readouterr()
+    assert 'Imported 5 records, 1 invalid.' in out
+    assert "'call_id': 'call_id must be an integer.'" in err
+
+
+@pytest.mark.django_db
+def test_import_cdrs_invalid_encoding(tmp_path, capsys):
+    """Test lines that are not UTF-8 are reported, not stopping the import."""
+    path = tmp_path / 'cdrs.csv'
+    lines = [line.encode() for line in CSV_LINES]
+    lines.insert(2, b'end,4,2019-09-30T08:40:00Z,\xff,')
+    path.write_bytes(b'\n'.join(lines) + b'\n')
+
+    call_command('import_cdrs', str(path), chunk_size=2)
+
+    assert completed_calls() == [(1, 585, 117), (2, 585, 117)]
+    out, err = capsys.readouterr()
+    assert 'Imported 5 records, 2 invalid.' in out
+    assert "'record': 'record must be a JSON object.'" in err
+
+    path.write_bytes(b'type,call_id,\xff\n')
+    with pytest.raises(CommandError, match='not valid UTF-8'):
+        call_command('import_cdrs', str(path))
+
+
+@pytest.mark.django_db
+def test_import_cdrs_ndjson_resume(tmp_path):
+    """Test NDJSON import resumes from the checkpoint."""
+    records = [{
+        "call_id": 1,
+        "type": "start",
+        "timestamp": "2019-09-30T08:30:15Z",
+        "source": "2212345678",
+        "destination": "3312345678"
+    }, {
+        "call_id": 1,
+        "type": "end",
+        "timestamp": "2019-09-30T08:40:00Z"
+    }, {
+        "call_id": 2,
+        "type": "end",
+        "timestamp": "2019-09-30T08:40:00Z"
+    }]
+    path = tmp_path / 'cdrs.ndjson'
+    path.write_text(
+        ''.join(json.dumps(record) + '\n' for record in records) +
+        'not json\n')
+
+    # Resume after the first record, previously imported
+    checkpoint = tmp_path / 'checkpoint.json'
+    first_line = path.read_text().split('\n')[0]
+    checkpoint.write_text(json.dumps({'offset': len(first_line) + 1}))
+    CallDetail.objects.create(
+        call_id=1, source="2212345678", destination="3312345678",
+        started_at=datetime(2019, 9, 30, 8, 30, 15, tzinfo=timezone.utc))
+
+    call_command('import_cdrs', str(path), checkpoint=str(checkpoint),
+                 chunk_size=2)
+
+    assert completed_calls() == [(1, 585, 117)]
+    assert CallDetail.objects.count() == 2
+    assert json.loads(checkpoint.read_text()) == {
+        'offset': len(path.read_bytes())}
+
+    # Nothing left to import
+    call_command('import_cdrs', str(path), checkpoint=str(checkpoint))
+    assert CallDetail.objects.count() == 2
+
+
+def test_spilled_pairing():
+    """Test unmatched halves are kept until their pair is read."""
+    start = {"call_id": 1, "type": "start"}
+    end = {"call_id": 1, "type": "end"}
+    other = {"call_id": 2, "type": "end"}
+
+    pairing = SpilledPairing()
+    assert pairing.pair([(10, 1, start), (20, 2, other)]) == []
+    assert pairing.count() == 2
+
+    assert pairing.pair([(30, 1, end)]) == [(10, start), (30, end)]
+    assert list(pairing.drain(10)) == [[(20, other)]]
+    assert pairing.count() == 0
+    pairing.close()
+
+
+@pytest.mark.django_db
+def test_import_cdrs_spilled_pairs(tmp_path):
+    """Test calls of records far apart are saved only once, completed."""
+    lines = [CSV_LINES[0]]
+    for call_id in range(1, 11):
+        lines.append('start,{},2019-09-30T08:30:15Z,2212345678,'
+                     '3312345678'.format(call_id))
+    for call_id in range(1, 11):
+        lines.append('end,{},2019-09-30T08:40:00Z,,'.format(call_id))
+    path = tmp_path / 'cdrs.csv'
+    path.write_text('\n'.join(lines) + '\n')
+    checkpoint = tmp_path / 'checkpoint.json'
+
+    with CaptureQueriesContext(connection) as queries:
+        call_command('import_cdrs', str(path), chunk_size=3,
+                     checkpoint=str(checkpoint))
+
+    assert completed_calls() == [
+        (call_id, 585, 117) for call_id in range(1, 11)]
+    assert not any(query['sql'].startswith('UPDATE "core_calldetail"')
+                   for query in queries.captured_queries)
+    assert not (tmp_path / 'checkpoint.json.spill').exists()
@@ -0,0 +1,208 @@
+from datetime import datetime, timezone
+import json
+
+import pytest
+from rest_framework.test import APIClient
+
+from core.metrics import (
+    DB_QUERIES, REQUEST_SECONDS, STAGE_SECONDS, Histogram, clear_metrics)
+from core.models import MetricsSnapshot
+
+VIEW = 'core.views.calls'
+
+
+@pytest.fixture
+def metrics(settings):
+    settings.METRICS_SAMPLE_RATE = 1
+    settings.METRICS_TOKEN = 'secret'
+    clear_metrics()
+    yield
+    clear_metrics()
+
+
+def stages(view=VIEW):
+    return {stage for (name, stage) in STAGE_SECONDS.samples if name == view}
+
+
+def test_histogram_render():
+    """Test histograms are rendered with cumulative buckets per label."""
+    histogram = Histogram('test_seconds', 'Test.', ('stage',), (0.1, 1))
+    histogram.observe(0.05, 'save')
+    histogram.observe(0.5, 'save')
+    histogram.observe(2, 'save')
+    histogram.observe(1, 'lookup')
+
+    assert histogram.render() == (
+        '# HELP test_seconds Test.\n'
+        '# TYPE test_seconds histogram\n'
+        'test_seconds_bucket{stage="lookup",le="0.1"} 0\n'
+        'test_seconds_bucket{stage="lookup",le="1"} 1\n'
+        'test_seconds_bucket{stage="lookup",le="+Inf"} 1\n'
+        'test_seconds_sum{stage="lookup"} 1\n'
+        'test_seconds_count{stage="lookup"} 1\n'
+        'test_seconds_bucket{stage="save",le="0.1"} 1\n'
+        'test_seconds_bucket{stage="save",le="1"} 2\n'
+        'test_seconds_bucket{stage="save",le="+Inf"} 3\n'
+        'test_seconds_sum{stage="save"} 2.55\n'
+        'test_seconds_count{stage="save"} 3\n')
+
+
+@pytest.mark.django_db
+@pytest.mark.freeze_time('2011-12-13')
+def test_bill_request_metrics(metrics, create_calls):
+    """Test the stages and queries of a bill request are recorded."""
+    create_calls(3)
+
+    response = APIClient().get(
+        '/calls/', {'number': "2212345678", 'period': '10/2011'})
+    assert response.status_code == 200
+
+    assert stages() == {
+        'validation', 'lookup', 'serialization', 'save', 'rendering'}
+    assert list(REQUEST_SECONDS.samples) == [(VIEW, 'GET', 200)]
+    counts, _ = DB_QUERIES.samples[(VIEW,)]
+    assert sum(counts) == 1
+
+    response = APIClient().get('/metrics', HTTP_AUTHORIZATION='Bearer secret')
+    assert response.status_code == 200
+    assert response['Content-Type'].startswith('text/plain; version=0.0.4')
+    content = response.content.decode()
+    assert ('calldetails_stage_duration_seconds_count{view="core.views.calls"'
+            ',stage="serialization"} 1\n') in content
+    assert ('calldetails_request_duration_seconds_count{view="core.views.calls"'
+            ',method="GET",status="200"} 1\n') in content
+    assert 'calldetails_request_db_queries_sum{view="core.views.calls"}' in (
+        content)
+    assert 'calldetails_queue_depth 0\n' in content
+
+
+@pytest.mark.django_db
+def test_post_request_metrics(metrics):
+    """Test pricing is recorded as a stage of saving the call."""
+    client = APIClient()
+    client.post('/calls/', {
+        "call_id": 11, "type": "start", "timestamp": "2016-02-29T12:00:00Z",
+        "source": "11987654321", "destination": "11123456789"
+    }, format='json')
+    client.post('/calls/', {
+        "call_id": 11, "type": "end", "timestamp": "2016-02-29T12:10:00Z"
+    }, format='json')
+
+    assert {'validation', 'save', 'get_price', 'rendering'} <= stages()
+    assert list(REQUEST_SECONDS.samples) == [(VIEW, 'POST', 204)]
+
+
+@pytest.mark.django_db
+@pytest.mark.freeze_time('2011-12-13')
+def test_streamed_bill_metrics(metrics, settings, create_calls):
+    """Test streamed bills are recorded when the response is closed."""
+    settings.BILL_STREAM_CHUNK_SIZE = 2
+    create_calls(5)
+
+    response = APIClient().get('/calls/', {
+        'number': "2212345678", 'period': '10/2011', 'stream': 'true'})
+    assert REQUEST_SECONDS.samples == {}
+
+    b''.join(response.streaming_content)
+    assert 'rendering' in stages()
+    assert list(REQUEST_SECONDS.samples) == [(VIEW, 'GET', 200)]
+    counts, _ = DB_QUERIES.samples[(VIEW,)]
+    assert sum(counts) == 1
+
+
+@pytest.mark.django_db
+@pytest.mark.freeze_time('2011-12-13')
+def test_requests_not_sampled(metrics, settings, create_calls):
+    """Test nothing is recorded for requests left out of the sample."""
+    settings.METRICS_SAMPLE_RATE = 0
+    create_calls(1)
+
+    APIClient().get('/calls/', {'number': "2212345678", 'period': '10/2011'})
+    assert STAGE_SECONDS.samples == {}
+    assert REQUEST_SECONDS.samples == {}
+
+
+@pytest.mark.django_db
+@pytest.mark.freeze_time('2011-12-13')
+def test_metrics_of_every_process(metrics, create_calls):
+    """Test /metrics sums the samples saved by every process."""
+    create_calls(1)
+    client = APIClient()
+    client.get('/calls/', {'number': "2212345678", 'period': '10/2011'})
+
+    # Requests served by another worker process
+    samples = {REQUEST_SECONDS.name: [
+        [[VIEW, 'GET', 200], [0] * 14 + [1], 12.5],
+        [[VIEW, 'POST', 204], [1] + [0] * 14, 0.0001],
+    ]}
+    MetricsSnapshot.objects.create(
+        process='web.2-4-0123abcd', samples=json.dumps(samples))
+
+    content = client.get(
+        '/metrics', HTTP_AUTHORIZATION='Bearer secret').content.decode()
+    assert ('calldetails_request_duration_seconds_count{view="core.views.calls"'
+            ',method="GET",status="200"} 2\n') in content
+    assert ('calldetails_request_duration_seconds_count{view="core.views.calls"'
+            ',method="POST",status="204"} 1\n') in content
+    assert MetricsSnapshot.objects.count() == 2
+
+
+@pytest.mark.django_db
+@pytest.mark.freeze_time('2011-12-13')
+def test_metrics_of_expired_processes(metrics, create_calls):
+    """Test snapshots not saved for a while are folded into a single one."""
+    create_calls(1)
+    client = APIClient()
+    params = {'number': "2212345678", 'period': '10/2011'}
+    count = ('calldetails_request_duration_seconds_count{'
+             'view="core.views.calls",method="GET",status="200"} %d\n')
+
+    def expire(process):
+        MetricsSnapshot.objects.filter(process=process).update(
+            updated_at=datetime(2011, 12, 12, tzinfo=timezone.utc))
+
+    # Requests served by a stopped worker process
+    samples = {REQUEST_SECONDS.name: [
+        [[VIEW, 'GET', 200], [0] * 14 + [1], 12.5],
+    ]}
+    MetricsSnapshot.objects.create(
+        process='web.2-4-0123abcd', samples=json.dumps(samples))
+    expire('web.2-4-0123abcd')
+
+    client.get('/calls/', params)
+    content = client.get(
+        '/metrics', HTTP_AUTHORIZATION='Bearer secret').content.decode()
+    assert count % 2 in content
+    assert MetricsSnapshot.objects.filter(
+        process='web.2-4-0123abcd').count() == 0
+    assert MetricsSnapshot.objects.filter(process='expired').count() == 1
+
+    # A process idle for a while is folded and keeps saving its new samples
+    (process,) = MetricsSnapshot.objects.exclude(
+        process='expired').values_list('process', flat=True)
+    expire(process)
+    client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret')
+    assert MetricsSnapshot.objects.count() == 2
+
+    client.get('/calls/', params)
+    content = client.get(
+        '/metrics', HTTP_AUTHORIZATION='Bearer secret').content.decode()
+    assert count % 3 in content
+    assert MetricsSnapshot.objects.count() == 2
+
+
+@pytest.mark.django_db
+def test_metrics_token(settings):
+    """Test /metrics is only served to requests with the token."""
+    client = APIClient()
+    settings.METRICS_TOKEN = ''
+    assert client.get('/metrics').status_code == 404
+
+    settings.METRICS_TOKEN = 'secret'
+    response = client.get('/metrics')
+    assert response.status_code == 401
+    assert response['WWW-Authenticate'] == 'Bearer'
+    assert client.get(
+        '/metrics', HTTP_AUTHORIZATION='Bearer other').status_code == 401
+    assert client.get(
+        '/metrics', HTTP_AUTHORIZATION='Bearer secret').status_code == 200
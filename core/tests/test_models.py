@@ -0,0 +1,236 @@
+from datetime import datetime, timezone
+
+import pytest
+from django.core.management import call_command
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+
+from core.models import CallDetail, MonthlyRollup
+from core.pagination import encode_cursor, paginate_bill
+from core.partitions import is_partitioned, partition_name
+
+
+def explain(queryset):
+    """
+    Return the query plan of a queryset, forcing index usage on PostgreSQL.
+
+    Tests run against almost empty tables, so PostgreSQL would always prefer a
+    sequential scan. Disabling it shows whether an index is usable, as it would
+    be chosen on a production sized table.
+    """
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+
+    return queryset.explain()
+
+
+@pytest.mark.django_db
+def test_call_id_lookup_uses_index():
+    """Test the call_id lookup of the POST calls does not scan the table."""
+    plan = explain(CallDetail.objects.filter(call_id=11))
+
+    if connection.vendor == 'sqlite':
+        assert 'USING INDEX' in plan or 'USING COVERING INDEX' in plan
+    elif connection.vendor == 'postgresql':
+        assert 'Index' in plan
+        assert 'Seq Scan' not in plan
+
+
+@pytest.mark.django_db
+def test_export_query_uses_index():
+    """Test the export query filters and orders using the bill index."""
+    plan = explain(CallDetail.objects.export('10/2011'))
+
+    assert 'calldetail_bill_idx' in plan
+    if connection.vendor == 'sqlite':
+        assert 'TEMP B-TREE' not in plan
+    elif connection.vendor == 'postgresql':
+        assert 'Seq Scan' not in plan
+        assert 'Sort' not in plan
+
+
+@pytest.mark.django_db
+def test_bill_query_uses_index():
+    """Test the bill query filters and orders using the bill index."""
+    plan = explain(CallDetail.objects.bill('2212345678', '10/2011'))
+
+    assert 'calldetail_bill_idx' in plan
+    if connection.vendor == 'sqlite':
+        # Rows are already sorted by the index, no extra sorting is needed
+        assert 'TEMP B-TREE' not in plan
+    elif connection.vendor == 'postgresql':
+        assert 'Seq Scan' not in plan
+        assert 'Sort' not in plan
+
+
+@pytest.mark.django_db
+def test_bill_page_query_uses_index():
+    """Test the query of a bill page after a cursor uses the bill index."""
+    call = CallDetail.objects.create(
+        call_id=1, source="2212345678", destination="3312345678",
+        duration=585, price=117, reference_period="10/2011",
+        started_at=datetime(2011, 10, 13, 8, 30, 15, tzinfo=timezone.utc),
+        ended_at=datetime(2011, 10, 13, 8, 40, 0, tzinfo=timezone.utc),
+        is_completed=True)
+
+    queries = []
+
+    def record_query(execute, sql, params, many, context):
+        queries.append((sql, params))
+        return execute(sql, params, many, context)
+
+    with connection.execute_wrapper(record_query):
+        paginate_bill(CallDetail.objects.bill('2212345678', '10/2011'),
+                      encode_cursor(call), 10)
+
+    sql, params = queries[0]
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            cursor.execute('EXPLAIN ' + sql, params)
+        else:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+        plan = str(cursor.fetchall())
+
+    assert 'calldetail_bill_idx' in plan
+    if connection.vendor == 'sqlite':
+        assert 'TEMP B-TREE' not in plan
+    elif connection.vendor == 'postgresql':
+        assert 'Sort' not in plan
+
+
+@pytest.mark.django_db
+def test_bill_query_prunes_partitions(capsys, settings):
+    """Test the bill query only reads the partition of its period."""
+    call_command('create_partition', period='10/2011')
+    out, err = capsys.readouterr()
+
+    # Run by the PostgreSQL job of the CI, with CD_CALL_DETAIL_PARTITIONS
+    if not settings.CALL_DETAIL_PARTITIONS:
+        assert not is_partitioned()
+        assert out == 'Calls are not partitioned, nothing to do.\n'
+        pytest.skip('calls are not partitioned')
+    assert connection.vendor == 'postgresql'
+    assert is_partitioned()
+
+    assert out == 'Created partition core_calldetail_p2011_10.\n'
+    call_command('create_partition', period='11/2011')
+
+    plan = explain(CallDetail.objects.bill('2212345678', '10/2011'))
+    assert partition_name('10/2011') in plan
+    assert partition_name('11/2011') not in plan
+    assert 'core_calldetail_default' not in plan
+
+
+@pytest.mark.django_db
+def test_compact_call_fields():
+    """Test phone numbers and periods are stored as integers."""
+    CallDetail.objects.create(
+        call_id=1, source="2212345678", destination="33123456789",
+        reference_period="10/2011", is_completed=True)
+    MonthlyRollup.objects.create(source="2212345678",
+                                 reference_period="12/2010")
+
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT source, destination, reference_period '
+                       'FROM core_calldetail')
+        assert cursor.fetchone() == (2212345678, 33123456789, 201110)
+
+    call = CallDetail.objects.get(source="2212345678")
+    assert (call.source, call.destination, call.reference_period) == (
+        "2212345678", "33123456789", "10/2011")
+
+    # Periods are ordered chronologically
+    assert list(MonthlyRollup.objects.filter(
+        reference_period__lt="01/2011").values_list(
+            'reference_period', flat=True)) == ["12/2010"]
+    assert list(CallDetail.objects.filter(
+        reference_period__range=("01/2011", "12/2011")).values_list(
+            'call_id', flat=True)) == [1]
+
+    # The leading zero would be lost, matching another number
+    with pytest.raises(ValueError):
+        CallDetail.objects.filter(source="02212345678").exists()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_migration_merges_duplicate_calls():
+    """Test duplicated call_ids are merged before call_id becomes unique."""
+    executor = MigrationExecutor(connection)
+    executor.migrate([('core', '0001_initial')])
+    apps = executor.loader.project_state([('core', '0001_initial')]).apps
+    OldCallDetail = apps.get_model('core', 'CallDetail')
+
+    try:
+        OldCallDetail.objects.create(
+            call_id=1, source='2212345678', destination='3312345678',
+            started_at=datetime(2011, 10, 1, 8, 30, 15, tzinfo=timezone.utc))
+        OldCallDetail.objects.create(
+            call_id=1, reference_period='10/2011',
+            ended_at=datetime(2011, 10, 1, 8, 40, 0, tzinfo=timezone.utc))
+        OldCallDetail.objects.create(
+            call_id=2, reference_period='10/2011',
+            ended_at=datetime(2011, 10, 1, 8, 40, 0, tzinfo=timezone.utc))
+        OldCallDetail.objects.create(
+            call_id=2, reference_period='10/2011',
+            ended_at=datetime(2011, 10, 1, 8, 50, 0, tzinfo=timezone.utc))
+    finally:
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    assert list(CallDetail.objects.order_by('call_id').values_list(
+        'call_id', 'source', 'duration', 'price', 'reference_period',
+        'is_completed')) == [
+            (1, '2212345678', 585, 117, '10/2011', True),
+            (2, None, None, None, '10/2011', False),
+        ]
+    assert CallDetail.objects.get(call_id=2).ended_at == datetime(
+        2011, 10, 1, 8, 40, 0, tzinfo=timezone.utc)
+
+
+@pytest.mark.django_db(transaction=True)
+def test_migration_stops_on_leading_zero():
+    """Test numbers starting with 0 stop their conversion to integers."""
+    executor = MigrationExecutor(connection)
+    target = [('core', '0009_call_detail_partitions')]
+    executor.migrate(target)
+    apps = executor.loader.project_state(target).apps
+    OldCallDetail = apps.get_model('core', 'CallDetail')
+    call = OldCallDetail.objects.create(
+        call_id=1, source='02212345678', destination='3312345678')
+
+    try:
+        executor = MigrationExecutor(connection)
+        with pytest.raises(ValueError, match='starting with 0'):
+            executor.migrate(executor.loader.graph.leaf_nodes())
+    finally:
+        call.delete()
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+
+@pytest.mark.django_db(transaction=True)
+def test_migration_rolls_up_completed_calls():
+    """Test the calls completed before the rollups are rolled up."""
+    executor = MigrationExecutor(connection)
+    target = [('core', '0006_monthly_bill_summary')]
+    executor.migrate(target)
+    apps = executor.loader.project_state(target).apps
+    OldCallDetail = apps.get_model('core', 'CallDetail')
+
+    try:
+        for call_id, duration, price in [(1, 60, 45), (2, 120, 54)]:
+            OldCallDetail.objects.create(
+                call_id=call_id, source='2212345678',
+                destination='3312345678', duration=duration, price=price,
+                reference_period='10/2011', is_completed=True)
+        OldCallDetail.objects.create(
+            call_id=3, source='2212345678', destination='3312345678')
+    finally:
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    assert list(MonthlyRollup.objects.values_list(
+        'source', 'reference_period', 'call_count', 'total_duration',
+        'total_price')) == [('2212345678', '10/2011', 2, 180, 99)]
@@ -0,0 +1,100 @@
+from datetime import datetime, timedelta, timezone
+import random
+
+import pytest
+from django.core.management import call_command
+
+from core.models import CallDetail, MonthlyBill
+from core.pricing import get_prices, to_epoch_seconds
+from core.utils import TariffTable, get_price
+
+TARIFF = TariffTable(
+    standing_charge=50,
+    standard_minute_charge=10,
+    reduced_minute_charge=2,
+    standard_start=8 * 60 * 60 + 30 * 60,
+    standard_end=20 * 60 * 60)
+
+# Calls from the get_price tests, (start, end, price)
+GET_PRICE_CASES = [
+    ((2011, 12, 13, 4, 0, 0), (2011, 12, 13, 5, 10, 0), 36),
+    ((2011, 12, 13, 22, 0, 0), (2011, 12, 13, 22, 10, 0), 36),
+    ((2011, 12, 13, 15, 0, 0), (2011, 12, 13, 15, 10, 0), 126),
+    ((2011, 12, 13, 15, 5, 20), (2011, 12, 13, 15, 10, 0), 72),
+    ((2011, 12, 13, 5, 57, 0), (2011, 12, 13, 6, 3, 30), 63),
+    ((2011, 12, 13, 21, 57, 13), (2011, 12, 13, 22, 17, 53), 54),
+    ((2011, 12, 13, 5, 50, 0), (2011, 12, 13, 22, 20, 0), 8676),
+    ((2011, 12, 13, 23, 15, 0), (2011, 12, 14, 3, 45, 0), 36),
+    ((2011, 12, 13, 23, 15, 0), (2011, 12, 14, 6, 45, 0), 441),
+    ((2011, 12, 13, 21, 0, 0), (2011, 12, 14, 5, 45, 0), 576),
+    ((2011, 12, 13, 21, 0, 0), (2011, 12, 14, 7, 0, 0), 1116),
+]
+
+
+def random_calls(count, max_duration, seed=0):
+    """Generate calls with random start and duration, up to max_duration"""
+    generator = random.Random(seed)
+    first_start = datetime(2011, 1, 1, tzinfo=timezone.utc)
+
+    calls = []
+    for _ in range(count):
+        start = first_start + timedelta(
+            seconds=generator.randrange(365 * 24 * 60 * 60))
+        duration = timedelta(
+            seconds=generator.randrange(int(max_duration.total_seconds())))
+        calls.append((start, start + duration))
+
+    return calls
+
+
+def test_get_prices_get_price_cases():
+    """Test get_prices matches the get_price test cases"""
+
+    starts = [datetime(*start, tzinfo=timezone.utc)
+              for start, _, _ in GET_PRICE_CASES]
+    ends = [datetime(*end, tzinfo=timezone.utc)
+            for _, end, _ in GET_PRICE_CASES]
+
+    prices = get_prices(to_epoch_seconds(starts), to_epoch_seconds(ends))
+    assert prices.tolist() == [price for _, _, price in GET_PRICE_CASES]
+
+
+def test_get_prices_matches_get_price():
+    """Test get_prices matches get_price on a random corpus of calls"""
+
+    calls = random_calls(20000, max_duration=timedelta(days=3))
+    starts, ends = zip(*calls)
+
+    prices = get_prices(to_epoch_seconds(starts), to_epoch_seconds(ends))
+    assert prices.tolist() == [get_price(start, end) for start, end in calls]
+
+    prices = get_prices(
+        to_epoch_seconds(starts), to_epoch_seconds(ends), TARIFF)
+    assert prices.tolist() == [
+        get_price(start, end, TARIFF) for start, end in calls]
+
+
+@pytest.mark.django_db
+def test_reprice_calls_command():
+    """Test reprice_calls command updates prices of a period"""
+
+    CallDetail.objects.create(
+        call_id=1, source="2212345678", destination="3312345678",
+        duration=1240, price=0, reference_period="10/2011",
+        started_at=datetime(2011, 10, 13, 21, 57, 13, tzinfo=timezone.utc),
+        ended_at=datetime(2011, 10, 13, 22, 17, 53, tzinfo=timezone.utc),
+        is_completed=True)
+    CallDetail.objects.create(
+        call_id=2, source="2212345678", destination="3312345678",
+        duration=585, price=0, reference_period="11/2011",
+        started_at=datetime(2011, 11, 13, 8, 30, 15, tzinfo=timezone.utc),
+        ended_at=datetime(2011, 11, 13, 8, 40, 0, tzinfo=timezone.utc),
+        is_completed=True)
+    MonthlyBill.objects.create(
+        number="2212345678", period="10/2011", call_records='[]')
+
+    call_command('reprice_calls', '10/2011', chunk_size=1)
+
+    assert CallDetail.objects.get(call_id=1).price == 54
+    assert CallDetail.objects.get(call_id=2).price == 0
+    assert MonthlyBill.objects.count() == 0
@@ -0,0 +1,131 @@
+import os
+import pstats
+
+import pytest
+from django.contrib.auth.models import User
+from rest_framework.test import APIClient
+
+BILL_PARAMS = {'number': "2212345678", 'period': '10/2011'}
+
+
+@pytest.fixture
+def profiling_dir(settings, tmp_path):
+    settings.PROFILING_DIR = str(tmp_path)
+    settings.PROFILING_ALLOWED_IPS = []
+    return tmp_path
+
+
+def function_names(path):
+    stats = pstats.Stats(str(path))
+    return {name for _, _, name in stats.stats}
+
+
+@pytest.mark.django_db
+@pytest.mark.freeze_time('2011-12-13')
+def test_profile_allowed_address(profiling_dir, settings, create_calls):
+    """Test flagged requests of allowed addresses write their profile."""
+    settings.PROFILING_ALLOWED_IPS = ['127.0.0.1']
+    create_calls(3)
+
+    response = APIClient().get('/calls/', BILL_PARAMS, HTTP_X_PROFILE='true')
+    assert response.status_code == 200
+
+    name = response['X-Profile']
+    assert sorted(os.listdir(profiling_dir)) == [
+        name + '.prof', name + '.sql']
+    assert 'render_call_records' in function_names(
+        profiling_dir / (name + '.prof'))
+
+    sql = (profiling_dir / (name + '.sql')).read_text()
+    assert sql.startswith('-- GET /calls/?number=2212345678&period=10%2F2011')
+    assert 'FROM "core_calldetail"' in sql
+
+
+@pytest.mark.django_db
+@pytest.mark.freeze_time('2011-12-13')
+def test_profile_staff_user(profiling_dir, create_calls):
+    """Test staff users can profile requests with the query flag."""
+    create_calls(1)
+    client = APIClient()
+    params = dict(BILL_PARAMS, profile='true')
+
+    # Logged in to the admin
+    user = User.objects.create_user(
+        'operator', password='secret', is_staff=True)
+    response = client.post('/admin/login/', {
+        'username': 'operator', 'password': 'secret', 'next': '/admin/'})
+    assert response.status_code == 302
+    response = client.get('/calls/', params)
+    assert response.status_code == 200
+    assert len(os.listdir(profiling_dir)) == 2
+
+    user.is_staff = False
+    user.save()
+    response = client.get('/calls/', params)
+    assert response.status_code == 200
+    assert not response.has_header('X-Profile')
+    assert len(os.listdir(profiling_dir)) == 2
+
+
+@pytest.mark.django_db
+@pytest.mark.freeze_time('2011-12-13')
+def test_profile_not_allowed(profiling_dir, settings, create_calls):
+    """Test requests are not profiled unless flagged and allowed."""
+    create_calls(1)
+
+    response = APIClient().get('/calls/', BILL_PARAMS, HTTP_X_PROFILE='true')
+    assert not response.has_header('X-Profile')
+
+    settings.PROFILING_ALLOWED_IPS = ['127.0.0.1']
+    response = APIClient().get('/calls/', BILL_PARAMS)
+    assert not response.has_header('X-Profile')
+
+    settings.PROFILING_DIR = ''
+    response = APIClient().get('/calls/', BILL_PARAMS, HTTP_X_PROFILE='true')
+    assert not response.has_header('X-Profile')
+
+    assert os.listdir(profiling_dir) == []
+
+
+@pytest.mark.django_db
+@pytest.mark.freeze_time('2011-12-13')
+def test_profile_forwarded_address(profiling_dir, settings, create_calls):
+    """Test clients behind a trusted proxy are allowed by their address."""
+    settings.PROFILING_ALLOWED_IPS = ['203.0.113.7']
+    settings.PROFILING_TRUSTED_PROXIES = 1
+    create_calls(1)
+    client = APIClient()
+
+    # Addresses added before the trusted proxy can be forged
+    response = client.get('/calls/', BILL_PARAMS, HTTP_X_PROFILE='true',
+                          HTTP_X_FORWARDED_FOR='203.0.113.7, 198.51.100.1')
+    assert not response.has_header('X-Profile')
+
+    response = client.get('/calls/', BILL_PARAMS, HTTP_X_PROFILE='true',
+                          HTTP_X_FORWARDED_FOR='198.51.100.1, 203.0.113.7')
+    assert response.has_header('X-Profile')
+
+    # Without proxies, the address of the connection is used
+    settings.PROFILING_TRUSTED_PROXIES = 0
+    response = client.get('/calls/', BILL_PARAMS, HTTP_X_PROFILE='true',
+                          HTTP_X_FORWARDED_FOR='203.0.113.7')
+    assert not response.has_header('X-Profile')
+
+
+@pytest.mark.django_db
+@pytest.mark.freeze_time('2011-12-13')
+def test_profile_streamed_bill(profiling_dir, settings, create_calls):
+    """Test streamed bills are profiled until the response is closed."""
+    settings.PROFILING_ALLOWED_IPS = ['127.0.0.1']
+    settings.BILL_STREAM_CHUNK_SIZE = 2
+    create_calls(5)
+
+    response = APIClient().get(
+        '/calls/', dict(BILL_PARAMS, stream='true'), HTTP_X_PROFILE='true')
+    assert os.listdir(profiling_dir) == []
+
+    b''.join(response.streaming_content)
+    name = response['X-Profile']
+    assert 'stream_bill' in function_names(profiling_dir / (name + '.prof'))
+    assert 'FROM "core_calldetail"' in (
+        profiling_dir / (name + '.sql')).read_text()
@@ -0,0 +1,143 @@
+from datetime import datetime, timedelta
+from datetime import timezone as utc_timezone
+
+import pytest
+from django.core.management import call_command
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from core import ingest
+from core.models import CallDetail, QueuedCallRecord
+from core.queue import enqueue_records, process_queue, queue_lag
+
+
+@pytest.fixture
+def queue_settings(settings):
+    settings.INGEST_QUEUE = True
+    return settings
+
+
+@pytest.mark.django_db
+def test_post_call_queued(queue_settings):
+    """Test records are queued and saved later by the worker."""
+    client = APIClient()
+
+    call_data = {
+        "call_id": 11,
+        "type": "start",
+        "timestamp": "2016-02-29T05:00:00Z",
+        "source": "11987654321",
+        "destination": "11123456789"
+    }
+    response = client.post('/calls/', call_data, format='json')
+    assert response.status_code == 202
+
+    call_data = {
+        "call_id": 11,
+        "type": "end",
+        "timestamp": "2016-02-29T05:40:00Z",
+    }
+    response = client.post('/calls/', call_data, format='json')
+    assert response.status_code == 202
+
+    # Invalid records are still refused by the request
+    del call_data["timestamp"]
+    response = client.post('/calls/', call_data, format='json')
+    assert response.status_code == 400
+    assert response.json() == {'timestamp': 'This field is required.'}
+
+    assert CallDetail.objects.count() == 0
+    assert QueuedCallRecord.objects.count() == 2
+
+    call_command('process_queue', once=True, batch_size=1)
+
+    assert QueuedCallRecord.objects.count() == 0
+    call = CallDetail.objects.get(call_id=11)
+    assert call.duration == 2400
+    assert call.price == 36
+    assert call.is_completed == True
+
+
+@pytest.mark.django_db
+def test_post_calls_batch_queued(queue_settings):
+    """Test batch records are queued, invalid records dropped by the worker."""
+    client = APIClient()
+
+    records = [{
+        "call_id": 11,
+        "type": "start",
+        "timestamp": "2016-02-29T12:00:00Z",
+        "source": "11987654321",
+        "destination": "11123456789"
+    }, {
+        "call_id": 11,
+        "type": "end",
+        "timestamp": "2016-02-29T11:00:00Z"
+    }, {
+        "type": "end",
+        "timestamp": "2016-02-29T12:00:00Z"
+    }]
+
+    response = client.post('/calls/batch/', records, format='json')
+    assert response.status_code == 202
+    assert response.json() == {
+        'queued': 2,
+        'errors': [{
+            'index': 2,
+            'errors': {'call_id': 'This field is required.'}
+        }]
+    }
+
+    call_command('process_queue', once=True)
+
+    assert QueuedCallRecord.objects.count() == 0
+    call = CallDetail.objects.get(call_id=11)
+    assert call.ended_at == None
+    assert call.is_completed == False
+
+
+@pytest.mark.django_db
+def test_queue_lag():
+    """Test queue lag measures depth and age of the oldest record."""
+    assert queue_lag() == (0, 0.0)
+
+    QueuedCallRecord.objects.create(record='{}')
+    QueuedCallRecord.objects.create(record='{}')
+    QueuedCallRecord.objects.update(
+        created_at=timezone.now() - timedelta(seconds=30))
+
+    depth, age = queue_lag()
+    assert depth == 2
+    assert 30 <= age < 60
+
+
+@pytest.mark.django_db
+def test_process_queue_concurrent_call(monkeypatch):
+    """Test a call created by another worker meanwhile is merged, not lost."""
+    # The Start Record is saved by another worker, not yet committed when
+    # the calls of this batch are fetched: the insert fails on the unique
+    # call_id
+    CallDetail.objects.create(
+        call_id=11, source="11987654321", destination="11123456789",
+        started_at=datetime(2016, 2, 29, 5, 0, tzinfo=utc_timezone.utc))
+    fetch_calls = ingest.fetch_calls
+    fetched = []
+
+    def racing_fetch_calls(call_ids):
+        if not fetched:
+            fetched.append(True)
+            return {}
+        return fetch_calls(call_ids)
+
+    monkeypatch.setattr(ingest, 'fetch_calls', racing_fetch_calls)
+    enqueue_records([{
+        "call_id": 11,
+        "type": "end",
+        "timestamp": "2016-02-29T05:40:00Z",
+    }])
+
+    assert process_queue(10) == 1
+    assert QueuedCallRecord.objects.count() == 0
+    call = CallDetail.objects.get(call_id=11)
+    assert call.is_completed == True
+    assert call.price == 36
@@ -0,0 +1,123 @@
+from datetime import datetime, timezone
+
+import pytest
+from django.core.management import call_command
+from rest_framework.test import APIClient
+
+from core.models import CallDetail, MonthlyRollup
+
+
+def rollups():
+    """Return all rollups as tuples, ordered by subscriber and period."""
+    return list(MonthlyRollup.objects.order_by(
+        'source', 'reference_period'
+    ).values_list(
+        'source', 'reference_period', 'call_count', 'total_duration',
+        'total_price'))
+
+
+def start_record(call_id, source, timestamp):
+    return {
+        "call_id": call_id,
+        "type": "start",
+        "timestamp": timestamp,
+        "source": source,
+        "destination": "3312345678"
+    }
+
+
+def end_record(call_id, timestamp):
+    return {
+        "call_id": call_id,
+        "type": "end",
+        "timestamp": timestamp
+    }
+
+
+@pytest.mark.django_db
+def test_rollups_updated_by_post():
+    """Test rollups are updated when calls are completed."""
+    client = APIClient()
+
+    client.post('/calls/', start_record(
+        1, "2212345678", "2019-09-30T08:30:15Z"), format='json')
+    assert rollups() == []
+
+    client.post('/calls/', end_record(
+        1, "2019-09-30T08:40:00Z"), format='json')
+    assert rollups() == [("2212345678", "09/2019", 1, 585, 117)]
+
+    client.post('/calls/', end_record(
+        2, "2019-09-30T08:50:00Z"), format='json')
+    client.post('/calls/', start_record(
+        2, "2212345678", "2019-09-30T08:30:00Z"), format='json')
+    assert rollups() == [("2212345678", "09/2019", 2, 1785, 333)]
+
+    # A repeated End Record moving the call to another period
+    client.post('/calls/', end_record(
+        2, "2019-10-01T08:30:00Z"), format='json')
+    assert rollups() == [
+        ("2212345678", "09/2019", 1, 585, 117),
+        ("2212345678", "10/2019", 1, 86400, 8676),
+    ]
+
+
+@pytest.mark.django_db
+def test_rollups_updated_by_batch():
+    """Test rollups are updated by batch saving."""
+    client = APIClient()
+
+    CallDetail.objects.create(
+        call_id=1, source="2212345678", destination="3312345678",
+        started_at=datetime(2019, 9, 30, 8, 30, 15, tzinfo=timezone.utc))
+
+    records = [
+        end_record(1, "2019-09-30T08:40:00Z"),
+        start_record(2, "2212345678", "2019-09-30T08:30:15Z"),
+        end_record(2, "2019-09-30T08:40:00Z"),
+        start_record(3, "4412345678", "2019-09-30T08:30:15Z"),
+        end_record(3, "2019-09-30T08:40:00Z"),
+        start_record(4, "4412345678", "2019-09-30T08:30:15Z"),
+    ]
+    response = client.post('/calls/batch/', records, format='json')
+    assert response.status_code == 200
+
+    assert rollups() == [
+        ("2212345678", "09/2019", 2, 1170, 234),
+        ("4412345678", "09/2019", 1, 585, 117),
+    ]
+
+
+@pytest.mark.django_db
+def test_rebuild_rollups_command():
+    """Test rebuild_rollups command rebuilds rollups from the calls."""
+
+    for call_id, source, period in [
+            (1, "2212345678", "09/2019"),
+            (2, "2212345678", "09/2019"),
+            (3, "2212345678", "10/2019"),
+            (4, "4412345678", "10/2019")]:
+        CallDetail.objects.create(
+            call_id=call_id, source=source, destination="3312345678",
+            duration=60, price=45, reference_period=period,
+            started_at=datetime(2019, 9, 30, 8, 30, 0, tzinfo=timezone.utc),
+            ended_at=datetime(2019, 9, 30, 8, 31, 0, tzinfo=timezone.utc),
+            is_completed=True)
+    CallDetail.objects.create(
+        call_id=5, source="2212345678", destination="3312345678",
+        started_at=datetime(2019, 9, 30, 8, 30, 0, tzinfo=timezone.utc))
+    MonthlyRollup.objects.create(
+        source="5512345678", reference_period="10/2019", call_count=1)
+
+    call_command('rebuild_rollups', period='09/2019')
+    assert rollups() == [
+        ("2212345678", "09/2019", 2, 120, 90),
+        ("5512345678", "10/2019", 1, 0, 0),
+    ]
+
+    call_command('rebuild_rollups')
+    assert rollups() == [
+        ("2212345678", "09/2019", 2, 120, 90),
+        ("2212345678", "10/2019", 1, 60, 45),
+        ("4412345678", "10/2019", 1, 60, 45),
+    ]
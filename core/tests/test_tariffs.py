@@ -0,0 +1,178 @@
+from datetime import datetime, time, timezone
+
+import pytest
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.db import IntegrityError, transaction
+from rest_framework.test import APIClient
+
+from core.models import CallDetail, Tariff
+from core.pricing import get_prices_by_tariff, to_epoch_seconds
+from core.tariffs import clear_tariff_lookup, get_tariff_lookup
+from core.utils import DEFAULT_TARIFF
+
+
+@pytest.fixture(autouse=True)
+def tariff_lookup():
+    """Discard lookups built with tariffs of rolled back transactions."""
+    clear_tariff_lookup()
+    yield
+    clear_tariff_lookup()
+
+
+def create_tariffs():
+    """Create a tariff for October 2011 and an open ended one after it."""
+    Tariff.objects.create(
+        effective_from=datetime(2011, 11, 1, tzinfo=timezone.utc),
+        standing_charge=50, standard_minute_charge=10,
+        standard_start=time(6, 0), standard_end=time(22, 0))
+    Tariff.objects.create(
+        effective_from=datetime(2011, 10, 1, tzinfo=timezone.utc),
+        effective_to=datetime(2011, 11, 1, tzinfo=timezone.utc),
+        standing_charge=40, standard_minute_charge=9,
+        reduced_minute_charge=1,
+        standard_start=time(8, 0), standard_end=time(20, 0))
+
+
+@pytest.mark.django_db
+def test_tariff_lookup():
+    """Test the effective tariff is found for each moment."""
+    assert get_tariff_lookup().get(
+        datetime(2011, 10, 13, tzinfo=timezone.utc)) == DEFAULT_TARIFF
+
+    # Saving tariffs refreshes the lookup
+    create_tariffs()
+    lookup = get_tariff_lookup()
+
+    moments = [
+        datetime(2011, 9, 30, 23, 59, 59, tzinfo=timezone.utc),
+        datetime(2011, 10, 1, tzinfo=timezone.utc),
+        datetime(2011, 10, 31, 23, 59, 59, tzinfo=timezone.utc),
+        datetime(2011, 11, 1, tzinfo=timezone.utc),
+        datetime(2030, 1, 1, tzinfo=timezone.utc),
+    ]
+    charges = [
+        lookup.get(moment).standing_charge for moment in moments]
+    assert charges == [36, 40, 40, 50, 50]
+
+    indexes = lookup.indexes(to_epoch_seconds(moments))
+    assert [lookup.table(index).standing_charge
+            for index in indexes] == charges
+
+    assert lookup.get(moments[1]).standard_start == 8 * 60 * 60
+
+    # Deleting tariffs refreshes the lookup
+    Tariff.objects.filter(effective_to=None).delete()
+    assert get_tariff_lookup().get(moments[-1]) == DEFAULT_TARIFF
+
+
+@pytest.mark.django_db
+def test_get_prices_by_tariff():
+    """Test each call is priced by the tariff effective when it ended."""
+    create_tariffs()
+
+    starts = [
+        datetime(2011, 9, 30, 21, 0, 0, tzinfo=timezone.utc),
+        datetime(2011, 10, 31, 19, 0, 0, tzinfo=timezone.utc),
+        datetime(2011, 10, 31, 23, 50, 0, tzinfo=timezone.utc),
+    ]
+    ends = [
+        datetime(2011, 9, 30, 21, 10, 0, tzinfo=timezone.utc),
+        datetime(2011, 10, 31, 21, 0, 0, tzinfo=timezone.utc),
+        datetime(2011, 11, 1, 6, 10, 0, tzinfo=timezone.utc),
+    ]
+
+    prices = get_prices_by_tariff(
+        to_epoch_seconds(starts), to_epoch_seconds(ends), get_tariff_lookup())
+    # Default: 10 * 9 + 36
+    # October: 60 * 9 + 60 * 1 + 40
+    # November: 10 * 10 + 50
+    assert prices.tolist() == [126, 640, 150]
+
+
+@pytest.mark.django_db
+def test_post_call_priced_by_tariff():
+    """Test POST calls and repricing use the effective tariff."""
+    client = APIClient()
+    create_tariffs()
+
+    call_data = {
+        "call_id": 11,
+        "type": "start",
+        "timestamp": "2011-10-31T19:00:00Z",
+        "source": "11987654321",
+        "destination": "11123456789"
+    }
+    response = client.post('/calls/', call_data, format='json')
+    assert response.status_code == 204
+
+    call_data = {
+        "call_id": 11,
+        "type": "end",
+        "timestamp": "2011-10-31T21:00:00Z"
+    }
+    response = client.post('/calls/', call_data, format='json')
+    assert response.status_code == 204
+    assert CallDetail.objects.get(call_id=11).price == 640
+
+    Tariff.objects.filter(effective_to__isnull=False).update(
+        standing_charge=30)
+    clear_tariff_lookup()
+    call_command('reprice_calls', '10/2011')
+    assert CallDetail.objects.get(call_id=11).price == 630
+
+
+@pytest.mark.django_db
+def test_tariff_validation():
+    """Test tariffs can't overlap nor have empty intervals."""
+    create_tariffs()
+
+    def tariff(**fields):
+        values = dict(
+            effective_from=datetime(2011, 9, 1, tzinfo=timezone.utc),
+            effective_to=datetime(2011, 10, 1, tzinfo=timezone.utc),
+            standing_charge=40, standard_minute_charge=9,
+            standard_start=time(8, 0), standard_end=time(20, 0))
+        values.update(fields)
+        return Tariff(**values)
+
+    tariff().full_clean()
+
+    with pytest.raises(ValidationError, match='overlaps'):
+        tariff(effective_to=datetime(2011, 10, 2, tzinfo=timezone.utc)
+               ).full_clean()
+    with pytest.raises(ValidationError, match='overlaps'):
+        tariff(effective_from=datetime(2012, 1, 1, tzinfo=timezone.utc),
+               effective_to=None).full_clean()
+    with pytest.raises(ValidationError, match='effective_to'):
+        tariff(effective_to=datetime(2011, 9, 1, tzinfo=timezone.utc)
+               ).full_clean()
+    with pytest.raises(ValidationError, match='standard_end'):
+        tariff(standard_end=time(8, 0)).full_clean()
+
+    # Saved tariffs are validated against themselves
+    Tariff.objects.get(effective_to__isnull=True).full_clean()
+
+    with pytest.raises(IntegrityError):
+        with transaction.atomic():
+            tariff(standard_end=time(7, 0)).save()
+
+
+@pytest.mark.django_db
+def test_tariff_admin_validation(admin_client, settings):
+    """Test tariffs added in the admin are validated."""
+    # Static files are collected in deploys only
+    settings.STATICFILES_STORAGE = (
+        'django.contrib.staticfiles.storage.StaticFilesStorage')
+    create_tariffs()
+
+    response = admin_client.post('/admin/core/tariff/add/', {
+        'effective_from_0': '2011-09-01', 'effective_from_1': '00:00:00',
+        'effective_to_0': '2011-10-02', 'effective_to_1': '00:00:00',
+        'standing_charge': 40, 'standard_minute_charge': 9,
+        'reduced_minute_charge': 0,
+        'standard_start': '08:00:00', 'standard_end': '20:00:00',
+    })
+    assert response.status_code == 200
+    assert 'overlaps' in response.content.decode()
+    assert Tariff.objects.count() == 2
@@ -1,5 +1,10 @@
 from datetime import datetime, timezone
-from core.utils import format_duration, get_price
+
+import pytest
+
+from core.utils import (
+    TariffTable, format_duration, format_period, get_price, is_closed_period,
+    parse_period)
 
 
 def test_get_price_same_day_call():
@@ -73,6 +78,55 @@ def test_get_price_with_reduced_tariff():
     assert get_price(start_date, end_date) == 1116
 
 
+def test_get_price_many_days():
+    """Test get_price for calls crossing months or lasting many days"""
+
+    # Call crossing months, from Standard t. to the next day Standard t.
+    start_date = datetime(2011, 10, 31, 21, 0, 0, tzinfo=timezone.utc)
+    end_date = datetime(2011, 11, 1, 7, 0, 0, tzinfo=timezone.utc)
+    # 120 minutes * R$ 0,09 + 0,36
+    assert get_price(start_date, end_date) == 1116
+
+    # Call crossing years, from Reduced t. to the next day Standard t.
+    start_date = datetime(2011, 12, 31, 23, 0, 0, tzinfo=timezone.utc)
+    end_date = datetime(2012, 1, 1, 6, 10, 0, tzinfo=timezone.utc)
+    # 10 minutes * R$ 0,09 + 0,36
+    assert get_price(start_date, end_date) == 126
+
+    # Call starting in Reduced t. by morning and ending in the next day
+    start_date = datetime(2011, 12, 13, 5, 0, 0, tzinfo=timezone.utc)
+    end_date = datetime(2011, 12, 14, 4, 0, 0, tzinfo=timezone.utc)
+    # 960 minutes * R$ 0,09 + 0,36
+    assert get_price(start_date, end_date) == 8676
+
+    # Call lasting three days
+    start_date = datetime(2011, 12, 13, 5, 0, 0, tzinfo=timezone.utc)
+    end_date = datetime(2011, 12, 15, 7, 30, 59, tzinfo=timezone.utc)
+    # (960 + 960 + 90) minutes * R$ 0,09 + 0,36
+    assert get_price(start_date, end_date) == 18126
+
+
+def test_get_price_tariff_table():
+    """Test get_price with a tariff table other than the default"""
+
+    tariff = TariffTable(
+        standing_charge=50,
+        standard_minute_charge=10,
+        reduced_minute_charge=2,
+        standard_start=8 * 60 * 60,
+        standard_end=20 * 60 * 60)
+
+    start_date = datetime(2011, 12, 13, 19, 0, 0, tzinfo=timezone.utc)
+    end_date = datetime(2011, 12, 13, 21, 30, 30, tzinfo=timezone.utc)
+    # 60 minutes * R$ 0,10 + 90 minutes * R$ 0,02 + R$ 0,50
+    assert get_price(start_date, end_date, tariff) == 830
+
+    start_date = datetime(2011, 12, 13, 19, 59, 30, tzinfo=timezone.utc)
+    end_date = datetime(2011, 12, 14, 8, 0, 30, tzinfo=timezone.utc)
+    # 0 minutes * R$ 0,10 + 721 minutes * R$ 0,02 + R$ 0,50
+    assert get_price(start_date, end_date, tariff) == 1492
+
+
 def test_format_duration():
     """Test format_duration function for various duration"""
 
@@ -82,3 +136,21 @@ def test_format_duration():
     assert format_duration(85) == "0h1m25s"
     assert format_duration(600) == "0h10m0s"
     assert format_duration(9200) == "2h33m20s"
+
+
+@pytest.mark.freeze_time('2011-12-13')
+def test_is_closed_period():
+    """Test is_closed_period function for past, current and future periods"""
+
+    assert is_closed_period("11/2011") == True
+    assert is_closed_period("12/2010") == True
+    assert is_closed_period("12/2011") == False
+    assert is_closed_period("01/2012") == False
+
+
+def test_parse_and_format_period():
+    """Test periods are converted to integers YYYYMM and back"""
+
+    assert parse_period("02/2016") == 201602
+    assert parse_period("12/2015") < parse_period("01/2016")
+    assert format_period(201602) == "02/2016"
@@ -0,0 +1,118 @@
+from datetime import datetime, timezone
+
+import pytest
+from rest_framework.test import APIClient
+
+from core.validators import parse_timestamp, validate_call_record
+
+
+def test_parse_timestamp():
+    """Test parse_timestamp parses only the fixed width format"""
+
+    assert parse_timestamp("2016-02-29T12:00:59Z") == datetime(
+        2016, 2, 29, 12, 0, 59, tzinfo=timezone.utc)
+
+    for timestamp in [
+            "2016-02-29 12:00:00Z",
+            "2016-02-29T12:00:00",
+            "2016-2-29T12:00:00Z",
+            "2016-02-29T12:00:00+00:00",
+            "2016-02-30T12:00:00Z",
+            "2016-02-29T24:00:00Z",
+            "2016-02-29T12:0a:00Z",
+            "2016-02-29T12:-1:00Z",
+            "２016-02-29T12:00:00Z",
+            ""]:
+        with pytest.raises(ValueError):
+            parse_timestamp(timestamp)
+
+
+def test_validate_call_record():
+    """Test validate_call_record returns the validated data of records"""
+
+    validated_data, errors = validate_call_record({
+        "call_id": 11,
+        "type": "start",
+        "timestamp": "2016-02-29T12:00:00Z",
+        "source": "11987654321",
+        "destination": "1123456789"
+    })
+    assert errors == {}
+    assert validated_data == {
+        'call_id': 11,
+        'source': '11987654321',
+        'destination': '1123456789',
+        'started_at': datetime(2016, 2, 29, 12, 0, 0, tzinfo=timezone.utc)
+    }
+
+    validated_data, errors = validate_call_record({
+        "call_id": 11,
+        "type": "end",
+        "timestamp": "2016-02-29T12:00:00Z",
+        "source": "not validated"
+    })
+    assert errors == {}
+    assert validated_data == {
+        'call_id': 11,
+        'ended_at': datetime(2016, 2, 29, 12, 0, 0, tzinfo=timezone.utc),
+        'reference_period': '02/2016'
+    }
+
+
+def test_validate_call_record_all_errors():
+    """Test validate_call_record reports the errors of all fields at once"""
+
+    validated_data, errors = validate_call_record({
+        "call_id": "11",
+        "type": "start",
+        "timestamp": "2016-02-29",
+        "source": "1198765432a",
+    })
+    assert validated_data is None
+    assert errors == {
+        'call_id': 'call_id must be an integer.',
+        'timestamp': 'timestamp must be in the format: "YYYY-MM-DDThh:mm:ssZ"',
+        'source': 'source must be a string of 10 or 11 digits.',
+        'destination': 'This field is required if call type is start.'
+    }
+
+    _, errors = validate_call_record({"type": "middle", "timestamp": 10})
+    assert errors == {
+        'call_id': 'This field is required.',
+        'type': 'type must be a string with value "start" or "end".',
+        'timestamp': 'timestamp must be a string.'
+    }
+
+
+@pytest.mark.django_db
+def test_post_call_detail_all_errors():
+    """Test POST call reports the errors of all fields at once."""
+    client = APIClient()
+
+    call_data = {
+        "type": "start",
+        "timestamp": "2016-02-29T12:00:00Z",
+        "source": 11987654321,
+        "destination": "111234567"
+    }
+
+    response = client.post('/calls/', call_data, format='json')
+    assert response.status_code == 400
+    assert response.json() == {
+        'call_id': 'This field is required.',
+        'source': 'source must be a string.',
+        'destination': 'destination must be a string of 10 or 11 digits.'
+    }
+
+
+def test_validate_call_record_leading_zero():
+    """Test phone numbers starting with 0 are invalid"""
+
+    _, errors = validate_call_record({
+        "call_id": 11,
+        "type": "start",
+        "timestamp": "2016-02-29T12:00:00Z",
+        "source": "01987654321",
+        "destination": "1123456789"
+    })
+    assert errors == {'source': 'source must not start with 0.'}
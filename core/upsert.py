@@ -0,0 +1,230 @@
+import re
+import sqlite3
+
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework import serializers
+
+from core.metrics import timer
+from core.models import CallDetail, MonthlyBill, MonthlyRollup
+from core.partitions import is_partitioned
+from core.serializers import complete_call
+from core.tariffs import get_tariff_lookup
+from core.utils import SECONDS_PER_DAY, standard_seconds
+
+# Each statement fills a half of the call, creating the CallDetail if it does
+# not exist. Halves already filled are left untouched, returning no row.
+UPSERT_START_SQL = """
+    INSERT INTO {table} (call_id, source, destination, started_at,
+                         is_completed)
+    VALUES (%s, %s, %s, %s, %s)
+    ON CONFLICT (call_id) DO UPDATE SET
+        source = excluded.source,
+        destination = excluded.destination,
+        started_at = excluded.started_at
+    WHERE {table}.started_at IS NULL
+    RETURNING id, source, destination, started_at, ended_at, reference_period
+"""
+
+# Completes the call when its start was saved: duration and price are found
+# from the start in the row and the end and tariff of the record
+UPSERT_END_SQL = """
+    INSERT INTO {table} (call_id, ended_at, reference_period, is_completed)
+    VALUES (%(call_id)s, %(ended_at)s, %(reference_period)s, %(is_completed)s)
+    ON CONFLICT (call_id) DO UPDATE SET
+        ended_at = excluded.ended_at,
+        reference_period = excluded.reference_period,
+        is_completed = {table}.started_at IS NOT NULL,
+        duration = %(end)s - {start},
+        price = %(standing_charge)s +
+            {standard_minutes} * %(standard_minute_extra)s +
+            (%(end)s - {start}) / 60 * %(reduced_minute_charge)s
+    WHERE {table}.ended_at IS NULL
+    RETURNING id, source, destination, started_at, ended_at, reference_period,
+              duration, price
+"""
+
+# Standard time minutes of the call as in get_price, start epochs are
+# positive so integer division truncates as floor division
+STANDARD_MINUTES_SQL = """
+    CASE WHEN {start} / 86400 = %(end_day)s
+    THEN (%(end_standard)s - {start_standard}) / 60
+    ELSE %(window_minutes)s - ({start_standard} + 59) / 60 +
+         %(end_standard)s / 60 +
+         (%(end_day)s - {start} / 86400 - 1) * %(window_minutes)s
+    END
+"""
+
+# Standard time seconds from the beginning of the day until the start
+START_STANDARD_SQL = """
+    CASE WHEN {start} - {start} / 86400 * 86400 < %(standard_start)s THEN 0
+         WHEN {start} - {start} / 86400 * 86400 > %(standard_end)s
+         THEN %(standard_end)s - %(standard_start)s
+         ELSE {start} - {start} / 86400 * 86400 - %(standard_start)s
+    END
+"""
+
+# UTC epoch seconds of the start saved in the row
+START_EPOCH_SQL = {
+    'postgresql': 'CAST(EXTRACT(EPOCH FROM {table}.started_at) AS BIGINT)',
+    'sqlite': "CAST(strftime('%%s', {table}.started_at) AS INTEGER)",
+}
+
+PLACEHOLDER_RE = re.compile(r'%\((\w+)\)s')
+
+
+def supports_upsert():
+    """Tell if the database supports INSERT ... ON CONFLICT ... RETURNING."""
+    if connection.vendor == 'postgresql':
+        # Partitioned calls have no unique call_id index to conflict on
+        return not is_partitioned()
+    if connection.vendor == 'sqlite':
+        return sqlite3.sqlite_version_info >= (3, 35, 0)
+    return False
+
+
+def to_datetime(value):
+    """Convert a datetime read by a raw query into an aware datetime."""
+    # SQLite returns datetimes as text
+    if isinstance(value, str):
+        value = parse_datetime(value)
+    if value is not None and timezone.is_naive(value):
+        value = timezone.make_aware(value, timezone.utc)
+    return value
+
+
+def to_db(field, value):
+    """Prepare a value of a CallDetail field to be sent in a raw query."""
+    return CallDetail._meta.get_field(field).get_db_prep_save(
+        value, connection)
+
+
+def from_db(field, value):
+    """Convert a value of a CallDetail field read by a raw query."""
+    return CallDetail._meta.get_field(field).from_db_value(
+        value, None, connection)
+
+
+def end_sql(table):
+    """Return UPSERT_END_SQL for the database in use."""
+    start = START_EPOCH_SQL[connection.vendor].format(table=table)
+    start_standard = START_STANDARD_SQL.format(start=start)
+    standard_minutes = STANDARD_MINUTES_SQL.format(
+        start=start, start_standard=start_standard)
+    return UPSERT_END_SQL.format(
+        table=table, start=start, standard_minutes=standard_minutes)
+
+
+def end_params(validated_data):
+    """Return the params of UPSERT_END_SQL for an End record."""
+    ended_at = validated_data['ended_at']
+    with timer('get_price'):
+        tariff = get_tariff_lookup().get(ended_at)
+
+    return {
+        'call_id': validated_data['call_id'],
+        'ended_at': to_db('ended_at', ended_at),
+        'reference_period': to_db(
+            'reference_period', validated_data['reference_period']),
+        'is_completed': False,
+        'end': int(ended_at.timestamp()),
+        'end_day': int(ended_at.timestamp()) // SECONDS_PER_DAY,
+        'end_standard': standard_seconds(ended_at, tariff),
+        'window_minutes': (tariff.standard_end - tariff.standard_start) // 60,
+        'standard_start': tariff.standard_start,
+        'standard_end': tariff.standard_end,
+        'standing_charge': tariff.standing_charge,
+        # Reduced charges are added to every minute, standard minutes are
+        # charged the difference
+        'standard_minute_extra': (
+            tariff.standard_minute_charge - tariff.reduced_minute_charge),
+        'reduced_minute_charge': tariff.reduced_minute_charge,
+    }
+
+
+def positional(sql, params):
+    """
+    Replace the %(name)s placeholders of a query by %s, as the SQLite backend
+    only takes positional params, returning the params in their order.
+    """
+    return (PLACEHOLDER_RE.sub('%s', sql),
+            [params[name] for name in PLACEHOLDER_RE.findall(sql)])
+
+
+def upsert_record(call_type, validated_data):
+    """
+    Save a Start or End Call Record in a single INSERT ... ON CONFLICT.
+
+    Concurrent records of the same call are merged by the database into a
+    single CallDetail. An End record completing the call saves its duration
+    and price in the same statement, a Start record arriving after the End
+    one, whose tariff is only known from the saved end, in a second one.
+
+    Returns the CallDetail, or None if the database does not support upserts
+    or the half of the record was already saved, when the record must be
+    saved by CallDetailSerializer. Raises ValidationError if the start is
+    after the end of the call.
+    """
+    if not supports_upsert():
+        return None
+
+    table = CallDetail._meta.db_table
+
+    if call_type == "start":
+        sql = UPSERT_START_SQL.format(table=table)
+        params = [
+            validated_data['call_id'],
+            to_db('source', validated_data['source']),
+            to_db('destination', validated_data['destination']),
+            to_db('started_at', validated_data['started_at']),
+            False,
+        ]
+    else:
+        sql, params = positional(end_sql(table), end_params(validated_data))
+
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            row = cursor.fetchone()
+
+        if row is None:
+            return None
+
+        pk, source, destination, started_at, ended_at, period = row[:6]
+        call = CallDetail(
+            pk=pk, call_id=validated_data['call_id'],
+            source=from_db('source', source),
+            destination=from_db('destination', destination),
+            started_at=to_datetime(started_at),
+            ended_at=to_datetime(ended_at),
+            reference_period=from_db('reference_period', period))
+
+        if not (call.started_at and call.ended_at):
+            return call
+
+        if call.started_at > call.ended_at:
+            # Rolls back the upsert
+            if call_type == "start":
+                raise serializers.ValidationError({
+                    'timestamp': ('Start Record Call timestamp cannot be '
+                                  'after End Record Call timestamp.')
+                })
+            raise serializers.ValidationError({
+                'timestamp': ('End Record Call timestamp cannot be '
+                              'before Start Record Call timestamp.')
+            })
+
+        if call_type == "start":
+            complete_call(call)
+            CallDetail.objects.filter(pk=pk).update(
+                is_completed=True, duration=call.duration, price=call.price)
+        else:
+            call.is_completed = True
+            call.duration, call.price = row[6:]
+
+        changes = [(None, call.totals())]
+        MonthlyRollup.objects.apply_changes(changes)
+        MonthlyBill.objects.invalidate(changes)
+
+    return call
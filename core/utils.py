@@ -1,3 +1,46 @@
+from collections import namedtuple
+from datetime import date, datetime
+
+SECONDS_PER_DAY = 24 * 60 * 60
+
+# Charges of a tariff are in cents and the standard time window boundaries in
+# seconds of the day, the rest of the day is reduced tariff time
+TariffTable = namedtuple('TariffTable', [
+    'standing_charge',
+    'standard_minute_charge',
+    'reduced_minute_charge',
+    'standard_start',
+    'standard_end',
+])
+
+DEFAULT_TARIFF = TariffTable(
+    standing_charge=36,
+    standard_minute_charge=9,
+    reduced_minute_charge=0,
+    standard_start=6 * 60 * 60,
+    standard_end=22 * 60 * 60,
+)
+
+
+def is_closed_period(period):
+    """Tell if a period in MM/YYYY format is a closed (previous) month"""
+    current_month = date.today().replace(day=1)
+    period_date = datetime.strptime(period, "%m/%Y").date()
+
+    return period_date < current_month
+
+
+def parse_period(period):
+    """Convert a period in MM/YYYY format into an integer YYYYMM"""
+    month, year = period.split('/')
+    return int(year) * 100 + int(month)
+
+
+def format_period(value):
+    """Format an integer YYYYMM period in MM/YYYY format"""
+    return '{:02d}/{:04d}'.format(value % 100, value // 100)
+
+
 def format_duration(duration_in_seconds):
     """Format the duration in human readable way"""
     hours = duration_in_seconds // 3600
@@ -7,14 +50,27 @@ def format_duration(duration_in_seconds):
     return "{}h{}m{}s".format(hours, minutes, seconds)
 
 
-def get_price(start_date, end_date):
+def format_price(price_in_cents):
+    """Format the price in BRL currency"""
+    return 'R$ {:.2f}'.format(price_in_cents / 100).replace('.', ',')
+
+
+def standard_seconds(call_date, tariff):
+    """Seconds of standard time from the beginning of the day until date"""
+    time = call_date.hour * 3600 + call_date.minute * 60 + call_date.second
+    time = min(max(time, tariff.standard_start), tariff.standard_end)
+
+    return time - tariff.standard_start
+
+
+def get_price(start_date, end_date, tariff=DEFAULT_TARIFF):
     """
     Calculate price of a call based on start and end times
 
     The call price depends on fixed charges, duration, time of the day.
     There is no fractioned charge, it applies to each completed 60 seconds.
 
-    There are two tariff times:
+    There are two tariff times, the default tariff table is:
 
     1. Standard time call - between 6h00 and 22h00 (excluding):
         - Standing charge: R$ 0,36
@@ -22,45 +78,29 @@ def get_price(start_date, end_date):
     2. Reduced tariff time call - between 22h00 and 6h00 (excluding):
         - Standing charge: R$ 0,36
         - Call charge/minute: R$ 0,00
-    """
-
-    # Calculations if the call started and ended in the same day
-    if start_date.day == end_date.day:
-        reduced_tariff = (
-            start_date.hour >= 22 and end_date.hour >= 22 or
-            start_date.hour < 6 and end_date.hour < 6)
-
-        if reduced_tariff:
-            # Charge only Standing charge
-            return 36
-
-        if start_date.hour < 6:
-            start_date = start_date.replace(hour=6, minute=0, second=0)
-        if end_date.hour >= 22:
-            end_date = end_date.replace(hour=22, minute=0, second=0)
-
-        billed_minutes = (end_date - start_date).seconds // 60
 
-        return billed_minutes * 9 + 36
-
-    # Calculations if the call ended in a following day
-    if end_date.day == start_date.day + 1:
-        if start_date.hour >= 22 and end_date.hour < 6:
-            # Charge only Standing charge
-            return 36
-
-        billed_minutes = 0
-
-        # Calculate minutes that should be billed in day 1
-        if start_date.hour >= 6 and start_date.hour < 22:
-            proxy_end_date = start_date.replace(hour=22, minute=0, second=0)
-            billed_minutes += (proxy_end_date - start_date).seconds // 60
-
-        # Calculate minutes that should be billed in day 2
-        if end_date.hour >= 6 and end_date.hour < 22:
-            proxy_start_date = start_date.replace(hour=6, minute=0, second=0)
-            billed_minutes += (end_date - proxy_start_date).seconds // 60
-
-        return billed_minutes * 9 + 36
-
-    return 36
+    Standard time minutes are the completed minutes of standard time in each
+    day the call went through, all other completed minutes of the call are
+    reduced tariff time minutes. Calls of any length take the same time to
+    calculate: the partial first and last days plus a full standard time
+    window for each day in between.
+    """
+    window_minutes = (tariff.standard_end - tariff.standard_start) // 60
+    start_standard = standard_seconds(start_date, tariff)
+    end_standard = standard_seconds(end_date, tariff)
+    days = end_date.toordinal() - start_date.toordinal()
+
+    if days == 0:
+        standard_minutes = (end_standard - start_standard) // 60
+    else:
+        standard_minutes = (
+            window_minutes - (start_standard + 59) // 60 +
+            end_standard // 60 +
+            (days - 1) * window_minutes)
+
+    total_minutes = int((end_date - start_date).total_seconds()) // 60
+    reduced_minutes = total_minutes - standard_minutes
+
+    return (tariff.standing_charge +
+            standard_minutes * tariff.standard_minute_charge +
+            reduced_minutes * tariff.reduced_minute_charge)
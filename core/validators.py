@@ -0,0 +1,128 @@
+from datetime import datetime, timezone
+import re
+
+# Phone numbers have 2 digits of area code plus 8 or 9 digits
+PHONE_NUMBER_RE = re.compile('[0-9]{10,11}')
+
+CALL_TYPES = ('start', 'end')
+
+TIMESTAMP_FORMAT_ERROR = (
+    'timestamp must be in the format: "YYYY-MM-DDThh:mm:ssZ"')
+
+
+def parse_timestamp(value):
+    """
+    Parse a timestamp in the fixed width format YYYY-MM-DDThh:mm:ssZ into an
+    UTC datetime, raising ValueError if it is not in the format.
+    """
+    if (len(value) != 20 or value[4] != '-' or value[7] != '-' or
+            value[10] != 'T' or value[13] != ':' or value[16] != ':' or
+            value[19] != 'Z'):
+        raise ValueError('Invalid timestamp: {}'.format(value))
+
+    digits = (value[0:4] + value[5:7] + value[8:10] + value[11:13] +
+              value[14:16] + value[17:19])
+    if not (digits.isascii() and digits.isdigit()):
+        raise ValueError('Invalid timestamp: {}'.format(value))
+
+    return datetime(
+        int(value[0:4]), int(value[5:7]), int(value[8:10]),
+        int(value[11:13]), int(value[14:16]), int(value[17:19]),
+        tzinfo=timezone.utc)
+
+
+def validate_phone_number(errors, data, field):
+    """Validate a phone number of a Start Call Record."""
+    value = data.get(field)
+
+    if not value:
+        errors[field] = 'This field is required if call type is start.'
+    elif not isinstance(value, str):
+        errors[field] = '{} must be a string.'.format(field)
+    elif not PHONE_NUMBER_RE.fullmatch(value):
+        errors[field] = '{} must be a string of 10 or 11 digits.'.format(
+            field)
+    elif value[0] == '0':
+        # Numbers are stored as integers, area codes never start with 0
+        errors[field] = '{} must not start with 0.'.format(field)
+
+    return value
+
+
+def validate_call_record(data):
+    """
+    Validate a Start or End Call Record on its own.
+
+    All fields are checked, returning the validated data and a dict with the
+    error of each invalid field, empty if the record is valid.
+    """
+    errors = {}
+
+    call_id = data.get('call_id')
+    if not call_id:
+        errors['call_id'] = 'This field is required.'
+    elif not isinstance(call_id, int):
+        errors['call_id'] = 'call_id must be an integer.'
+
+    call_type = data.get('type')
+    if not call_type:
+        errors['type'] = 'This field is required.'
+    elif call_type not in CALL_TYPES:
+        errors['type'] = 'type must be a string with value "start" or "end".'
+
+    timestamp = data.get('timestamp')
+    date = None
+    if not timestamp:
+        errors['timestamp'] = 'This field is required.'
+    elif not isinstance(timestamp, str):
+        errors['timestamp'] = 'timestamp must be a string.'
+    else:
+        try:
+            date = parse_timestamp(timestamp)
+        except ValueError:
+            errors['timestamp'] = TIMESTAMP_FORMAT_ERROR
+
+    if call_type == 'start':
+        source = validate_phone_number(errors, data, 'source')
+        destination = validate_phone_number(errors, data, 'destination')
+
+    if errors:
+        return None, errors
+
+    if call_type == 'start':
+        validated_data = {
+            'call_id': call_id,
+            'source': source,
+            'destination': destination,
+            'started_at': date,
+        }
+    else:
+        validated_data = {
+            'call_id': call_id,
+            'ended_at': date,
+            'reference_period': '{:02d}/{:04d}'.format(date.month, date.year),
+        }
+
+    return validated_data, errors
+
+
+def validate_call_order(call, call_type, validated_data):
+    """
+    Validate a record against the other record already saved in the call,
+    returning a dict with the errors, empty if the record is valid.
+    """
+    if call_type == 'start' and call.ended_at and (
+            validated_data['started_at'] > call.ended_at):
+        return {
+            'timestamp': ('Start Record Call timestamp cannot be '
+                          'after End Record Call timestamp.')
+        }
+
+    if call_type == 'end' and call.started_at and (
+            validated_data['ended_at'] < call.started_at):
+        return {
+            'timestamp': ('End Record Call timestamp cannot be '
+                          'before Start Record Call timestamp.')
+        }
+
+    return {}
@@ -1,9 +1,31 @@
+import functools
+import hmac
+import json
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.http import Http404, HttpResponse, StreamingHttpResponse
 from rest_framework import status
-from rest_framework.decorators import api_view
+from rest_framework.decorators import api_view, parser_classes
+from rest_framework.exceptions import ValidationError
+from rest_framework.parsers import JSONParser
 from rest_framework.response import Response
 
-from core.models import CallDetail
-from core.serializers import CallDetailSerializer, MonthlyBillSerializer
+from core.archive import archive_file, bill_calls
+from core.export import EXPORT_CONTENT_TYPES, export_calls
+from core.ingest import ingest_records, validate_records
+from core.metrics import format_gauge, render_metrics, timer
+from core.models import CallDetail, MonthlyBill
+from core.pagination import paginate_bill
+from core.parsers import NDJSONParser
+from core.partitions import lock_calls
+from core.queue import enqueue_records, queue_lag
+from core.serializers import (
+    BillExportSerializer, BillSummarySerializer, CallDetailSerializer,
+    MonthlyBillSerializer, render_call_records)
+from core.streaming import stream_bill
+from core.upsert import upsert_record
+from core.validators import validate_call_order, validate_call_record
 
 
 @api_view(['GET', 'POST'])
@@ -14,37 +36,222 @@ def calls(request):
     if request.method == 'GET':
         serializer = MonthlyBillSerializer(data=request.query_params)
 
-        if not serializer.is_valid():
+        with timer('validation'):
+            is_valid = serializer.is_valid()
+        if not is_valid:
             return Response(serializer.errors,
                             status=status.HTTP_400_BAD_REQUEST)
 
         number = serializer.data['number']
         period = serializer.data['period']
-        calls = CallDetail.objects.filter(
-            source=number
-        ).filter(
-            reference_period=period
-        ).filter(
-            is_completed=True).order_by('started_at')
-
-        serializer = MonthlyBillSerializer(calls, many=True)
+        limit = serializer.validated_data['limit']
+        cursor = serializer.validated_data['cursor']
+
+        if limit or cursor:
+            with timer('lookup'):
+                calls, next_cursor = paginate_bill(
+                    bill_calls(number, period, archive_file(period)), cursor,
+                    limit or settings.BILL_PAGE_MAX_LIMIT)
+            with timer('serialization'):
+                call_records = MonthlyBillSerializer(calls, many=True).data
+            return Response(
+                {
+                    'number': number,
+                    'period': period,
+                    'call_records': call_records,
+                    'next_cursor': next_cursor
+                },
+                status=status.HTTP_200_OK)
+
+        with timer('lookup'):
+            bill = MonthlyBill.objects.filter(
+                number=number, period=period).first()
+            # The version read, to only cache the bill if it is unchanged
+            version = bill.version if bill else None
+            if bill and not bill.call_records:
+                bill = None
+            if bill:
+                summary = json.loads(bill.summary)
+            else:
+                archive = archive_file(period)
+                calls = bill_calls(number, period, archive)
+                summary = BillSummarySerializer(calls.summary()).data
+
+        # Return only the totals, without the call records
+        if request.query_params.get('summary_only') == 'true':
+            return Response(
+                {
+                    'number': number,
+                    'period': period,
+                    'summary': summary
+                },
+                status=status.HTTP_200_OK)
+
+        if bill:
+            call_records = json.loads(bill.call_records)
+        elif request.query_params.get('stream') == 'true':
+            # Large bills are rendered while sent, without being cached
+            return StreamingHttpResponse(
+                stream_bill(number, period, summary, calls,
+                            settings.BILL_STREAM_CHUNK_SIZE),
+                content_type='application/json',
+                status=status.HTTP_200_OK)
+        else:
+            with timer('serialization'):
+                call_records = render_call_records(calls)
+
+            # Only closed periods are accepted, so the bill can be cached,
+            # unless the period was archived meanwhile: calls read from the
+            # database and from the new file could be counted twice. Bills
+            # without calls are not, not to store a row per number asked
+            if call_records and archive_file(period) == archive:
+                with timer('save'):
+                    MonthlyBill.objects.cache(
+                        number, period, version, json.dumps(call_records),
+                        json.dumps(summary))
+
         return Response(
             {
                 'number': number,
                 'period': period,
-                'call_records': serializer.data
+                'summary': summary,
+                'call_records': call_records
             },
             status=status.HTTP_200_OK)
 
     # Save a call detail from a Start Call Record or End Call Record
     if request.method == 'POST':
+        with timer('validation'):
+            validated_data, errors = validate_call_record(request.data)
+        if errors:
+            return Response(errors, status=status.HTTP_400_BAD_REQUEST)
+
+        if settings.INGEST_QUEUE:
+            with timer('save'):
+                enqueue_records([request.data])
+            return Response({}, status=status.HTTP_202_ACCEPTED)
+
+        # Merge the record into the call with a single statement
         try:
-            call = CallDetail.objects.get(call_id=request.data.get('call_id'))
-            serializer = CallDetailSerializer(call, data=request.data)
-        except CallDetail.DoesNotExist:
-            serializer = CallDetailSerializer(data=request.data)
+            with timer('save'):
+                call = upsert_record(request.data['type'], validated_data)
+        except ValidationError as exc:
+            return Response(exc.detail, status=status.HTTP_400_BAD_REQUEST)
+
+        if call:
+            return Response({}, status=status.HTTP_204_NO_CONTENT)
+
+        # Repeated records, or databases without upsert support. A call
+        # inserted by a concurrent request in between is merged on a retry
+        try:
+            return save_call_record(request.data, validated_data)
+        except IntegrityError:
+            return save_call_record(request.data, validated_data)
+
+
+def save_call_record(data, validated_data):
+    """
+    Save a call record with CallDetailSerializer, locking its call. The record
+    was already validated, only its order against the saved call is checked.
+    """
+    with transaction.atomic():
+        with timer('lookup'):
+            lock_calls([validated_data['call_id']])
+            call = CallDetail.objects.select_for_update().filter(
+                call_id=validated_data['call_id']).first()
+        serializer = CallDetailSerializer(call, data=data)
 
-        if serializer.is_valid():
-            serializer.save()
+        if serializer.instance is None:
+            with timer('save'):
+                serializer.create(validated_data)
             return Response({}, status=status.HTTP_204_NO_CONTENT)
+
+        with timer('validation'):
+            errors = validate_call_order(
+                serializer.instance, data['type'], validated_data)
+        if errors:
+            return Response(errors, status=status.HTTP_400_BAD_REQUEST)
+
+        with timer('save'):
+            serializer.update(serializer.instance, validated_data)
+    return Response({}, status=status.HTTP_204_NO_CONTENT)
+
+
+@api_view(['POST'])
+@parser_classes([JSONParser, NDJSONParser])
+def calls_batch(request):
+    """Create/update calls from a batch of Start and End Call Records."""
+    records = request.data
+    if not isinstance(records, list):
+        return Response({'records': 'records must be a list.'},
+                        status=status.HTTP_400_BAD_REQUEST)
+
+    if settings.INGEST_QUEUE:
+        with timer('validation'):
+            valid, errors = validate_records(records)
+        with timer('save'):
+            enqueue_records([records[index] for index, _, _ in valid])
+        return Response({'queued': len(valid), 'errors': errors},
+                        status=status.HTTP_202_ACCEPTED)
+
+    with timer('save'):
+        saved, errors = ingest_records(records)
+    return Response({'saved': saved, 'errors': errors},
+                    status=status.HTTP_200_OK)
+
+
+def token_required(setting):
+    """
+    Serve a view only to requests with the bearer token of a setting, the
+    view is disabled while the setting is empty.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            token = getattr(settings, setting)
+            if not token:
+                raise Http404
+            authorization = request.META.get('HTTP_AUTHORIZATION', '')
+            if not hmac.compare_digest(authorization.encode(),
+                                       'Bearer {}'.format(token).encode()):
+                response = HttpResponse(status=status.HTTP_401_UNAUTHORIZED)
+                response['WWW-Authenticate'] = 'Bearer'
+                return response
+            return view(request, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@token_required('EXPORT_TOKEN')
+@api_view(['GET'])
+def calls_export(request):
+    """Export the completed calls of every subscriber in a period."""
+    serializer = BillExportSerializer(data=request.query_params)
+
+    if not serializer.is_valid():
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    period = serializer.data['period']
+    output = serializer.data['output']
+
+    response = StreamingHttpResponse(
+        export_calls(period, output, settings.BILL_STREAM_CHUNK_SIZE),
+        content_type=EXPORT_CONTENT_TYPES[output],
+        status=status.HTTP_200_OK)
+    response['Content-Disposition'] = 'attachment; filename="{}.{}"'.format(
+        period.replace('/', '-'), output)
+    return response
+
+
+@token_required('METRICS_TOKEN')
+def metrics(request):
+    """Expose the request metrics of every process to Prometheus."""
+    depth, age = queue_lag()
+    content = (
+        render_metrics() +
+        format_gauge('calldetails_queue_depth',
+                     'Call records waiting to be saved.', depth) +
+        format_gauge('calldetails_queue_lag_seconds',
+                     'Age of the oldest queued call record.', age))
+    return HttpResponse(
+        content, content_type='text/plain; version=0.0.4; charset=utf-8')